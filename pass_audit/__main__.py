@@ -17,13 +17,22 @@
 #
 
 import os
+import itertools
 import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from argparse import ArgumentParser, RawDescriptionHelpFormatter
 
 from pass_audit import __version__
-from pass_audit.audit import PassAudit
+from pass_audit.audit import ZXCVBN, PassAudit, StrongFilter
 from pass_audit.msg import Msg
-from pass_audit.passwordstore import PasswordStore, PasswordStoreError
+from pass_audit.passwordstore import (PasswordStore, PasswordStoreError,
+                                      PasswordStores)
+from pass_audit.pwned import (PwnedAPI, PwnedCache, PwnedFile, PwnedFilter,
+                              PwnedIndex)
+from pass_audit.report import reports
+from pass_audit.state import AuditState
+from pass_audit.stats import stats
 
 
 class ArgParser(ArgumentParser):
@@ -33,7 +42,8 @@ class ArgParser(ArgumentParser):
         description = """
  A pass extension for auditing your password repository. It supports safe
  breached password detection from haveibeenpwned.com using K-anonymity method,
- duplicated passwords, and password strength estimation using zxcvbn."""
+ duplicated and similar passwords, and password strength estimation using
+ zxcvbn."""
         epilog = "More information may be found in the pass-audit(1) man page."
 
         super().__init__(prog='pass audit',
@@ -46,15 +56,102 @@ class ArgParser(ArgumentParser):
 
     def add_arguments(self):
         """Set arguments."""
-        self.add_argument('paths', type=str, nargs='?', metavar='pass-names',
-                          default='', help="""Path(s) to audit in the password
-                          store, If empty audit the full store.""")
+        self.add_argument('paths', type=str, nargs='*', metavar='pass-names',
+                          default=[''], help="""Path(s) to audit in the
+                          password store, If empty audit the full store.""")
 
         self.add_argument('-V', '--version', action='version',
                           version='%(prog)s ' + __version__,
                           help='Show the program version and exit.')
         self.add_argument('-n', '--name', type=str, default="*",
                           help="""Check only passwords with this filename""")
+        self.add_argument('-j', '--jobs', type=int,
+                          default=os.cpu_count() or 1,
+                          help="""Number of passwords to decrypt and check
+                          in parallel, default to the number of CPUs.""")
+        self.add_argument('--backend', choices=PasswordStore.backends,
+                          default='pass', help="""Decryption backend: pass,
+                          gpg to call GnuPG directly or gpgme to decrypt
+                          in-process, default to pass.""")
+        self.add_argument('--store', action='append', default=[],
+                          metavar='[NAME=]PATH', help="""Also audit the
+                          password store in PATH, can be used more than once.
+                          The paths are then qualified with the name of their
+                          store, default to the name of its directory.""")
+        self.add_argument('--checks', type=self.split,
+                          default=list(PassAudit.checks), help="""Comma
+                          separated checks to run: breach, strength and
+                          duplicates, default to all of them.""")
+        self.add_argument('--skip', type=self.split, default=[],
+                          metavar='CHECKS', help="""Comma separated checks
+                          not to run.""")
+        self.add_argument('-i', '--incremental', action='store_true',
+                          help="""Only audit the passwords that are new or
+                          changed since the previous incremental audit.""")
+        self.add_argument('--fast-entropy', type=float, default=60,
+                          metavar='BITS', help="""Do not run zxcvbn on the
+                          passwords with at least this entropy that are
+                          certainly strong, 0 to disable, default to 60.""")
+        self.add_argument('--zxcvbn-timeout', type=float, default=2,
+                          metavar='SECONDS', help="""CPU time budget of
+                          zxcvbn per password, 0 for no limit, default to
+                          2.""")
+        self.add_argument('--zxcvbn-max-length', type=int, default=72,
+                          metavar='N', help="""Do not check the strength of
+                          the longer passwords, default to 72.""")
+        self.add_argument('--hibp-workers', type=int, default=8,
+                          metavar='N', help="""Maximum number of concurrent
+                          requests to haveibeenpwned.com, default to 8.""")
+        self.add_argument('--no-cache', action='store_true',
+                          help="""Do not cache the buckets retrieved from
+                          haveibeenpwned.com.""")
+        self.add_argument('--cache-ttl', type=float, default=24,
+                          metavar='HOURS', help="""Time a cached bucket is
+                          used before being revalidated, default to 24
+                          hours.""")
+        self.add_argument('--cache-size', type=int, default=256,
+                          metavar='MB', help="""Maximum size of the cache,
+                          default to 256 MB.""")
+        hibp = self.add_mutually_exclusive_group()
+        hibp.add_argument('--hibp-file', type=str, metavar='PATH',
+                          help="""Offline mode, check the breached passwords
+                          against a local Pwned Passwords SHA-1 file (ordered
+                          by hash) instead of haveibeenpwned.com.""")
+        hibp.add_argument('--hibp-index', type=str, metavar='PATH',
+                          help="""Offline mode, check the breached passwords
+                          against a binary index built with --build-index.""")
+        hibp.add_argument('--hibp-url', type=str, metavar='URL',
+                          help="""Base URL of the Pwned Passwords API, such as
+                          a local server started with pass audit
+                          serve-ranges, default to
+                          https://api.pwnedpasswords.com.""")
+        self.add_argument('--hibp-filter', type=str, metavar='PATH',
+                          help="""Only look up the passwords that might be
+                          breached according to a filter built with
+                          --build-filter.""")
+        self.add_argument('--build-index', type=str, metavar='PATH',
+                          help="""Build a binary index of the Pwned Passwords
+                          file given with --hibp-file and exit.""")
+        self.add_argument('--build-filter', type=str, metavar='PATH',
+                          help="""Build a filter of the Pwned Passwords file
+                          or index given with --hibp-file or --hibp-index and
+                          exit.""")
+        self.add_argument('--fp-rate', type=float, default=0.01,
+                          metavar='RATE', help="""False positive rate of the
+                          filter built with --build-filter, default to
+                          0.01.""")
+        self.add_argument('--format', choices=tuple(reports),
+                          default='text', help="""Output format of the
+                          findings: text, json for a JSON document or ndjson
+                          for a JSON record per line as soon as the finding
+                          is known, default to text.""")
+        self.add_argument('--with-passwords', action='store_true',
+                          help="""Include the plaintext passwords in the json
+                          and ndjson findings.""")
+        self.add_argument('--stats', action='store_true',
+                          help="""Report the time spent in every stage of the
+                          audit, the number of subprocesses, HTTP requests,
+                          bytes received and cache hits.""")
         group = self.add_mutually_exclusive_group()
         group.add_argument('-v', '--verbose', action='count', default=0,
                            help='Set verbosity level, '
@@ -62,91 +159,354 @@ class ArgParser(ArgumentParser):
         group.add_argument('-q', '--quiet', action='store_true',
                            help='Be quiet.')
 
+    @staticmethod
+    def split(value):
+        """Split a comma separated list of checks."""
+        return [check.strip() for check in value.split(',') if check.strip()]
+
+
+def select_checks(msg, checks, skip):
+    """Get the checks to run, without the skipped ones."""
+    for check in checks + skip:
+        if check not in PassAudit.checks:
+            msg.die(f"invalid check: {check}, use "
+                    f"{', '.join(PassAudit.checks)}.")
+    checks = [check for check in checks if check not in skip]
+    if not checks:
+        msg.die("no check to run.")
+    return checks
+
 
 def setup():
     """Read program arguments & sanity checks."""
     parser = ArgParser()
     arg = parser.parse_args(sys.argv)
-    msg = Msg(arg.verbose, arg.quiet)
+    msg = Msg(arg.verbose, arg.quiet, arg.format != 'text')
 
     if not parser.passwordstore:
         msg.die("not running inside password-store.")
+    if arg.jobs < 1:
+        msg.die(f"invalid number of jobs: {arg.jobs}.")
+    if arg.fast_entropy < 0:
+        msg.die(f"invalid entropy: {arg.fast_entropy}.")
+    if arg.zxcvbn_timeout < 0:
+        msg.die(f"invalid timeout: {arg.zxcvbn_timeout}.")
+    if arg.zxcvbn_max_length < 1:
+        msg.die(f"invalid maximum length: {arg.zxcvbn_max_length}.")
+    if arg.hibp_workers < 1:
+        msg.die(f"invalid number of workers: {arg.hibp_workers}.")
+    arg.checks = select_checks(msg, arg.checks, arg.skip)
+    if arg.build_index and not arg.hibp_file:
+        msg.die("--build-index requires a Pwned Passwords file (--hibp-file).")
+    if arg.build_filter and not (arg.hibp_file or arg.hibp_index):
+        msg.die("--build-filter requires a Pwned Passwords file or index "
+                "(--hibp-file, --hibp-index).")
+
+    return msg, arg
+
+
+def build_index(msg, arg):
+    """Build a binary index of the Pwned Passwords file."""
+    msg.message(f"Building {arg.build_index} - this may take some time")
+    try:
+        total = PwnedIndex.build(arg.hibp_file, arg.build_index)
+    except (OSError, ValueError) as error:
+        msg.die(f"impossible to build {arg.build_index}: {error}")
+    msg.success(f"{total} breached passwords indexed in {arg.build_index}.")
+
+
+def build_filter(msg, arg):
+    """Build a filter of the Pwned Passwords file or index."""
+    source = pwned_open(msg, arg)
+    msg.message(f"Building {arg.build_filter} - this may take some time")
+    try:
+        size = PwnedFilter.build(source, arg.build_filter, arg.fp_rate)
+    except (OSError, ValueError) as error:
+        msg.die(f"impossible to build {arg.build_filter}: {error}")
+    msg.success(f"{len(source)} breached passwords filtered in "
+                f"{arg.build_filter} ({size} bytes).")
+
 
-    if arg.paths == '':
+def pwned_open(msg, arg):
+    """Get the lookup backend for the breached passwords."""
+    if arg.hibp_index:
+        path, backend = arg.hibp_index, PwnedIndex
+    elif arg.hibp_file:
+        path, backend = arg.hibp_file, PwnedFile
+    else:
+        cache = None
+        if not arg.no_cache:
+            try:
+                cache = PwnedCache(ttl=arg.cache_ttl * 3600,
+                                   size=arg.cache_size * 2**20)
+            except OSError as error:
+                msg.warning(f"impossible to use the cache: {error}")
+        return PwnedAPI(arg.hibp_url, workers=arg.hibp_workers, cache=cache)
+
+    source = None
+    try:
+        source = backend(path)
+    except (OSError, ValueError) as error:
+        msg.die(f"impossible to read {path}: {error}")
+    return source
+
+
+def prefilter_open(msg, arg):
+    """Get the filter of the breached passwords, if any."""
+    prefilter = None
+    if not arg.hibp_filter:
+        return prefilter
+
+    try:
+        prefilter = PwnedFilter(arg.hibp_filter)
+    except (OSError, ValueError) as error:
+        msg.die(f"impossible to read {arg.hibp_filter}: {error}")
+    return prefilter
+
+
+def pass_open(msg, arg):
+    """Open the password stores and list the paths to audit."""
+    if arg.paths == ['']:
         msg.message("Auditing whole store - this may take some time")
 
-    store = PasswordStore()
-    if not store.exist():
-        msg.die("no password store to audit.")
-    if not store.isvalid():
-        msg.die('invalid user ID, password access aborted.')
+    store = PasswordStore(backend=arg.backend)
+    if store.backend != arg.backend:
+        msg.warning(f"python3-gpg not present, using the {store.backend} "
+                    "backend")
+    stores = {PasswordStores.name(store.prefix): store}
+    for option in arg.store:
+        name, prefix = '', option
+        if '=' in option:
+            name, prefix = option.split('=', 1)
+        prefix = os.path.expanduser(prefix)
+        if not name:
+            name = PasswordStores.name(prefix)
+        if name in stores or PasswordStores.separator in name:
+            msg.die(f"invalid store name: {name}, use --store NAME=PATH.")
+        stores[name] = PasswordStore(prefix, arg.backend)
 
-    paths = store.list(arg.paths, arg.name)
-    if not paths:
-        msg.die(f"{arg.paths} is not in the password store.")
+    # The .gpg-id files above the pass-names are checked now, the ones of
+    # their subfolders as the folders are listed.
+    for pstore in stores.values():
+        where = f" in {pstore.prefix}" if arg.store else ''
+        if not pstore.exist():
+            msg.die(f"no password store to audit{where}.")
+        with stats.stage('keyring'):
+            valid = pstore.isvalid(paths=arg.paths, nested=False)
+        if not valid:
+            msg.die(f"invalid user ID{where}, password access aborted.")
+    if arg.store:
+        store = PasswordStores(stores)
 
-    return msg, store, paths
+    def walk(paths):
+        while True:
+            try:
+                with stats.stage('list'):
+                    path = next(paths, None)
+            except PasswordStoreError as error:
+                msg.die(f"{error}, password access aborted.")
+            if path is None:
+                return
+            yield path
 
+    # The paths are listed while the first ones are decrypted.
+    paths = walk(store.walk(arg.paths, arg.name, valid=True))
+    first = next(paths, None)
+    if first is None:
+        msg.die(f"{' '.join(arg.paths)} is not in the password store.")
 
-def pass_read(msg, store, paths):
-    """Read data from the password store."""
-    msg.verbose("Reading the password store")
-    data = {}
-    for path in paths:
+    return store, itertools.chain([first], paths)
+
+
+def pass_read(msg, store, paths, jobs=1):
+    """Read data from the password store.
+
+    The passwords are decrypted by a pool of ``jobs`` workers, the ``(path,
+    entry)`` pairs are yielded in the same order than ``paths``. At most
+    ``2 * jobs`` passwords are decrypted ahead of the consumer.
+    """
+
+    def show(path):
         try:
-            msg.verbose(f"Reading {path}")
-            data[path] = store.show(path)
+            return store.show(path), None
         except PasswordStoreError as error:
-            msg.warning(
-                f"Impossible to read {path} from the password store: {error}")
-    return data
+            return None, error
+
+    def read(path, future):
+        entry, error = future.result()
+        msg.verbose(f"Reading {path}")
+        if error is None:
+            yield path, entry
+        else:
+            msg.warning(f"Impossible to read {path} from the password "
+                        f"store: {error}")
+
+    msg.verbose("Reading the password store")
+    window = deque()
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        for path in paths:
+            window.append((path, executor.submit(show, path)))
+            if len(window) > 2 * jobs:
+                yield from read(*window.popleft())
+        while window:
+            yield from read(*window.popleft())
+
+
+def serve_ranges(argv):
+    """Serve the ranges of a local Pwned Passwords file or index."""
+    # pylint: disable=import-outside-toplevel
+    from pass_audit.server import RangeServer  # asyncio is only needed here
+    parser = ArgumentParser(prog='pass audit serve-ranges',
+                            description="""Answer the /range/{prefix}
+                            requests of the Pwned Passwords API from a local
+                            Pwned Passwords file or index, for the audits
+                            started with --hibp-url.""")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--hibp-file', type=str, metavar='PATH',
+                        help="""Local Pwned Passwords SHA-1 file, ordered by
+                        hash.""")
+    source.add_argument('--hibp-index', type=str, metavar='PATH',
+                        help="""Binary index built with --build-index.""")
+    parser.add_argument('--host', type=str, default='127.0.0.1',
+                        help="""Address to listen on, default to
+                        127.0.0.1.""")
+    parser.add_argument('--port', type=int, default=8080,
+                        help="""Port to listen on, default to 8080.""")
+    parser.add_argument('--cache-size', type=int, default=64, metavar='MB',
+                        help="""Maximum size of the buckets kept in memory,
+                        default to 64 MB.""")
+    parser.add_argument('-v', '--verbose', action='count', default=0,
+                        help='Log the requests.')
+    arg = parser.parse_args(argv)
+    msg = Msg(arg.verbose)
+    if arg.cache_size < 0:
+        msg.die(f"invalid cache size: {arg.cache_size}.")
+
+    server = RangeServer(pwned_open(msg, arg), arg.cache_size * 2**20,
+                         msg=msg)
+    msg.message(f"Serving {arg.hibp_index or arg.hibp_file} on "
+                f"http://{arg.host}:{arg.port}, use --hibp-url to audit "
+                "against it")
+    try:
+        server.serve(arg.host, arg.port)
+    except OSError as error:
+        msg.die(f"impossible to serve on {arg.host}:{arg.port}: {error}")
+
+
+def audit_open(msg, arg):
+    """Set up the audit of the selected checks.
 
+    The API and zxcvbn are only loaded by the checks using them.
+    """
+    api, prefilter = None, None
+    if 'breach' in arg.checks:
+        api = pwned_open(msg, arg)
+        prefilter = prefilter_open(msg, arg)
+    if not ZXCVBN and 'strength' in arg.checks:
+        msg.warning("python3-zxcvbn not present, skipping check")
 
-def zxcvbn_parse(details):
-    """Nicely print the results from zxcvbn."""
-    sequence = ''
-    for seq in details.get('sequence', []):
-        sequence += f"{seq['token']}({seq['pattern']}) "
-    res = f"Score {details['score']} ({details['guesses']} guesses). "
-    return res + f"This estimate is based on the sequence {sequence}"
+    strong = StrongFilter(arg.fast_entropy) if arg.fast_entropy else None
+    verbose = msg.verb if arg.format == 'text' else 0  # stdout is a report
+    return PassAudit({}, verbose, api, prefilter, arg.jobs, strong=strong,
+                     timeout=arg.zxcvbn_timeout,
+                     max_length=arg.zxcvbn_max_length, checks=arg.checks)
+
+
+def state_open(msg, arg, store, paths, report):
+    """Load the state of the previous audit, report its findings.
+
+    :return tuple: The state and the paths new or changed since the
+        previous audit.
+    """
+    state = AuditState(store, checks=arg.checks)
+    state.load()
+    todo = state.changed(paths)
+    msg.verbose(f"Skipping {len(paths) - len(todo)} unchanged passwords")
+    changed = set(todo)
+    unchanged = [path for path in paths if path not in changed]
+    if 'breach' in arg.checks:
+        for path, payload, count in state.breached(unchanged):
+            report.finding('breached', path, payload, count)
+    if 'strength' in arg.checks:
+        for path, payload, details in state.weak(unchanged):
+            report.finding('weak', path, payload, details)
+    return state, todo
+
+
+def state_close(msg, audit, state, paths, report):
+    """Report the duplicates of all the audited paths, save the state.
+
+    The passwords not evaluated in this audit are recorded, the ones of the
+    unchanged paths are reported with them.
+    """
+    for path in audit.unevaluated:
+        state.found('unevaluated', path, None)
+    audit.unevaluated = state.unevaluated(paths)
+    state.prune(paths)
+    if 'duplicates' in audit.checks:
+        for dpaths in state.duplicates(paths):
+            report.finding('duplicated', None, None, dpaths)
+        for spaths in state.similar(paths):
+            report.finding('similar', None, None, spaths)
+    try:
+        state.save()
+    except PasswordStoreError as error:
+        msg.warning(f"Impossible to save the audit state: {error}")
 
 
 def main():
     """pass-audit main function."""
-    msg, store, paths = setup()
+    if sys.argv[:1] == ['serve-ranges']:
+        serve_ranges(sys.argv[1:])
+        return
+    msg, arg = setup()
+    stats.reset()
+    if arg.build_index:
+        build_index(msg, arg)
+        return
+    if arg.build_filter:
+        build_filter(msg, arg)
+        return
 
-    data = pass_read(msg, store, paths)
-    audit = PassAudit(data, msg.verb)
+    store, paths = pass_open(msg, arg)
+    audit = audit_open(msg, arg)
 
-    msg.verbose("Checking for breached passwords")
-    breached = audit.password()
-    for path, payload, count in breached:
-        msg.warning(f"Password breached: {payload} from {path} has"
-                    f" been breached {count} time(s).")
+    # The findings are reported as soon as they are known.
+    report = reports[arg.format](msg, arg.with_passwords or
+                                 arg.format == 'text')
+    state = None
+    todo = paths
+    if arg.incremental:
+        paths = list(paths)
+        state, todo = state_open(msg, arg, store, paths, report)
 
-    msg.verbose("Checking for weak passwords")
-    try:
-        weak = audit.zxcvbn()
-    except ImportError as error:
-        weak = []
-        msg.warning(f"python3-{error.name} not present, skipping check")
-    for path, payload, details in weak:
-        msg.warning(f"Weak password detected: {payload} from {path}"
-                    f" might be weak. {zxcvbn_parse(details)}")
-
-    msg.verbose("Checking for duplicated passwords")
-    duplicated = audit.duplicates()
-    for paths in duplicated:
-        msg.warning(f"Duplicated passwords detected in {', '.join(paths)}")
-
-    if not breached and not weak and not duplicated:
-        msg.success(f"None of the {len(data)} passwords tested are "
-                    "breached, duplicated or weak.")
-    else:
-        msg.error(f"{len(data)} passwords tested and {len(breached)} breached,"
-                  f" {len(weak)} weak passwords found,"
-                  f" {len(duplicated)} duplicated passwords found.")
-        msg.message("You should update them with 'pass update'.")
+    entries = pass_read(msg, store, todo, arg.jobs)
+    if state:
+        entries = state.track(entries)
+    msg.verbose("Checking the passwords")
+    for check, path, payload, result in audit.stream(entries):
+        if state and check in ('duplicated', 'similar'):
+            continue
+        if state:
+            state.found(check, path, result)
+        report.finding(check, path, payload, result)
+    total = len(paths) if state else audit.total
+    if state:
+        state_close(msg, audit, state, paths, report)
+
+    if audit.unevaluated:
+        report.unevaluated(audit.unevaluated)
+    if audit.strong:
+        msg.verbose(f"{audit.strong.skipped} strong passwords not checked "
+                    "with zxcvbn")
+    msg.verbose(f"zxcvbn cache: {audit.cache.hits} hits, "
+                f"{audit.cache.misses} misses")
+
+    if arg.stats:
+        stats.count('zxcvbn_cache_hits', audit.cache.hits)
+        stats.count('zxcvbn_cache_misses', audit.cache.misses)
+        report.stats(stats.asdict())
+    report.summary(total)
 
 
 if __name__ == "__main__":
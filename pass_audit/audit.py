@@ -4,111 +4,776 @@
 #
 
 import os
+import sys
+import math
+import signal
 import hashlib
+import functools
+import threading
+import multiprocessing
+from collections import OrderedDict, deque
+from concurrent.futures import (Future, ProcessPoolExecutor,
+                                ThreadPoolExecutor)
+from importlib.util import find_spec
 
-import requests
-try:
-    from zxcvbn import zxcvbn
-    ZXCVBN = True
-except ImportError:
-    ZXCVBN = False
+from pass_audit.duplicates import DuplicateIndex
+from pass_audit.pwned import PwnedAPI
+from pass_audit.stats import stats
 
-from pass_audit import __version__
+# zxcvbn is only imported when the strength of a password is estimated.
+ZXCVBN = find_spec('zxcvbn') is not None
 
+# The virtual timer of the CPU time budget is not available on Windows.
+TIMER = hasattr(signal, 'setitimer')
 
-class PwnedAPI():
-    """Simple wrapper for https://haveibeenpwned.com API."""
 
-    def __init__(self):
-        self.headers = {'user-agent': f"pass-audit/{__version__}"}
+class StrengthTimeout(Exception):
+    """The strength estimation of a password is over its time budget."""
 
-    def password_range(self, prefix):
-        """Query the haveibeenpwned API to retrieve the bucket ``prefix``."""
-        url = f"https://api.pwnedpasswords.com/range/{prefix}"
-        res = requests.get(url, headers=self.headers, verify=True)
-        res.raise_for_status()
 
-        hashes = []
-        counts = []
-        for item in res.text.split('\r\n'):
-            (partialhash, count) = item.split(':')
-            hashes.append(prefix + partialhash)
-            counts.append(int(count))
-        return (hashes, counts)
+def _expired(signum, frame):
+    """Interrupt zxcvbn when its CPU time budget is over."""
+    raise StrengthTimeout()
+
+
+def _zxcvbn(password, user_input):
+    """Run zxcvbn, recent versions refuse passwords over 72 characters."""
+    from zxcvbn import zxcvbn  # pylint: disable=import-outside-toplevel
+    try:
+        return zxcvbn(password, user_inputs=user_input)
+    except ValueError:
+        return None
+
+
+def _hash(password):
+    """Get the SHA-1 hash of a password, as used by haveibeenpwned.com."""
+    return hashlib.sha1(password.encode("utf8")).hexdigest().upper()
+
+
+def _inputs(path, entry):
+    """Get the user inputs zxcvbn penalizes in the password of entry."""
+    user_input = list(entry.values()) + path.split(os.sep)
+    if entry['password'] in user_input:
+        user_input.remove(entry['password'])
+    return user_input
+
+
+def strength(item, timeout=0, max_length=72):
+    """Estimate the strength of a password with zxcvbn.
+
+    The CPU time budget relies on a virtual timer counting the CPU time of the
+    whole process, it is only enforced in the main thread of a process, and
+    not on Windows.
+
+    :param tuple item: The password and the user inputs to penalize.
+    :param float timeout: CPU time budget in seconds, 0 for no limit.
+    :param int max_length: Do not estimate the longer passwords.
+    :return dict: The zxcvbn results, ``None`` if it cannot be estimated.
+    """
+    password, user_input = item
+    if len(password) > max_length:
+        return None
+    if not timeout or not TIMER or (
+            threading.current_thread() != threading.main_thread()):
+        return _zxcvbn(password, user_input)
+
+    previous = signal.signal(signal.SIGVTALRM, _expired)
+    try:
+        signal.setitimer(signal.ITIMER_VIRTUAL, timeout)
+        try:
+            results = _zxcvbn(password, user_input)
+        finally:
+            signal.setitimer(signal.ITIMER_VIRTUAL, 0)
+    except StrengthTimeout:
+        results = None
+    finally:
+        signal.signal(signal.SIGVTALRM, previous)
+    return results
+
+
+def strengths(items, timeout=0, max_length=72):
+    """Estimate the strength of a chunk of passwords with zxcvbn."""
+    return [strength(item, timeout, max_length) for item in items]
+
+
+def _pool(processes):
+    """Start the processes estimating the strength of the passwords.
+
+    The audit already runs the threads decrypting and looking up the
+    passwords, a forked process could inherit a lock held by one of them.
+    The processes are started by a fork server, or spawned, when the start
+    method can be given (python >= 3.7).
+    """
+    if sys.version_info < (3, 7):
+        return ProcessPoolExecutor(max_workers=processes)
+    methods = multiprocessing.get_all_start_methods()
+    method = 'forkserver' if 'forkserver' in methods else 'spawn'
+    return ProcessPoolExecutor(max_workers=processes,
+                               mp_context=multiprocessing.get_context(method))
+
+
+class StrengthCache():
+    """Bounded LRU cache of the zxcvbn results.
+
+    The results are indexed by the digest of the password and the user inputs
+    that can change them: the ones that may be found in the password, as a
+    word, reversed or with l33t substitutions, with their rank. Thus, the same
+    password in different entries is usually estimated only once.
+
+    :param int size: Maximum number of results kept.
+
+    """
+    _l33t = None
+
+    def __init__(self, size=4096):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        """Get the number of results kept."""
+        return len(self._entries)
+
+    def __getitem__(self, key):
+        """Get the results of a key, count the hits and misses."""
+        try:
+            result = self._entries[key]
+        except KeyError:
+            self.misses += 1
+            raise
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return result
+
+    def __setitem__(self, key, result):
+        """Keep the results of a key, evict the least recently used."""
+        self._entries[key] = result
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    @classmethod
+    def l33t(cls):
+        """Get the letters a character may substitute, as in zxcvbn."""
+        if cls._l33t is None:
+            # pylint: disable=import-outside-toplevel
+            from zxcvbn.matching import L33T_TABLE
+            cls._l33t = {char: {letter for letter, subs in L33T_TABLE.items()
+                                if char in subs}
+                         for subs in L33T_TABLE.values() for char in subs}
+        return cls._l33t
+
+    @classmethod
+    def found(cls, password, word):
+        """Check if word may be matched by zxcvbn in the password."""
+        if word in password:
+            return True
+        l33t = cls.l33t()
+        for start in range(len(password) - len(word) + 1):
+            for char, letter in zip(password[start:], word):
+                if char != letter and letter not in l33t.get(char, ()):
+                    break
+            else:
+                return True
+        return False
+
+    @classmethod
+    def key(cls, password, user_input):
+        """Get the key of the zxcvbn results of a password."""
+        # zxcvbn lowercases the user inputs and ranks them by their last
+        # position, only the ranks of the relevant ones are kept in the key.
+        ranks = {}
+        for rank, word in enumerate(user_input, 1):
+            if not isinstance(word, (str, bytes)):
+                word = str(word)
+            ranks[word.lower()] = rank
+
+        lower = password.lower()
+        reverse = ''.join(reversed(password)).lower()
+        relevant = []
+        for word, rank in ranks.items():
+            if isinstance(word, str) and word != '':
+                if cls.found(lower, word) or cls.found(reverse, word):
+                    relevant.append((word, rank))
+        digest = hashlib.sha256(password.encode()).digest()
+        return digest, tuple(sorted(relevant))
+
+
+class StrongFilter():
+    """Conservative fast path of the zxcvbn strength estimation.
+
+    A password is certainly strong (zxcvbn score of 3 or more) if it has
+    ``n >= max(9, T + 7, 2T + 1)`` characters, where ``T`` is the length of
+    the longest token zxcvbn could match as a pattern. In this case, any
+    sequence of patterns zxcvbn may find is estimated to more than 10^8
+    guesses: three patterns or more already cost 10^8 guesses, one or two
+    patterns leave at least 7 characters to bruteforce.
+
+    ``T`` is bounded cheaply: the longest substring made of trigrams found in
+    the dictionaries (as is, reversed or with l33t substitutions), the longest
+    user input found in the password, the longest keyboard walk, repetition,
+    sequence or run of date characters. Only ASCII passwords whose entropy
+    (length times the log2 of their charset size) is above the threshold are
+    considered.
+
+    :param int bits: Minimum entropy of a password considered without zxcvbn.
+
+    """
+    _grams = None
+    _walks = None
+
+    def __init__(self, bits=60):
+        self.bits = bits
+        self.skipped = 0
+
+    @classmethod
+    def _tables(cls):
+        """Build the trigrams of the dictionaries and the keyboard walks."""
+        if cls._grams is None:
+            # pylint: disable=import-outside-toplevel
+            from zxcvbn.adjacency_graphs import ADJACENCY_GRAPHS
+            from zxcvbn.matching import RANKED_DICTIONARIES
+            grams = set()
+            for name, words in RANKED_DICTIONARIES.items():
+                if name == 'user_inputs':
+                    continue
+                for word in words:
+                    for index in range(len(word) - 2):
+                        gram = word[index:index + 3]
+                        grams.add(gram)
+                        grams.add(gram[::-1])
+            walks = set()
+            for graph in ADJACENCY_GRAPHS.values():
+                for key, adjacents in graph.items():
+                    for adjacent in adjacents:
+                        for char in adjacent or '':
+                            walks.add((key, char))
+            cls._grams, cls._walks = grams, walks
+        return cls._grams, cls._walks
+
+    @staticmethod
+    def _run(flags, gap=0):
+        """Get the length of the longest run of true flags, plus gap."""
+        longest = run = 0
+        for flag in flags:
+            run = run + 1 if flag else 0
+            longest = max(longest, run)
+        return longest + gap if longest else 0
+
+    @classmethod
+    def entropy(cls, password):
+        """Get the length times charset entropy of a password."""
+        size = 0
+        size += 26 if any(char.islower() for char in password) else 0
+        size += 26 if any(char.isupper() for char in password) else 0
+        size += 10 if any(char.isdigit() for char in password) else 0
+        size += 33 if not password.isalnum() else 0
+        return len(password) * math.log2(size) if size else 0
+
+    @classmethod
+    def _dictionaries(cls, lower, grams):
+        """Bound the dictionary words, any char may be a l33t substitution."""
+        l33t = StrengthCache.l33t()
+        options = [{char} | l33t.get(char, set()) for char in lower]
+        flags = []
+        for index in range(len(lower) - 2):
+            flags.append(any(a + b + c in grams for a in options[index]
+                             for b in options[index + 1]
+                             for c in options[index + 2]))
+        return cls._run(flags, 2)
+
+    @staticmethod
+    def _user_inputs(lower, user_input, span=0):
+        """Get the longest user input found in the password, over span."""
+        for word in user_input:
+            if not isinstance(word, bytes):
+                word = str(word).lower()
+                if len(word) > span and (
+                        StrengthCache.found(lower, word) or
+                        StrengthCache.found(lower[::-1], word)):
+                    span = len(word)
+        return span
+
+    @classmethod
+    def _patterns(cls, password, walks):
+        """Bound the keyboard walks, sequences and repetitions."""
+        # pylint: disable=import-outside-toplevel
+        from zxcvbn.matching import MAX_DELTA
+        size = len(password)
+        pairs = list(zip(password, password[1:]))
+        span = cls._run((pair in walks for pair in pairs), 1)
+        deltas = [ord(b) - ord(a) for a, b in pairs]
+        for delta in set(deltas):
+            if 0 < abs(delta) <= MAX_DELTA:
+                span = max(span, cls._run(
+                    (value == delta for value in deltas), 1))
+        for period in range(1, size // 2 + 1):
+            run = cls._run(password[index] == password[index + period]
+                           for index in range(size - period))
+            if run >= period:
+                span = max(span, run + period)
+        return span
+
+    @classmethod
+    def _dates(cls, password):
+        """Bound the dates and years."""
+        run = cls._run(char.isdigit() or char.isspace() or char in '/\\_.-'
+                       for char in password)
+        return min(run, 10) if run >= 4 else 0
+
+    @classmethod
+    def span(cls, password, user_input):
+        """Get the maximum length of a pattern zxcvbn could find."""
+        grams, walks = cls._tables()
+        lower = password.lower()
+        span = max(2, cls._dictionaries(lower, grams))
+        span = cls._user_inputs(lower, user_input, span)
+        return max(span, cls._patterns(password, walks),
+                   cls._dates(password))
+
+    def isstrong(self, password, user_input):
+        """Check if zxcvbn would certainly find the password strong."""
+        if not self.bits or any(ord(char) > 127 for char in password):
+            return False
+        if self.entropy(password) < self.bits:
+            return False
+        size = len(password)
+        span = self.span(password, user_input)
+        return size >= max(9, span + 7, 2 * span + 1)
 
 
 class PassAudit():
-    """Pass audit main class."""
+    """Pass audit main class.
 
-    def __init__(self, data, verbose):
+    :param dict data: The password entries to audit, indexed by path.
+    :param int verbose: Verbosity level.
+    :param PwnedAPI api: Client used to retrieve the breached passwords.
+    :param PwnedFilter prefilter: Only retrieve the buckets of the passwords
+        that might be breached according to this filter.
+    :param int jobs: Number of processes used to estimate the strength of the
+        passwords. With a time budget, they are estimated in a process even
+        with a single job.
+    :param StrengthCache cache: Cache of the zxcvbn results.
+    :param StrongFilter strong: Do not estimate with zxcvbn the passwords
+        this filter finds certainly strong.
+    :param float timeout: CPU time budget of zxcvbn per password in seconds,
+        0 for no limit.
+    :param int max_length: Do not estimate the longer passwords with zxcvbn.
+    :param list checks: The checks streamed, default to all of them.
+
+    """
+    checks = {
+        'breach': ('breached',),
+        'strength': ('weak',),
+        'duplicates': ('duplicated', 'similar'),
+    }
+
+    def __init__(self, data, verbose, api=None, prefilter=None, jobs=1,
+                 cache=None, strong=None, timeout=0, max_length=72,
+                 checks=None):
+        if checks is not None:
+            self.checks = {check: self.checks[check] for check in checks}
         self.data = data
         self.verbose = verbose
+        self.api = api
+        self.prefilter = prefilter
+        self.jobs = jobs
+        self.cache = StrengthCache() if cache is None else cache
+        self.strong = strong
+        self.timeout = timeout
+        self.max_length = max_length
+        self.unevaluated = []
+        self.total = 0
+
+    def _lookup(self, prefixes):
+        """Look up the hashes grouped by prefix, the buckets are not kept.
+
+        :param dict prefixes: Lists of ``(path, phash, ...)`` by prefix.
+        :yield tuple: The breached hashes records with their count.
+        """
+        if self.api is None:
+            self.api = PwnedAPI()
+        with stats.stage('hibp'):
+            for prefix, bucket in self.api.password_ranges(prefixes):
+                for record in prefixes[prefix]:
+                    count = bucket.count(record[1])
+                    if count:
+                        yield record, count
 
     def password(self):
         """K-anonymity password breach detection on haveibeenpwned.com."""
-        # Generate the list of hashes and prefixes to query.
-        data = []
-        api = PwnedAPI()
-        buckets = {}
+        # Generate the hashes to look up, grouped by prefix.
+        prefixes = {}
         for path, entry in self.data.items():
             if self.verbose:
                 print(f"Getting the prefix of {path}")
             if entry.get('password', '') == '':
                 continue
-            password = entry['password'].encode("utf8")
-            phash = hashlib.sha1(password).hexdigest().upper()  # nosec
-            prefix = phash[0:5]
-            data.append((path, entry, phash, prefix))
-            if prefix not in buckets:
-                buckets[prefix] = api.password_range(prefix)
-
-        # Compare the data and return the breached passwords.
+            with stats.stage('hash'):
+                phash = _hash(entry['password'])
+            if self.prefilter is not None and phash not in self.prefilter:
+                continue
+            prefixes.setdefault(phash[0:5], []).append((path, phash))
+
+        counts = {}
+        for (path, _), count in self._lookup(prefixes):
+            counts[path] = count
+
+        # Return the breached passwords.
         breached = []
-        for path, entry, phash, prefix in data:
-            if phash in buckets[prefix][0]:
-                index = buckets[prefix][0].index(phash)
-                count = buckets[prefix][1][index]
-                breached.append((path, entry.get('password', ''), count))
+        for path, entry in self.data.items():
+            if path in counts:
+                breached.append((path, entry['password'], counts[path]))
         return breached
 
+    @property
+    def processes(self):
+        """Number of processes estimating the strength, 0 to estimate inline.
+
+        The virtual timer of the time budget counts the CPU time of all the
+        threads of a process, the passwords are estimated in a process of
+        their own to not spend the budget decrypting or looking up passwords.
+        """
+        if self.jobs > 1:
+            return self.jobs
+        return 1 if self.timeout and TIMER else 0
+
     def zxcvbn(self):
         """Password strength estimation using Dropbox' zxcvbn."""
         if not ZXCVBN:
             raise ImportError(name='zxcvbn')
+        with stats.stage('zxcvbn'):
+            return self._zxcvbn()
 
-        weak = []
+    def _keys(self):
+        """Get the cache keys of the passwords, and the ones to estimate.
+
+        Only the passwords not certainly strong and not in the cache are
+        estimated, once.
+
+        :return tuple: The ``(path, password, key)`` of the passwords to
+            check, the cached results and the passwords to estimate by key.
+        """
+        keys = []
+        results = {}
+        todo = {}
         for path, entry in self.data.items():
-            if self.verbose:
-                print(f"Checking {path}")
             if entry.get('password', '') == '':
                 continue
             password = entry['password']
-            user_input = list(entry.values()) + path.split(os.sep)
-            if password in user_input:
-                user_input.remove(password)
+            user_input = _inputs(path, entry)
+            if len(password) > self.max_length:  # Not evaluated
+                keys.append((path, password, None))
+                results[None] = None
+                continue
+            if self.strong and self.strong.isstrong(password, user_input):
+                self.strong.skipped += 1
+                continue
+            key = StrengthCache.key(password, user_input)
+            keys.append((path, password, key))
+            if key in results or key in todo:
+                self.cache.hits += 1
+                continue
             try:
-                results = zxcvbn(password, user_inputs=user_input)
-            except ValueError:
-                pass
-            else:
-                if results['score'] <= 2:
-                    weak.append((path, password, results))
+                results[key] = self.cache[key]
+            except KeyError:
+                todo[key] = (password, user_input)
+        return keys, results, todo
+
+    def _zxcvbn(self):
+        """Estimate the strength of the passwords, with the cache."""
+        keys, results, todo = self._keys()
+
+        # The passwords are sent by chunks to the processes, the results are
+        # received in the same order.
+        items = list(todo.values())
+        estimate = functools.partial(strength, timeout=self.timeout,
+                                     max_length=self.max_length)
+        if self.processes and items:
+            chunksize = max(1, len(items) // (self.processes * 4))
+            with _pool(self.processes) as executor:
+                estimates = list(executor.map(estimate, items,
+                                              chunksize=chunksize))
+        else:
+            estimates = map(estimate, items)
+        for key, result in zip(todo, estimates):
+            results[key] = self.cache[key] = result
+
+        weak = []
+        self.unevaluated = []
+        for path, password, key in keys:
+            if self.verbose:
+                print(f"Checking {path}")
+            result = results[key]
+            if result is None:
+                self.unevaluated.append(path)
+            elif result['score'] <= 2:
+                weak.append((path, password, result))
         return weak
 
+    def _index(self):
+        """Index the digests of the passwords."""
+        index = DuplicateIndex()
+        for path, entry in self.data.items():
+            if entry.get('password', '') != '':
+                index.add(path, index.record(entry['password']))
+        return index
+
     def duplicates(self):
         """Check for duplicated passwords."""
-        seen = {}
-        for path, entry in self.data.items():
-            if entry.get('password', '') == '':
-                continue
-            password = entry['password']
-            if password in seen:
-                seen[password].append(path)
+        with stats.stage('duplicates'):
+            return self._index().duplicates()
+
+    def similar(self):
+        """Check for similar, but different, passwords."""
+        with stats.stage('duplicates'):
+            return self._index().similar()
+
+    def stream(self, entries, lookups=64, chunksize=16):
+        """Audit the entries as they come and yield the findings when known.
+
+        Every entry is hashed, checked and dropped: only the salted digests
+        of its password are kept, to find the duplicated and similar
+        passwords. Otherwise, the memory used does not depend on the number
+        of entries but on the size of the batches:
+
+        - The bucket of a prefix is requested as soon as the hash of an entry
+          is known, while the next entries are still decrypted. The entries
+          with the same prefix share the request, a password already checked
+          is not requested again. At most ``lookups`` prefixes are in
+          progress.
+        - The strength estimations are sent by chunks of ``chunksize``
+          passwords to the processes. At most ``2 * jobs`` chunks are in
+          progress.
+
+        Only the selected ``checks`` are run: the API is not used without
+        the ``breach`` check, nor zxcvbn without the ``strength`` one.
+
+        :param iterable entries: ``(path, entry)`` pairs, such as
+            ``data.items()`` or a generator reading the password store.
+        :yield tuple: The findings ``(check, path, password, result)``:
+            ``('breached', path, password, count)`` and ``('weak', path,
+            password, results)`` in the order of the entries, then
+            ``('duplicated', None, None, paths)`` and ``('similar', None,
+            None, paths)``.
+        """
+        self.total = 0
+        self.unevaluated = []
+        dedupe = 'duplicates' in self.checks
+        index = DuplicateIndex()
+        checkers = []
+        if 'breach' in self.checks:
+            checkers.append(BreachPrefetch(self, lookups))
+        if ZXCVBN and 'strength' in self.checks:
+            checkers.append(StrengthEstimator(self, chunksize))
+
+        try:
+            for path, entry in entries:
+                self.total += 1
+                password = entry.get('password', '')
+                if password == '':
+                    continue
+                if dedupe:
+                    with stats.stage('duplicates'):
+                        index.add(path, index.record(password))
+                for checker in checkers:
+                    checker.add(path, entry)
+                    yield from checker.findings()
+            for checker in checkers:
+                yield from checker.findings(block=True)
+        finally:
+            for checker in checkers:
+                checker.shutdown()
+
+        if not dedupe:
+            return
+        with stats.stage('duplicates'):
+            duplicated = index.duplicates()
+            similar = index.similar()
+        for paths in duplicated:
+            yield 'duplicated', None, None, paths
+        for paths in similar:
+            yield 'similar', None, None, paths
+
+
+class BreachPrefetch():
+    """Request the buckets of the passwords as soon as their hash is known.
+
+    The buckets are requested by a pool of threads while the next entries
+    are still read. The entries with the same prefix share the request, a
+    password already checked is not requested again, its count is reused.
+    The breached passwords are released in the order of the entries.
+
+    :param PassAudit audit: The audit, for its API and prefilter.
+    :param int lookups: Maximum number of prefixes in progress.
+
+    """
+
+    def __init__(self, audit, lookups=64):
+        if audit.api is None:
+            audit.api = PwnedAPI()
+        self.audit = audit
+        self.lookups = lookups
+        self.checked = {}
+        self.prefixes = OrderedDict()
+        self._fetcher = ThreadPoolExecutor(
+            max_workers=getattr(audit.api, 'workers', 1))
+
+    def _range(self, prefix):
+        """Retrieve the bucket of a prefix."""
+        with stats.stage('hibp'):
+            return self.audit.api.password_range(prefix)
+
+    def add(self, path, entry):
+        """Request the bucket of a password, unless already in progress."""
+        password = entry['password']
+        with stats.stage('hash'):
+            phash = _hash(password)
+        prefilter = self.audit.prefilter
+        if prefilter is not None and phash not in prefilter:
+            return
+        prefix = phash[0:5]
+        future, records = self.prefixes.get(prefix, (None, []))
+        records.append((path, phash, password))
+        if future is None and phash not in self.checked:
+            future = self._fetcher.submit(self._range, prefix)
+        self.prefixes[prefix] = (future, records)
+
+    def _received(self, block=False):
+        """Remove the oldest prefix, get its bucket and records if received.
+
+        :return tuple: The bucket, ``None`` if not requested, and the
+            records. ``None`` if the bucket is still in progress.
+        """
+        limit = 0 if block else self.lookups
+        prefix = next(iter(self.prefixes))
+        future, records = self.prefixes[prefix]
+        if len(self.prefixes) <= limit and future and not future.done():
+            return None
+        del self.prefixes[prefix]
+        return future.result() if future else None, records
+
+    def findings(self, block=False):
+        """Yield the breached passwords of the buckets received.
+
+        :param bool block: Wait for all the buckets in progress.
+        """
+        while self.prefixes:
+            received = self._received(block)
+            if received is None:
+                break
+            bucket, records = received
+            for path, phash, password in records:
+                if phash not in self.checked:
+                    self.checked[phash] = bucket.count(phash)
+                count = self.checked[phash]
+                if count:
+                    yield 'breached', path, password, count
+
+    def shutdown(self):
+        """Stop the requests threads."""
+        self._fetcher.shutdown()
+
+
+class StrengthEstimator():
+    """Estimate the strength of the passwords as they come.
+
+    The passwords not certainly strong nor in the cache are sent by chunks
+    of ``chunksize`` passwords to the processes of the audit, at most
+    ``2 * jobs`` chunks are in progress. The same password waiting for its
+    estimation is only sent once. The weak passwords are released in the
+    order of the entries.
+
+    :param PassAudit audit: The audit, for its strength settings and cache.
+    :param int chunksize: Number of passwords sent at once to a process.
+
+    """
+
+    def __init__(self, audit, chunksize=16):
+        self.audit = audit
+        self.chunksize = chunksize
+        self._window = deque()
+        self._waiting = {}
+        self._chunk = []
+        self._futures = deque()
+        self._executor = None
+        if audit.processes:
+            self._executor = _pool(audit.processes)
+
+    def add(self, path, entry):
+        """Queue the strength estimation of the password of an entry."""
+        audit = self.audit
+        password = entry['password']
+        user_input = _inputs(path, entry)
+        slot = [path, password, None, False]
+        if len(password) > audit.max_length:  # Not evaluated
+            slot[3] = True
+        elif audit.strong and audit.strong.isstrong(password, user_input):
+            audit.strong.skipped += 1
+            return
+        else:
+            key = StrengthCache.key(password, user_input)
+            if key in self._waiting:
+                audit.cache.hits += 1
+                self._waiting[key].append(slot)
             else:
-                seen[password] = [path]
+                try:
+                    slot[2:] = [audit.cache[key], True]
+                except KeyError:
+                    self._waiting[key] = [slot]
+                    self._chunk.append((key, (password, user_input)))
+        self._window.append(slot)
+
+    def _submit(self, block=False):
+        """Send the chunk to estimate, if full or without processes."""
+        if not self._chunk:
+            return
+        if not block and len(self._chunk) < self.chunksize and self._executor:
+            return
+        keys = [key for key, _ in self._chunk]
+        items = [item for _, item in self._chunk]
+        args = (items, self.audit.timeout, self.audit.max_length)
+        if self._executor:
+            future = self._executor.submit(strengths, *args)
+        else:
+            future = Future()
+            with stats.stage('zxcvbn'):
+                future.set_result(strengths(*args))
+        self._futures.append((future, keys))
+        self._chunk = []
+
+    def _gather(self, block=False):
+        """Gather the estimated chunks, wait for the oldest ones if needed."""
+        limit = 0 if block else 2 * self.audit.jobs
+        futures = self._futures
+        while futures and (len(futures) > limit or futures[0][0].done()):
+            future, keys = futures.popleft()
+            if not future.done():
+                with stats.stage('zxcvbn'):
+                    future.result()
+            for key, result in zip(keys, future.result()):
+                self.audit.cache[key] = result
+                for slot in self._waiting.pop(key):
+                    slot[2:] = [result, True]
+
+    def findings(self, block=False):
+        """Yield the weak passwords estimated at the head of the window.
+
+        :param bool block: Wait for all the estimations in progress.
+        """
+        self._submit(block)
+        self._gather(block)
+        while self._window and self._window[0][3]:
+            path, password, result, _ = self._window.popleft()
+            if self.audit.verbose:
+                print(f"Checking {path}")
+            if result is None:
+                self.audit.unevaluated.append(path)
+            elif result['score'] <= 2:
+                yield 'weak', path, password, result
 
-        duplicated = []
-        for paths in seen.values():
-            if len(paths) > 1:
-                duplicated.append(paths)
-        return duplicated
+    def shutdown(self):
+        """Stop the processes."""
+        if self._executor:
+            self._executor.shutdown()
@@ -0,0 +1,178 @@
+# -*- encoding: utf-8 -*-
+# pass audit - Password Store Extension (https://www.passwordstore.org/)
+# Copyright (C) 2018-2022 Alexandre PUJOL <alexandre@pujol.io>.
+#
+
+import re
+import hmac
+import operator
+import struct
+import hashlib
+import secrets
+
+
+class DuplicateIndex():
+    """Find the duplicated and similar passwords without keeping them.
+
+    For every password, only salted digests are kept:
+
+    - ``digest``: the digest of the password, to find the duplicates.
+    - ``skeleton``: the digest of its normalized form: lower case, with the
+      runs of digits and of symbols collapsed. ``Summer2023!`` and
+      ``summer2024?`` have the same skeleton. The passwords with less than
+      ``skeleton_letters`` letters, such as PIN codes, have no skeleton.
+    - ``signature``: a MinHash signature of the bigrams of the words of the
+      normalized form, to estimate the similarity of two passwords, packed
+      in bytes.
+
+    The similar passwords are found with Locality Sensitive Hashing: the
+    signatures are split in bands and only the passwords with a common band
+    are compared. It does not compare every pair of passwords.
+
+    :param bytes salt: Key of the digests. Default to a random salt.
+    :param float threshold: Minimum similarity of two similar passwords, the
+        estimated Jaccard index of the bigrams of their words.
+
+    """
+    hashes = 64
+    rows = 4
+    bucket = 8
+    letters = 6
+    skeleton_letters = 4
+    _signature = struct.Struct(f'<{hashes}H')
+    _words = re.compile(r'[^\W\d_]{4,}')
+
+    def __init__(self, salt=None, threshold=0.6):
+        if salt is None:
+            salt = secrets.token_bytes(16)
+        self.salt = salt
+        self.threshold = threshold
+        self.paths = {}
+        self.records = {}
+
+    @staticmethod
+    def normalize(password):
+        """Get the normalized form of a password."""
+        chars = []
+        for char in password.lower():
+            if char.isdigit():
+                char = '0'
+            elif not char.isalpha():
+                char = '!'
+            if char in '0!' and chars and chars[-1] == char:
+                continue
+            chars.append(char)
+        return ''.join(chars)
+
+    def _digest(self, data):
+        """Get the salted digest of a string."""
+        return hmac.new(self.salt, data.encode(), hashlib.sha256).hexdigest()
+
+    def signature(self, normal):
+        """Get the MinHash signature of the words of a normalized form.
+
+        The words are the runs of at least four letters, the signature is
+        made of the bigrams of the words surrounded by a separator. Each
+        bigram is hashed once, with the salt, its digest gives its ``hashes``
+        values. The signature is packed in bytes. The passwords with less
+        than ``letters`` letters in words, such as random ones, have no
+        signature.
+        """
+        words = self._words.findall(normal)
+        if sum(map(len, words)) < self.letters:
+            return None
+        grams = set()
+        for word in words:
+            word = f"!{word}!"
+            grams.update(word[index:index + 2]
+                         for index in range(len(word) - 1))
+        values = [self._signature.unpack(hashlib.shake_256(
+            self.salt + gram.encode()).digest(self._signature.size))
+            for gram in grams]
+        return self._signature.pack(*map(min, zip(*values)))
+
+    def record(self, password):
+        """Get the digests of a password."""
+        normal = self.normalize(password)
+        skeleton = None
+        if sum(map(str.isalpha, normal)) >= self.skeleton_letters:
+            skeleton = self._digest(normal)
+        return {
+            'digest': self._digest(password),
+            'skeleton': skeleton,
+            'signature': self.signature(normal),
+        }
+
+    def add(self, path, record):
+        """Index the record of the password of path."""
+        digest = record['digest']
+        if digest in self.paths:
+            self.paths[digest].append(path)
+        else:
+            self.paths[digest] = [path]
+            self.records[digest] = (record['skeleton'], record['signature'])
+
+    def similarity(self, signature, other):
+        """Estimate the similarity of two passwords from their signatures."""
+        return sum(map(operator.eq, self._signature.unpack(signature),
+                       self._signature.unpack(other))) / self.hashes
+
+    def bands(self, signature):
+        """Get the bands of a signature, the keys of its LSH buckets."""
+        width = 2 * self.rows
+        return [(index, signature[start:start + width]) for index, start
+                in enumerate(range(0, len(signature), width))]
+
+    def duplicates(self):
+        """Get the paths of the duplicated passwords."""
+        return [paths for paths in self.paths.values() if len(paths) > 1]
+
+    def similar(self):
+        """Get the clusters of paths of similar, but different, passwords.
+
+        A cluster is led by its first password. A password joins the cluster
+        of a previous one with the same skeleton, or, if it has a signature,
+        the cluster of the most similar leader if their similarity is over
+        the threshold, otherwise it leads a new cluster. Every password of a
+        cluster is then similar to its leader, the clusters are not chained
+        through their members. Only the leaders are put in the bands and only
+        the last ``bucket`` leaders of a band are compared to a new password,
+        it bounds the cost of the common bands.
+        """
+        clusters = {}
+        skeletons = {}
+        bands = {}
+        for digest, (skeleton, signature) in self.records.items():
+            if skeleton is None:
+                continue
+            leader = skeletons.get(skeleton)
+            if leader is None and signature is not None:
+                leader = self._leader(signature, bands)
+            if leader is None:
+                leader = digest
+                if signature is not None:
+                    for band in self.bands(signature):
+                        bands.setdefault(band, []).append(digest)
+            skeletons.setdefault(skeleton, leader)
+            clusters.setdefault(leader, []).append(digest)
+
+        similar = []
+        for digests in clusters.values():
+            if len(digests) > 1:
+                similar.append([path for digest in digests
+                                for path in self.paths[digest]])
+        return similar
+
+    def _leader(self, signature, bands):
+        """Get the leader the most similar to a signature, over threshold."""
+        leader, best = None, 0
+        compared = set()
+        for band in self.bands(signature):
+            for other in bands.get(band, [])[-self.bucket:]:
+                if other in compared:
+                    continue
+                compared.add(other)
+                similarity = self.similarity(signature, self.records[other][1])
+                if similarity >= self.threshold and similarity > best:
+                    leader, best = other, similarity
+        return leader
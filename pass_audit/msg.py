@@ -21,17 +21,23 @@ class Msg():
     MAGENTA = '\033[1m\033[95m'
     BOLD = '\033[1m'
 
-    def __init__(self, verbose=0, quiet=False):
+    def __init__(self, verbose=0, quiet=False, stderr=False):
         self.verb = verbose
         self.quiet = quiet
+        self.stderr = stderr
         if self.quiet:
             self.verb = 0
 
+    @property
+    def out(self):
+        """Output of the messages, stderr if stdout is used by a report."""
+        return sys.stderr if self.stderr else sys.stdout
+
     def verbose(self, msg=''):
         """Verbose method."""
         if self.verb >= 1:
             out = f"{self.MAGENTA}  .  {self.end}{self.magenta}{msg}{self.end}"
-            print(out, file=sys.stdout)
+            print(out, file=self.out)
 
     def debug(self, msg=''):
         """Debug method."""
@@ -42,19 +48,19 @@ class Msg():
         """Message method."""
         if not self.quiet:
             out = f"{self.BOLD}  .  {self.end}{msg}"
-            print(out, file=sys.stdout)
+            print(out, file=self.out)
 
     def success(self, msg=''):
         """Success method."""
         if not self.quiet:
             out = f"{self.GREEN} (*) {self.end}{self.green}{msg}{self.end}"
-            print(out, file=sys.stdout)
+            print(out, file=self.out)
 
     def warning(self, msg=''):
         """Warning method."""
         if not self.quiet:
             out = f"{self.YELLOW}  w  {self.end}{self.yellow}{msg}{self.end}"
-            print(out, file=sys.stdout)
+            print(out, file=self.out)
 
     def error(self, msg=''):
         """Error method."""
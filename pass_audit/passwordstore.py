@@ -4,9 +4,18 @@
 #
 
 import os
+import hashlib
+import shlex
 import shutil
+import threading
+from fnmatch import fnmatchcase
+from importlib.util import find_spec
 from subprocess import Popen, PIPE  # nosec
-from pathlib import Path
+
+from pass_audit.stats import stats
+
+# The GPGME bindings are only imported by the gpgme backend.
+GPGME = find_spec('gpg') is not None
 
 
 class PasswordStoreError(Exception):
@@ -19,9 +28,19 @@ class PasswordStore():
     Based on the PasswordStore class from pass-import.
     See https://github.com/roddhjav/pass-import for more information.
 
+    :param str prefix: Path to the password store.
+    :param str backend: Decryption backend: ``pass`` calls the pass script,
+        ``gpg`` calls GnuPG directly on the password files, ``gpgme`` decrypts
+        them in-process with the GPGME bindings. If the bindings are not
+        present, ``gpgme`` falls back to ``gpg``.
+
     """
+    backends = ('pass', 'gpg', 'gpgme')
+    keyrings = ('pubring.kbx', 'pubring.gpg', 'secring.gpg', 'trustdb.gpg',
+                'private-keys-v1.d')
+    keyrings_cached = 32
 
-    def __init__(self, prefix=None):
+    def __init__(self, prefix=None, backend='pass'):
         self._binary = shutil.which('pass')
         self._gpgbinary = shutil.which('gpg2') or shutil.which('gpg')
         self.env = dict(**os.environ)
@@ -45,6 +64,12 @@ class PasswordStore():
             self.prefix = prefix
         if 'PASSWORD_STORE_DIR' not in self.env or self.prefix is None:
             raise PasswordStoreError("pass prefix unknown")
+        if backend not in self.backends:
+            raise PasswordStoreError(f"unknown backend {backend}")
+        if backend == 'gpgme' and not GPGME:
+            backend = 'gpg'
+        self.backend = backend
+        self._local = threading.local()
 
     def _setenv(self, var, env=None):
         """Add var in the environment variables dictionary."""
@@ -57,6 +82,7 @@ class PasswordStore():
         """Call to a command."""
         if isinstance(data, bytes):
             nline = False
+        stats.count('subprocesses')
         with Popen(command, universal_newlines=nline, env=self.env, stdin=PIPE,
                    stdout=PIPE, stderr=PIPE, shell=False) as process:
             (stdout, stderr) = process.communicate(data)
@@ -72,6 +98,79 @@ class PasswordStore():
             raise PasswordStoreError(f"{stderr} {stdout}")
         return stdout
 
+    def _gpgopts(self):
+        """Get the GnuPG options used by pass."""
+        opts = shlex.split(self.env.get('PASSWORD_STORE_GPG_OPTS', ''))
+        opts.extend(['--quiet', '--yes', '--compress-algo=none',
+                     '--no-encrypt-to'])
+        if 'GPG_AGENT_INFO' in self.env or self._gpgbinary.endswith('gpg2'):
+            opts.extend(['--batch', '--use-agent'])
+        return opts
+
+    def passfile(self, path):
+        """Get the password file of path."""
+        return os.path.join(self.prefix, path + '.gpg')
+
+    def _gpg(self, path, nline=True):
+        """Decrypt a password file with GnuPG, with the options of pass."""
+        passfile = self.passfile(path)
+        if not os.path.isfile(passfile):
+            raise PasswordStoreError(f"{path} is not in the password store.")
+        return self.decrypt(passfile, nline)
+
+    def decrypt(self, file, nline=True):
+        """Decrypt any file with GnuPG, with the options of pass."""
+        command = [self._gpgbinary, '--decrypt']
+        command.extend(self._gpgopts())
+        command.extend(['--', file])
+        res, stdout, stderr = self._call(command, nline=nline)
+        if res:
+            raise PasswordStoreError(f"{stderr} {stdout}")
+        return stdout
+
+    def encrypt(self, data, file):
+        """Encrypt data in file to the GPG ids of the store."""
+        command = [self._gpgbinary, '--encrypt']
+        for gpgid in self.gpgids():
+            command.extend(['--recipient', gpgid])
+        command.extend(self._gpgopts())
+        command.extend(['--batch', '--output', file])
+        res, stdout, stderr = self._call(command, data)
+        if res:
+            raise PasswordStoreError(f"{stderr} {stdout}")
+
+    def _gpgme(self, path, nline=True):
+        """Decrypt a password file in-process with GPGME.
+
+        Each thread reuses its own GPGME context as they cannot be shared.
+        """
+        import gpg  # pylint: disable=import-outside-toplevel
+        passfile = self.passfile(path)
+        if not os.path.isfile(passfile):
+            raise PasswordStoreError(f"{path} is not in the password store.")
+
+        context = getattr(self._local, 'context', None)
+        if context is None:
+            context = gpg.Context(home_dir=self.env.get('GNUPGHOME'))
+            self._local.context = context
+        with open(passfile, 'rb') as file:
+            try:
+                plaintext, _, _ = context.decrypt(file, verify=False)
+            except gpg.errors.GpgError as error:
+                raise PasswordStoreError(str(error)) from error
+        if not nline:
+            return plaintext
+        text = plaintext.decode()
+        return text.replace('\r\n', '\n').replace('\r', '\n')
+
+    def _decrypt(self, path, nline=True):
+        """Decrypt path with the selected backend."""
+        if self.backend == 'gpgme':
+            return self._gpgme(path, nline)
+        if self.backend == 'gpg':
+            return self._gpg(path, nline)
+        return self._command(['show', path], nline=nline)
+
     @property
     def prefix(self):
         """Get password store prefix from PASSWORD_STORE_DIR."""
@@ -81,32 +180,90 @@ class PasswordStore():
     def prefix(self, value):
         self.env['PASSWORD_STORE_DIR'] = value
 
+    def _walk(self, folder, filename, folders=False, valid=False):
+        """Walk a folder of the store, hidden and linked folders are skipped.
+
+        The entries of a folder are sorted as their paths would be, so the
+        paths are yielded in order without sorting them all. With folders,
+        the paths of the folders are yielded instead of the password files,
+        starting with the walked folder. With valid, the ``.gpg-id`` file of
+        a folder is checked when the folder is entered.
+        """
+        pattern = None if folders else f'{filename}.gpg'
+        if folders:
+            yield folder
+        gpgid = False
+        try:
+            with os.scandir(os.path.join(self.prefix, folder)) as scan:
+                entries = []
+                for entry in scan:
+                    if entry.name.startswith('.'):
+                        gpgid |= entry.name == '.gpg-id'
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        entries.append((entry.name + os.sep, True))
+                    elif pattern and fnmatchcase(entry.name, pattern):
+                        entries.append((entry.name[:-4], False))
+        except OSError:
+            return
+        if valid and gpgid and not self.isvalid(paths=[folder], nested=False):
+            raise PasswordStoreError(
+                f"invalid user ID in {os.path.join(self.prefix, folder)}")
+        entries.sort()
+        for name, isdir in entries:
+            path = os.path.join(folder, name.rstrip(os.sep))
+            if isdir:
+                yield from self._walk(path, filename, folders, valid)
+            else:
+                yield path
+
+    def walk(self, paths=('',), filename='*', valid=False):
+        """Lazily list the paths of several pass-names of the store.
+
+        A pass-name is a password file or a folder of the store, the paths
+        are yielded as soon as they are found, only once. As with pass, a
+        trailing separator designates the folder when a password file has the
+        same name. With valid, the ``.gpg-id`` files of the folders are
+        checked as they are entered, a PasswordStoreError is raised for an
+        invalid one.
+        """
+        seen = set()
+        for path in paths:
+            path = path.lstrip(os.sep)
+            if os.path.isfile(os.path.join(self.prefix, path + '.gpg')):
+                found = [path]
+            else:
+                found = self._walk(path.rstrip(os.sep), filename,
+                                   valid=valid)
+            for item in found:
+                if item not in seen:
+                    seen.add(item)
+                    yield item
+
     def list(self, path='', filename='*'):
         """List the paths in the password store repository."""
-        prefix = os.path.join(self.prefix, path)
-        if os.path.isfile(prefix + '.gpg'):
-            paths = [path]
-        else:
-            paths = []
-            for ppath in Path(prefix).rglob(f'{filename}.gpg'):
-                file = os.sep + str(ppath)[len(self.prefix) + 1:]
-                if f"{os.sep}." not in file:
-                    file = os.path.splitext(file)[0][1:]
-                    paths.append(file)
-        paths.sort()
-        return paths
+        return list(self.walk([path], filename))
 
     def show(self, path):
         """Decrypt path and read the credentials in the password file."""
+        with stats.stage('decrypt'):
+            try:
+                data = self._decrypt(path)
+            except UnicodeDecodeError:
+                data = self._decrypt(path, nline=False)
+            return self.parse(path, data)
+
+    @staticmethod
+    def parse(path, data):
+        """Read the credentials from the decrypted content of path."""
         entry = {}
         entry['group'] = os.path.dirname(path)
         entry['title'] = os.path.basename(path)
-        try:
-            data = self._command(['show', path]).split('\n')
-        except UnicodeDecodeError:
-            entry['data'] = self._command(['show', path], nline=False)
+        if isinstance(data, bytes):
+            entry['data'] = data
             return entry
 
+        data = data.split('\n')
         data.pop()
         if data:
             line = data.pop(0)
@@ -129,40 +286,217 @@ class PasswordStore():
         """Check if the password store is initialized."""
         return os.path.isfile(os.path.join(self.prefix, '.gpg-id'))
 
-    def isvalid(self):
-        """Ensure the GPG keyring is usable."""
-        trusted = ['m', 'f', 'u', 'w', 's']
-        with open(os.path.join(self.prefix, '.gpg-id'), 'r') as file:
-            gpgids = file.read().split('\n')
-            gpgids.pop()
+    def gpgids(self, path=''):
+        """Get the GPG ids the password store, or path, is encrypted for."""
+        gpgids = []
+        with open(os.path.join(self.prefix, path, '.gpg-id'), 'r') as file:
+            for line in file:
+                gpgid = line.split('#', 1)[0].strip()
+                if gpgid:
+                    gpgids.append(gpgid)
+        return gpgids
+
+    def _hasgpgid(self, folder):
+        """Check if a folder of the store has its own .gpg-id file."""
+        return os.path.isfile(os.path.join(self.prefix, folder, '.gpg-id'))
+
+    def gpgidpaths(self, paths=('',), nested=True):
+        """List the folders with the .gpg-id files of several pass-names.
+
+        The password files of a pass-name are encrypted to the GPG ids of the
+        nearest .gpg-id file above it, or of the .gpg-id files of its
+        subfolders. Without nested, the subfolders are not walked.
+        """
+        gpgidpaths = set()
+        for path in paths:
+            path = path.lstrip(os.sep)
+            if os.path.isfile(os.path.join(self.prefix, path + '.gpg')):
+                folders = iter([os.path.dirname(path)])
+            else:
+                folders = self._walk(path.rstrip(os.sep), '*', folders=True)
+            parent = next(folders)
+            while parent and not self._hasgpgid(parent):
+                parent = os.path.dirname(parent)
+            gpgidpaths.add(parent)
+            if nested:
+                gpgidpaths.update(filter(self._hasgpgid, folders))
+        return sorted(gpgidpaths)
+
+    def _keyring(self):
+        """Get the state of the files of the GPG keyring."""
+        home = os.path.expanduser(
+            self.env.get('GNUPGHOME', os.path.join('~', '.gnupg')))
+        state = [self._gpgbinary, home]
+        for name in self.keyrings:
+            try:
+                stat = os.stat(os.path.join(home, name))
+            except OSError:
+                continue
+            state.append(f"{name}:{stat.st_mtime_ns}:{stat.st_size}")
+        return state
 
+    @staticmethod
+    def _match(gpgid, key):
+        """Check if a GPG id designates a key, as gpg would do."""
+        keyid = gpgid.replace(' ', '').rstrip('!').upper()
+        if keyid.startswith('0X'):
+            keyid = keyid[2:]
+        if len(keyid) in (8, 16, 32, 40, 64) and all(
+                char in '0123456789ABCDEF' for char in keyid):
+            return any(fpr.upper().endswith(keyid) for fpr in key['fprs'])
+        if gpgid.startswith('='):
+            return gpgid[1:] in key['uids']
+        if gpgid.startswith('<'):
+            return any(gpgid.lower() in uid.lower() for uid in key['uids'])
+        gpgid = gpgid.lstrip('@*').lower()
+        return any(gpgid in uid.lower() for uid in key['uids'])
+
+    def _keys(self, gpgids):
+        """List the keys of the GPG ids, with a single call to gpg."""
         cmd = [
             self._gpgbinary,
             '--with-colons',
             '--batch',
+            '--with-secret',
             '--list-keys',
             '--',
         ]
-        for gpgid in gpgids:
-            res, out, _ = self._call(cmd + [gpgid])
-            if res:
-                return False
-            for line in out.split('\n'):
-                record = line.split(':')
-                if record[0] == 'pub':
-                    trust = record[1]
-            if trust not in trusted:
+        _, out, _ = self._call(cmd + sorted(set(gpgids)))
+        keys = []
+        for line in out.split('\n'):
+            record = line.split(':')
+            if record[0] == 'pub':
+                keys.append({'trust': record[1], 'secret': False,
+                             'fprs': [], 'uids': []})
+            elif not keys:
+                continue
+            elif record[0] == 'fpr':
+                keys[-1]['fprs'].append(record[9])
+            elif record[0] == 'uid':
+                keys[-1]['uids'].append(record[9].replace('\\x3a', ':'))
+            if record[0] in ('pub', 'sub') and len(record) > 14:
+                keys[-1]['secret'] |= record[14] == '+'
+        return keys
+
+    def _trusted(self, gpgids):
+        """Check the keys of the GPG ids of the .gpg-id files, by folder."""
+        trusted = ['m', 'f', 'u', 'w', 's']
+        keys = self._keys(gid for ids in gpgids.values() for gid in ids)
+        for ids in gpgids.values():
+            secret = False
+            for gpgid in ids:
+                matches = [key for key in keys if self._match(gpgid, key)
+                           and key['trust'] in trusted]
+                if not matches:
+                    return False
+                secret |= any(key['secret'] for key in matches)
+            if not secret:
                 return False
+        return True
 
-        cmd = [
-            self._gpgbinary,
-            '--with-colons',
-            '--batch',
-            '--list-secret-keys',
-            '--',
-        ]
-        for gpgid in gpgids:
-            res, _, _ = self._call(cmd + [gpgid])
-            if res == 0:
-                return True
-        return False
+    def isvalid(self, cache=None, paths=('',), nested=True):
+        """Ensure the GPG keyring is usable.
+
+        The keys of the ``.gpg-id`` files of the pass-names must be present
+        and trusted, and every ``.gpg-id`` file must have a secret key. They
+        are checked with a single call to gpg, a valid keyring is cached
+        until its files change.
+
+        :param str cache: Path to the cache file of the valid keyrings.
+        :param list paths: The pass-names to audit, default to the store.
+        :param bool nested: Also check the ``.gpg-id`` files of the
+            subfolders, otherwise they are left to ``walk``.
+        """
+        gpgids = {path: self.gpgids(path)
+                  for path in self.gpgidpaths(paths, nested)}
+        if not all(gpgids.values()):
+            return False
+
+        if cache is None:
+            cache = os.path.join(os.path.expanduser(os.environ.get(
+                'XDG_CACHE_HOME', os.path.join('~', '.cache'))),
+                'pass-audit', 'keyring')
+        state = self._keyring() + [f"{path}={','.join(ids)}"
+                                   for path, ids in sorted(gpgids.items())]
+        digest = hashlib.sha256('\0'.join(state).encode()).hexdigest()
+        try:
+            with open(cache, 'r') as file:
+                digests = file.read().split()
+        except OSError:
+            digests = []
+        if digest in digests:
+            return True
+
+        if not self._trusted(gpgids):
+            return False
+
+        digests = [item for item in digests if item != digest]
+        digests = digests[-(self.keyrings_cached - 1):] + [digest]
+        try:
+            os.makedirs(os.path.dirname(cache), mode=0o700, exist_ok=True)
+            tmp = f"{cache}.{os.getpid()}.tmp"
+            with open(tmp, 'w') as file:
+                file.write('\n'.join(digests) + '\n')
+            os.replace(tmp, cache)
+        except OSError:
+            pass
+        return True
+
+
+class PasswordStores():
+    """Several password stores audited together.
+
+    The paths are qualified with the name of their store: ``name:path``. The
+    state of an incremental audit is encrypted to the first store.
+
+    :param dict stores: The password stores, by name.
+
+    """
+    separator = ':'
+
+    def __init__(self, stores):
+        self.stores = stores
+        self.main = next(iter(stores.values()))
+
+    @staticmethod
+    def name(prefix):
+        """Get the default name of the store in prefix."""
+        return os.path.basename(os.path.normpath(prefix)).lstrip('.')
+
+    def split(self, path):
+        """Get the store and the path in the store of a qualified path."""
+        name, path = path.split(self.separator, 1)
+        return self.stores[name], path
+
+    @property
+    def prefix(self):
+        """Get the prefixes of all the stores."""
+        return os.pathsep.join(store.prefix for store in self.stores.values())
+
+    def passfile(self, path):
+        """Get the password file of a qualified path."""
+        store, path = self.split(path)
+        return store.passfile(path)
+
+    def walk(self, paths=('',), filename='*', valid=False):
+        """Lazily list the qualified paths of pass-names in all the stores."""
+        for name, store in self.stores.items():
+            for path in store.walk(paths, filename, valid):
+                yield f"{name}{self.separator}{path}"
+
+    def list(self, path='', filename='*'):
+        """List the qualified paths in all the password stores."""
+        return list(self.walk([path], filename))
+
+    def show(self, path):
+        """Decrypt a qualified path in its password store."""
+        store, path = self.split(path)
+        return store.show(path)
+
+    def decrypt(self, file, nline=True):
+        """Decrypt any file with the first store."""
+        return self.main.decrypt(file, nline)
+
+    def encrypt(self, data, file):
+        """Encrypt data in file to the GPG ids of the first store."""
+        self.main.encrypt(data, file)
@@ -0,0 +1,500 @@
+# -*- encoding: utf-8 -*-
+# pass audit - Password Store Extension (https://www.passwordstore.org/)
+# Copyright (C) 2018-2022 Alexandre PUJOL <alexandre@pujol.io>.
+#
+
+import os
+import math
+import mmap
+import struct
+import sys
+import threading
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+from pass_audit import __version__
+from pass_audit.stats import stats
+
+
+class Bucket():
+    """Compact bucket of breached passwords sharing the same prefix.
+
+    The digests are stored without their first two bytes as a sorted bytes
+    array of fixed width records, and the counts in an array of unsigned
+    integers. A lookup is a binary search. It is the same whatever the bucket
+    comes from: the API, the cache or a local file or index.
+
+    :param str prefix: The 5 hexadecimal digits prefix of the bucket.
+
+    """
+    width = 18
+
+    def __init__(self, prefix, suffixes=b'', counts=None):
+        self.prefix = prefix
+        self.suffixes = suffixes
+        self.counts = array('I') if counts is None else counts
+
+    @classmethod
+    def from_records(cls, prefix, records):
+        """Create a bucket from an iterable of ``(digest, count)``."""
+        records = sorted((digest[2:], count) for digest, count in records)
+        suffixes = b''.join(suffix for suffix, _ in records)
+        counts = array('I', (count for _, count in records))
+        return cls(prefix, suffixes, counts)
+
+    @classmethod
+    def from_text(cls, prefix, text):
+        """Create a bucket from lines of ``SUFFIX:COUNT``, as sent by HIBP."""
+        records = []
+        for item in text.splitlines():
+            if not item:
+                continue
+            (partialhash, count) = item.split(':')
+            records.append((bytes.fromhex(prefix + partialhash), int(count)))
+        return cls.from_records(prefix, records)
+
+    def __len__(self):
+        """Get the number of hashes in the bucket."""
+        return len(self.counts)
+
+    def __eq__(self, other):
+        """Compare the prefix and the records of two buckets."""
+        return (isinstance(other, Bucket) and self.prefix == other.prefix
+                and self.suffixes == other.suffixes
+                and self.counts == other.counts)
+
+    def __iter__(self):
+        """Iterate over the ``(hash, count)`` of the bucket."""
+        head = bytes.fromhex(self.prefix[:4])
+        for index, count in enumerate(self.counts):
+            suffix = self.suffixes[index * self.width:(index + 1) * self.width]
+            yield (head + suffix).hex().upper(), count
+
+    def __contains__(self, phash):
+        """Check if ``phash`` has been breached."""
+        return self.count(phash) > 0
+
+    def count(self, phash):
+        """Get the number of times ``phash`` has been breached, 0 if never."""
+        if phash[:5].upper() != self.prefix:
+            return 0
+        key = bytes.fromhex(phash)[2:]
+        low, high = 0, len(self)
+        while low < high:
+            mid = (low + high) // 2
+            start = mid * self.width
+            if self.suffixes[start:start + self.width] < key:
+                low = mid + 1
+            else:
+                high = mid
+        start = low * self.width
+        if low < len(self) and self.suffixes[start:start + self.width] == key:
+            return self.counts[low]
+        return 0
+
+
+class PwnedCache():
+    """On-disk cache of the HIBP buckets.
+
+    A bucket is stored in a file named after its prefix, with the ``ETag`` of
+    the response on the first line. Nothing else is stored: the buckets are
+    public and the prefixes are already sent to the API. The file modification
+    time is the time the bucket was retrieved, its access time is used to
+    evict the least recently used buckets.
+
+    :param str path: Path to the cache directory.
+    :param float ttl: Time, in seconds, a bucket is used without revalidation.
+    :param int size: Maximum size of the cache, in bytes.
+
+    """
+
+    def __init__(self, path=None, ttl=86400, size=256 * 2**20):
+        if path is None:
+            cache = os.environ.get('XDG_CACHE_HOME',
+                                   os.path.join('~', '.cache'))
+            path = os.path.join(os.path.expanduser(cache), 'pass-audit',
+                                'ranges')
+        self.path = path
+        self.ttl = ttl
+        self.size = size
+        self._used = None
+        self._lock = threading.Lock()
+        os.makedirs(self.path, mode=0o700, exist_ok=True)
+
+    def get(self, prefix):
+        """Get the bucket ``prefix`` from the cache.
+
+        :return tuple: ``(etag, text, fresh)`` or None if not in the cache.
+        """
+        path = os.path.join(self.path, prefix)
+        try:
+            with open(path, 'r', newline='') as file:
+                etag = file.readline().rstrip('\n')
+                text = file.read()
+            mtime = os.stat(path).st_mtime
+            os.utime(path, (time.time(), mtime))
+        except OSError:
+            return None
+        return etag, text, time.time() - mtime < self.ttl
+
+    def touch(self, prefix):
+        """Mark the bucket ``prefix`` as revalidated."""
+        try:
+            os.utime(os.path.join(self.path, prefix))
+        except OSError:
+            pass
+
+    def put(self, prefix, etag, text):
+        """Store the bucket ``prefix`` and evict the oldest buckets."""
+        path = os.path.join(self.path, prefix)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, 'w', newline='') as file:
+            file.write(f"{etag}\n{text}")
+        os.replace(tmp, path)
+
+        with self._lock:
+            if self._used is None:
+                self._used = sum(entry.stat().st_size
+                                 for entry in self._entries())
+            else:
+                self._used += os.stat(path).st_size
+            if self._used > self.size:
+                self._evict()
+
+    def _entries(self):
+        """List the buckets in the cache."""
+        return [entry for entry in os.scandir(self.path)
+                if not entry.name.endswith('.tmp')]
+
+    def _evict(self):
+        """Remove the least recently used buckets."""
+        entries = sorted(self._entries(),
+                         key=lambda entry: entry.stat().st_atime)
+        self._used = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if self._used <= self.size * 0.9:
+                break
+            self._used -= entry.stat().st_size
+            os.remove(entry.path)
+
+
+class PwnedAPI():
+    """Simple wrapper for https://haveibeenpwned.com API.
+
+    All the requests share a keep-alive session. Requests rejected with a 429
+    or 5xx status are retried with an exponential backoff honoring the
+    ``Retry-After`` header. The requests library is only imported once the
+    API is used, the other lookups do not need it.
+
+    :param str url: Base URL of the Pwned Passwords API.
+    :param int workers: Maximum number of requests in flight.
+    :param int retries: Maximum number of retries for a request.
+    :param float timeout: Timeout of a request, in seconds.
+    :param PwnedCache cache: Optional on-disk cache of the buckets.
+
+    """
+    url = 'https://api.pwnedpasswords.com'
+
+    def __init__(self, url=None, workers=8, retries=5, timeout=30,
+                 cache=None):
+        # pylint: disable=import-outside-toplevel
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        if url:
+            self.url = url.rstrip('/')
+        self.workers = workers
+        self.timeout = timeout
+        self.cache = cache
+        self.headers = {
+            'user-agent': f"pass-audit/{__version__}",
+            'accept-encoding': 'gzip, deflate',
+        }
+        retry = Retry(total=retries, backoff_factor=0.5,
+                      status_forcelist=(429, 500, 502, 503, 504))
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers,
+                              max_retries=retry)
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def password_range(self, prefix):
+        """Query the haveibeenpwned API to retrieve the bucket ``prefix``."""
+        headers = {}
+        cached = None
+        if self.cache is not None:
+            cached = self.cache.get(prefix)
+        if cached is not None:
+            etag, text, fresh = cached
+            if fresh:
+                stats.count('hibp_cache_hits')
+                return Bucket.from_text(prefix, text)
+            if etag:
+                headers['if-none-match'] = etag
+
+        url = f"{self.url}/range/{prefix}"
+        res = self.session.get(url, headers=headers, verify=True,
+                               timeout=self.timeout)
+        stats.count('http_requests')
+        stats.count('http_bytes', int(res.headers.get('content-length',
+                                                      len(res.content))))
+        if res.status_code == 304 and cached is not None:
+            stats.count('hibp_cache_hits')
+            self.cache.touch(prefix)
+            return Bucket.from_text(prefix, cached[1])
+        res.raise_for_status()
+        if self.cache is not None:
+            stats.count('hibp_cache_misses')
+            self.cache.put(prefix, res.headers.get('etag', ''), res.text)
+        return Bucket.from_text(prefix, res.text)
+
+    def password_ranges(self, prefixes):
+        """Retrieve the buckets of all ``prefixes`` concurrently.
+
+        :return: An iterator of ``(prefix, bucket)``, in the same order than
+            ``prefixes``.
+        """
+        prefixes = list(prefixes)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            yield from zip(prefixes,
+                           executor.map(self.password_range, prefixes))
+
+
+class PwnedFile():
+    """Offline lookup in a local Pwned Passwords SHA-1 dump.
+
+    The dump must be the text file ordered by hash, with one ``HASH:COUNT``
+    line per password. It is memory-mapped and binary searched, so it is never
+    loaded in memory.
+
+    :param str path: Path to the Pwned Passwords dump.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        """Count the passwords in the dump."""
+        lines = 0
+        for start in range(0, len(self._mmap), 1 << 26):
+            lines += self._mmap[start:start + (1 << 26)].count(b'\n')
+        if self._mmap[-1:] not in (b'\n', b''):
+            lines += 1
+        return lines
+
+    def digests(self):
+        """Iterate over the SHA-1 digests of the dump."""
+        offset = 0
+        while offset < len(self._mmap):
+            end = self._mmap.find(b'\n', offset)
+            if end == -1:
+                end = len(self._mmap)
+            line = self._mmap[offset:offset + 40]
+            if line.strip():
+                yield bytes.fromhex(line.decode())
+            offset = end + 1
+
+    def _bisect(self, key):
+        """Return the offset of the first line greater or equal than key."""
+        low, high = 0, len(self._mmap)
+        while low < high:
+            mid = (low + high) // 2
+            start = self._mmap.rfind(b'\n', 0, mid) + 1
+            if self._mmap[start:start + len(key)] < key:
+                end = self._mmap.find(b'\n', start)
+                low = len(self._mmap) if end == -1 else end + 1
+            else:
+                high = start
+        return low
+
+    def password_range(self, prefix):
+        """Retrieve the bucket ``prefix`` from the local dump."""
+        key = prefix.encode()
+        offset = self._bisect(key)
+        records = []
+        while offset < len(self._mmap):
+            end = self._mmap.find(b'\n', offset)
+            if end == -1:
+                end = len(self._mmap)
+            line = self._mmap[offset:end].strip()
+            if not line.startswith(key):
+                break
+            (phash, count) = line.split(b':')
+            records.append((bytes.fromhex(phash.decode()), int(count)))
+            offset = end + 1
+        return Bucket.from_records(prefix, records)
+
+    def password_ranges(self, prefixes):
+        """Retrieve the buckets of all ``prefixes`` from the local dump.
+
+        :return: An iterator of ``(prefix, bucket)``.
+        """
+        for prefix in prefixes:
+            yield prefix, self.password_range(prefix)
+
+
+class PwnedIndex():
+    """Lookup in a compact binary index of the Pwned Passwords.
+
+    The index starts with a magic header and a table of ``2^20 + 1`` record
+    offsets, one for each 5 hexadecimal digits prefix. It is followed by the
+    sorted records: the 20 bytes SHA-1 digest and the count packed as a 4 bytes
+    unsigned integer. A bucket is therefore retrieved with a single read.
+
+    :param str path: Path to the index, built with :func:`PwnedIndex.build`.
+
+    """
+    magic = b'PAUDIDX1'
+    record = struct.Struct('<20sI')
+    buckets = 1 << 20
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(self.magic)] != self.magic:
+            raise ValueError(f"{path} is not a Pwned Passwords index")
+        self._records = len(self.magic) + 4 * (self.buckets + 1)
+
+    def __len__(self):
+        """Count the passwords in the index."""
+        return struct.unpack_from('<I', self._mmap, self._records - 4)[0]
+
+    def digests(self):
+        """Iterate over the SHA-1 digests of the index."""
+        step = self.record.size * 4096
+        for start in range(self._records, len(self._mmap), step):
+            chunk = self._mmap[start:start + step]
+            for digest, _ in self.record.iter_unpack(chunk):
+                yield digest
+
+    def password_range(self, prefix):
+        """Retrieve the bucket ``prefix`` from the index."""
+        offset = len(self.magic) + 4 * int(prefix, 16)
+        start, end = struct.unpack_from('<2I', self._mmap, offset)
+        start = self._records + start * self.record.size
+        end = self._records + end * self.record.size
+
+        records = self.record.iter_unpack(self._mmap[start:end])
+        return Bucket.from_records(prefix, records)
+
+    def password_ranges(self, prefixes):
+        """Retrieve the buckets of all ``prefixes`` from the index.
+
+        :return: An iterator of ``(prefix, bucket)``.
+        """
+        for prefix in prefixes:
+            yield prefix, self.password_range(prefix)
+
+    @classmethod
+    def build(cls, source, path):
+        """Build the index ``path`` from the Pwned Passwords dump ``source``.
+
+        The dump is read line by line and must be ordered by hash.
+
+        :return int: The number of passwords in the index.
+        """
+        sizes = array('I', bytes(4 * cls.buckets))
+        previous = b''
+        buffer = bytearray()
+        with open(source, 'rb') as src, open(path, 'wb') as dst:
+            dst.write(cls.magic)
+            dst.write(bytes(4 * (cls.buckets + 1)))
+            for line in src:
+                line = line.strip()
+                if not line:
+                    continue
+                (phash, count) = line.split(b':')
+                digest = bytes.fromhex(phash.decode())
+                if digest <= previous:
+                    raise ValueError(f"{source} is not ordered by hash")
+                previous = digest
+                sizes[int.from_bytes(digest[:3], 'big') >> 4] += 1
+                buffer += cls.record.pack(digest, int(count))
+                if len(buffer) >= 1 << 20:
+                    dst.write(buffer)
+                    buffer.clear()
+            dst.write(buffer)
+
+            offsets = array('I', [0])
+            for size in sizes:
+                offsets.append(offsets[-1] + size)
+            total = offsets[-1]
+            if sys.byteorder == 'big':
+                offsets.byteswap()
+            dst.seek(len(cls.magic))
+            dst.write(offsets.tobytes())
+        return total
+
+
+class PwnedFilter():
+    """Bloom filter of the Pwned Passwords.
+
+    It tells if a password is certainly not breached, or if it might be
+    breached, with a configurable false positive rate. As the SHA-1 digests are
+    uniformly distributed, the bit positions are derived from the digest
+    itself, using double hashing.
+
+    :param str path: Path to the filter, built with :func:`PwnedFilter.build`.
+
+    """
+    magic = b'PAUDBLM1'
+    header = struct.Struct('<QI')
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(self.magic)] != self.magic:
+            raise ValueError(f"{path} is not a Pwned Passwords filter")
+        self.size, self.hashes = self.header.unpack_from(
+            self._mmap, len(self.magic))
+        self._bits = len(self.magic) + self.header.size
+
+    @staticmethod
+    def _positions(digest, size, hashes):
+        """Get the bit positions of a digest."""
+        first = int.from_bytes(digest[0:8], 'little')
+        second = int.from_bytes(digest[8:16], 'little') | 1
+        return ((first + i * second) % size for i in range(hashes))
+
+    def __contains__(self, phash):
+        """Tell if the hexadecimal SHA-1 ``phash`` might be breached."""
+        digest = bytes.fromhex(phash)
+        for position in self._positions(digest, self.size, self.hashes):
+            byte = self._mmap[self._bits + (position >> 3)]
+            if not byte & (1 << (position & 7)):
+                return False
+        return True
+
+    @classmethod
+    def build(cls, source, path, rate=0.01):
+        """Build the filter ``path`` from a Pwned Passwords backend.
+
+        :param source: A :class:`PwnedFile` or a :class:`PwnedIndex`.
+        :param float rate: False positive rate of the filter.
+        :return int: The size of the filter, in bytes.
+        """
+        if not 0 < rate < 1:
+            raise ValueError(f"invalid false positive rate: {rate}")
+        total = max(len(source), 1)
+        size = math.ceil(-total * math.log(rate) / math.log(2) ** 2)
+        size = (size + 7) // 8 * 8
+        hashes = max(1, round(size / total * math.log(2)))
+
+        bits = bytearray(size // 8)
+        for digest in source.digests():
+            for position in cls._positions(digest, size, hashes):
+                bits[position >> 3] |= 1 << (position & 7)
+
+        with open(path, 'wb') as file:
+            file.write(cls.magic)
+            file.write(cls.header.pack(size, hashes))
+            file.write(bits)
+        return len(cls.magic) + cls.header.size + len(bits)
@@ -0,0 +1,190 @@
+# -*- encoding: utf-8 -*-
+# pass audit - Password Store Extension (https://www.passwordstore.org/)
+# Copyright (C) 2018-2022 Alexandre PUJOL <alexandre@pujol.io>.
+#
+
+import sys
+import json
+import time
+
+
+class Report():
+    """Report the findings of an audit as text messages.
+
+    The findings are reported as soon as they are known. A finding is
+    ``(check, path, payload, result)``, as given by ``PassAudit.stream``.
+
+    :param Msg msg: Output messages.
+    :param bool passwords: Show the plaintext passwords, when they are known.
+
+    """
+    checks = ('breached', 'weak', 'duplicated', 'similar')
+
+    def __init__(self, msg, passwords=True):
+        self.msg = msg
+        self.passwords = passwords
+        self.found = dict.fromkeys(self.checks, 0)
+        self.start = time.monotonic()
+
+    def finding(self, check, path, payload, result):
+        """Report a finding of the audit."""
+        self.found[check] += 1
+        if not self.passwords:
+            payload = None
+        password = self.designate(path, payload)
+        if check == 'breached':
+            self.msg.warning(f"Password breached: {password} has been "
+                             f"breached {result} time(s).")
+        elif check == 'weak':
+            self.msg.warning(f"Weak password detected: {password} might be "
+                             f"weak. {self.strength(result)}")
+        elif check == 'duplicated':
+            self.msg.warning("Duplicated passwords detected in "
+                             f"{', '.join(result)}")
+        elif check == 'similar':
+            self.msg.warning("Similar passwords detected in "
+                             f"{', '.join(result)}")
+
+    def unevaluated(self, paths):
+        """Report the passwords not evaluated with zxcvbn."""
+        self.msg.warning(f"{len(paths)} passwords not evaluated, they are too "
+                         "long or too slow to check with zxcvbn: "
+                         f"{', '.join(paths)}")
+
+    def summary(self, total):
+        """Report the summary of the audit."""
+        if not any(self.found.values()):
+            self.msg.success(f"None of the {total} passwords tested are "
+                             "breached, duplicated or weak.")
+        else:
+            self.msg.error(f"{total} passwords tested and "
+                           f"{self.found['breached']} breached,"
+                           f" {self.found['weak']} weak passwords found,"
+                           f" {self.found['duplicated']} duplicated and"
+                           f" {self.found['similar']} similar passwords"
+                           " found.")
+            self.msg.message("You should update them with 'pass update'.")
+
+    def stats(self, stats):
+        """Report the time and the counters of the audit."""
+        self.msg.message(f"{'Stage':<12}{'Wall (s)':>10}{'CPU (s)':>10}"
+                         f"{'Calls':>8}")
+        for name, times in stats['stages'].items():
+            self.msg.message(f"{name:<12}{times['wall']:>10.3f}"
+                             f"{times['cpu']:>10.3f}{times['calls']:>8}")
+        counters = ', '.join(f"{name.replace('_', ' ')}: {value}"
+                             for name, value in stats['counters'].items())
+        self.msg.message(f"Counters: {counters}")
+
+    @staticmethod
+    def designate(path, payload):
+        """Designate a password, it is unknown if not decrypted."""
+        if payload is None:
+            return f"the password of {path}"
+        return f"{payload} from {path}"
+
+    @staticmethod
+    def strength(details):
+        """Nicely print the results from zxcvbn."""
+        sequence = ''
+        for seq in details.get('sequence', []):
+            sequence += f"{seq['token']}({seq['pattern']}) "
+        res = f"Score {details['score']} ({details['guesses']} guesses). "
+        if not sequence:
+            return res
+        return res + f"This estimate is based on the sequence {sequence}"
+
+
+class JSONReport(Report):
+    """Report the findings of an audit as a JSON document.
+
+    Every finding is a record with its check, its path (or its paths), its
+    result and the time it was found, in seconds since the beginning of the
+    audit. The document is printed at the end of the audit.
+
+    :param Msg msg: Output messages.
+    :param bool passwords: Include the plaintext passwords in the records.
+
+    """
+
+    def __init__(self, msg, passwords=False):
+        super().__init__(msg, passwords)
+        self.records = []
+        self.statistics = None
+
+    def record(self, check, path, payload, result):
+        """Get the record of a finding."""
+        record = {'check': check}
+        if check in ('breached', 'weak'):
+            record['path'] = path
+            if self.passwords and payload is not None:
+                record['password'] = payload
+        if check == 'breached':
+            record['count'] = result
+        elif check == 'weak':
+            record['score'] = result['score']
+            record['guesses'] = float(result['guesses'])
+            sequence = result.get('sequence', [])
+            record['patterns'] = [seq['pattern'] for seq in sequence]
+            if self.passwords:
+                record['sequence'] = [seq['token'] for seq in sequence]
+        else:
+            record['paths'] = result
+        record['time'] = round(time.monotonic() - self.start, 3)
+        return record
+
+    def emit(self, record):
+        """Output a record."""
+        self.records.append(record)
+
+    def finding(self, check, path, payload, result):
+        """Report a finding of the audit."""
+        self.found[check] += 1
+        self.emit(self.record(check, path, payload, result))
+
+    def unevaluated(self, paths):
+        """Report the passwords not evaluated with zxcvbn."""
+        self.emit(self.record('unevaluated', None, None, paths))
+
+    def stats(self, stats):
+        """Report the time and the counters of the audit."""
+        self.statistics = stats
+
+    def summary(self, total):
+        """Report the summary of the audit."""
+        summary = {'total': total, **self.found,
+                   'time': round(time.monotonic() - self.start, 3)}
+        document = {'findings': self.records, 'summary': summary}
+        if self.statistics:
+            document['stats'] = self.statistics
+        json.dump(document, sys.stdout, indent=2)
+        print(file=sys.stdout)
+
+
+class NDJSONReport(JSONReport):
+    """Report the findings of an audit as newline delimited JSON.
+
+    A record is printed as soon as its finding is known, the last record is
+    the summary of the audit, with the ``summary`` check. It can be preceded
+    by the ``stats`` record.
+    """
+
+    def emit(self, record):
+        """Output a record."""
+        print(json.dumps(record), file=sys.stdout, flush=True)
+
+    def stats(self, stats):
+        """Report the time and the counters of the audit."""
+        self.emit({'check': 'stats', **stats})
+
+    def summary(self, total):
+        """Report the summary of the audit."""
+        self.emit({'check': 'summary', 'total': total, **self.found,
+                   'time': round(time.monotonic() - self.start, 3)})
+
+
+reports = {
+    'text': Report,
+    'json': JSONReport,
+    'ndjson': NDJSONReport,
+}
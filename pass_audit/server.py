@@ -0,0 +1,228 @@
+# -*- encoding: utf-8 -*-
+# pass audit - Password Store Extension (https://www.passwordstore.org/)
+# Copyright (C) 2018-2022 Alexandre PUJOL <alexandre@pujol.io>.
+#
+
+import gzip
+import asyncio
+import hashlib
+import functools
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+
+# The task of the running coroutine (python >= 3.7).
+_current_task = getattr(asyncio, 'current_task', None)
+if _current_task is None:
+    _current_task = asyncio.Task.current_task
+
+
+class RangeServer():
+    """Serve the ranges of a local Pwned Passwords dump or index over HTTP.
+
+    It answers the ``GET /range/{prefix}`` requests as the HIBP API does, a
+    PwnedAPI using its URL gets the same buckets. The clients are served
+    concurrently by an asyncio event loop, with keep-alive connections. The
+    buckets are read from the source by a pool of threads, a bucket requested
+    by several clients at once is only read once. The most requested buckets
+    are kept in memory, formatted and compressed, up to ``size`` bytes.
+
+    :param source: The Pwned Passwords, a PwnedFile or a PwnedIndex.
+    :param int size: Maximum size of the buckets kept in memory, in bytes.
+    :param int workers: Number of threads reading the source.
+    :param Msg msg: Log the requests, in verbose mode.
+
+    """
+    timeout = 60
+    hexdigits = frozenset('0123456789ABCDEF')
+
+    def __init__(self, source, size=64 * 2**20, workers=4, msg=None):
+        self.source = source
+        self.size = size
+        self.msg = msg
+        self.used = 0
+        self.hits = 0
+        self.misses = 0
+        self.server = None
+        self._buckets = OrderedDict()
+        self._pending = {}
+        self._clients = {}
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+
+    def _read(self, prefix):
+        """Read and format the bucket of prefix, as sent by HIBP."""
+        bucket = self.source.password_range(prefix)
+        body = '\r\n'.join(f"{phash[5:]}:{count}"
+                           for phash, count in bucket).encode()
+        etag = f'"{hashlib.sha256(body).hexdigest()[:16]}"'
+        return etag, body, gzip.compress(body)
+
+    def _done(self, prefix, future):
+        """Keep a bucket read in memory, evict the least recently used."""
+        del self._pending[prefix]
+        if future.cancelled() or future.exception() is not None:
+            return
+        etag, body, compressed = future.result()
+        self._buckets[prefix] = (etag, body, compressed)
+        self.used += len(body) + len(compressed)
+        while self.used > self.size:
+            _, (_, body, compressed) = self._buckets.popitem(last=False)
+            self.used -= len(body) + len(compressed)
+
+    async def bucket(self, prefix):
+        """Get the ``(etag, body, compressed body)`` of the bucket prefix."""
+        cached = self._buckets.get(prefix)
+        if cached is not None:
+            self._buckets.move_to_end(prefix)
+            self.hits += 1
+            return cached
+
+        future = self._pending.get(prefix)
+        if future is None:
+            self.misses += 1
+            loop = asyncio.get_event_loop()
+            future = loop.run_in_executor(self._executor, self._read, prefix)
+            self._pending[prefix] = future
+            future.add_done_callback(functools.partial(self._done, prefix))
+        else:
+            self.hits += 1
+        return await asyncio.shield(future)
+
+    @staticmethod
+    def _send(writer, status, headers=None, body=b'', head=False):
+        """Write a response."""
+        lines = [f"HTTP/1.1 {status.value} {status.phrase}"]
+        headers = dict(headers or {})
+        headers['Content-Length'] = str(len(body))
+        lines.extend(f"{name}: {value}" for name, value in headers.items())
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+        if not head:
+            writer.write(body)
+
+    async def lookup(self, prefix, headers, response):
+        """Answer a request of the bucket of prefix.
+
+        :param dict headers: The request headers, with lower case names.
+        :param dict response: The response headers, updated.
+        :return tuple: The status and the body of the response.
+        """
+        if len(prefix) != 5 or not self.hexdigits.issuperset(prefix):
+            return (HTTPStatus.BAD_REQUEST,
+                    b'The hash prefix was not in a valid format')
+        try:
+            etag, body, compressed = await self.bucket(prefix)
+        except (OSError, ValueError):
+            return HTTPStatus.INTERNAL_SERVER_ERROR, b''
+
+        response.update({
+            'Content-Type': 'text/plain',
+            'Cache-Control': 'public, max-age=86400',
+            'ETag': etag,
+            'Vary': 'Accept-Encoding',
+        })
+        if headers.get('if-none-match') == etag:
+            return HTTPStatus.NOT_MODIFIED, b''
+        if 'gzip' in headers.get('accept-encoding', ''):
+            response['Content-Encoding'] = 'gzip'
+            return HTTPStatus.OK, compressed
+        return HTTPStatus.OK, body
+
+    async def respond(self, writer, request, headers):
+        """Answer a request, the connection is kept alive if it returns True.
+
+        :param str request: The request line.
+        :param dict headers: The request headers, with lower case names.
+        """
+        try:
+            method, target, version = request.split()
+        except ValueError:
+            self._send(writer, HTTPStatus.BAD_REQUEST,
+                       {'Connection': 'close'})
+            return False
+        connection = headers.get('connection', '').lower()
+        keep = connection == 'keep-alive' or (
+            version == 'HTTP/1.1' and connection != 'close')
+        status, response, body = HTTPStatus.OK, {}, b''
+        if not keep:
+            response['Connection'] = 'close'
+        elif version != 'HTTP/1.1':
+            response['Connection'] = 'keep-alive'
+
+        if method not in ('GET', 'HEAD'):
+            status = HTTPStatus.METHOD_NOT_ALLOWED
+            response.update({'Allow': 'GET, HEAD', 'Connection': 'close'})
+            keep = False
+        elif not target.startswith('/range/'):
+            status = HTTPStatus.NOT_FOUND
+        else:
+            prefix = target[len('/range/'):].split('?', 1)[0].upper()
+            status, body = await self.lookup(prefix, headers, response)
+
+        self._send(writer, status, response, body, method == 'HEAD')
+        if self.msg:
+            peer = writer.get_extra_info('peername') or ('-',)
+            self.msg.verbose(f"{peer[0]} {method} {target} {status.value}")
+        return keep
+
+    async def handle(self, reader, writer):
+        """Answer the requests of a client connection."""
+        task = _current_task()
+        self._clients[task] = writer
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(reader.readline(),
+                                                     self.timeout)
+                    headers = {}
+                    while True:
+                        line = await asyncio.wait_for(reader.readline(),
+                                                      self.timeout)
+                        if line.strip() == b'':
+                            break
+                        name, _, value = line.decode('latin-1').partition(':')
+                        headers[name.strip().lower()] = value.strip()
+                except (asyncio.TimeoutError, ValueError):
+                    break
+                if not request.strip():
+                    break
+                keep = await self.respond(writer, request.decode('latin-1'),
+                                          headers)
+                await writer.drain()
+                if not keep:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+            self._clients.pop(task, None)
+
+    async def start(self, host='127.0.0.1', port=8080):
+        """Start to serve the ranges, get the port of the server."""
+        self.server = await asyncio.start_server(self.handle, host, port,
+                                                 backlog=1024)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        """Stop to serve the ranges, the open connections are closed."""
+        self.server.close()
+        clients = list(self._clients.items())
+        for _, writer in clients:
+            writer.close()
+        await asyncio.gather(*(task for task, _ in clients),
+                             return_exceptions=True)
+        await self.server.wait_closed()
+        self._executor.shutdown(wait=False)
+
+    def serve(self, host='127.0.0.1', port=8080):
+        """Serve the ranges until interrupted."""
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(self.start(host, port))
+            loop.run_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if self.server is not None:
+                loop.run_until_complete(self.stop())
+            loop.close()
@@ -0,0 +1,205 @@
+# -*- encoding: utf-8 -*-
+# pass audit - Password Store Extension (https://www.passwordstore.org/)
+# Copyright (C) 2018-2022 Alexandre PUJOL <alexandre@pujol.io>.
+#
+
+import os
+import json
+import hashlib
+import secrets
+
+from pass_audit.duplicates import DuplicateIndex
+from pass_audit.passwordstore import PasswordStoreError
+
+
+class AuditState():
+    """Findings of the previous audit of a password store.
+
+    For every audited entry, it records the fingerprint of its password file
+    (modification time and size), the number of times it has been breached,
+    its strength score, if it could be evaluated, and the salted digests of
+    the password, used to find the duplicated and similar passwords. It
+    never contains any password.
+    Moreover, the state is encrypted to the GPG ids of the password store.
+
+    :param PasswordStore store: The audited password store.
+    :param str path: Path to the state file. Default to a file named after
+        the store in ``$XDG_CACHE_HOME/pass-audit/state``.
+    :param list checks: The checks of the audit. A state recorded with other
+        checks is not used, it may lack some findings.
+
+    """
+    version = 4
+    checks = ['breach', 'strength', 'duplicates']
+
+    def __init__(self, store, path=None, checks=None):
+        if checks is not None:
+            self.checks = sorted(checks, key=self.checks.index)
+        self.store = store
+        if path is None:
+            cache = os.environ.get('XDG_CACHE_HOME',
+                                   os.path.join('~', '.cache'))
+            name = hashlib.sha256(store.prefix.encode()).hexdigest()[:16]
+            path = os.path.join(os.path.expanduser(cache), 'pass-audit',
+                                'state', f"{name}.gpg")
+        self.path = path
+        self.salt = secrets.token_hex(16)
+        self.entries = {}
+
+    def load(self):
+        """Read and decrypt the state, start from an empty one on error."""
+        if not os.path.isfile(self.path):
+            return False
+        try:
+            state = json.loads(self.store.decrypt(self.path))
+        except (PasswordStoreError, ValueError):
+            return False
+        if state.get('version') != self.version:
+            return False
+        if state.get('checks', AuditState.checks) != self.checks:
+            return False
+        self.salt = state['salt']
+        self.entries = state['entries']
+        return True
+
+    def save(self):
+        """Encrypt and write the state."""
+        os.makedirs(os.path.dirname(self.path), mode=0o700, exist_ok=True)
+        state = {
+            'version': self.version,
+            'salt': self.salt,
+            'checks': self.checks,
+            'entries': self.entries,
+        }
+        self.store.encrypt(json.dumps(state), self.path)
+
+    def fingerprint(self, path):
+        """Get the fingerprint of the password file of path."""
+        stat = os.stat(self.store.passfile(path))
+        return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+    def index(self):
+        """Get the index of the digests of the passwords, keyed on the salt."""
+        return DuplicateIndex(bytes.fromhex(self.salt))
+
+    def changed(self, paths):
+        """Get the paths that are new or changed since the previous audit."""
+        changed = []
+        for path in paths:
+            entry = self.entries.get(path)
+            if entry is None or entry['fingerprint'] != self.fingerprint(path):
+                changed.append(path)
+        return changed
+
+    def add(self, path, password):
+        """Record an audited entry, without any finding yet."""
+        record = {'digest': None, 'skeleton': None, 'signature': None}
+        if password:
+            record = self.index().record(password)
+            if record['signature'] is not None:
+                record['signature'] = record['signature'].hex()
+        self.entries[path] = {
+            'fingerprint': self.fingerprint(path),
+            'breached': 0,
+            'score': None,
+            'guesses': None,
+            'unevaluated': False,
+            **record,
+        }
+
+    def track(self, entries):
+        """Record the ``(path, entry)`` pairs as they are audited."""
+        for path, entry in entries:
+            self.add(path, entry.get('password', ''))
+            yield path, entry
+
+    def found(self, check, path, result):
+        """Record a finding of an audited entry."""
+        if check == 'breached':
+            self.entries[path]['breached'] = result
+        elif check == 'weak':
+            self.entries[path]['score'] = result['score']
+            self.entries[path]['guesses'] = float(result['guesses'])
+        elif check == 'unevaluated':
+            self.entries[path]['unevaluated'] = True
+
+    def _exists(self, path):
+        """Check if the password file of a recorded entry still exists."""
+        try:
+            return os.path.isfile(self.store.passfile(path))
+        except (KeyError, ValueError):  # Not in the audited stores
+            return False
+
+    def prune(self, paths):
+        """Forget the removed entries, not in paths anymore.
+
+        The entries of the pass-names not audited are kept, an audit of a
+        folder does not forget the rest of the store.
+        """
+        paths = set(paths)
+        self.entries = {path: record for path, record in self.entries.items()
+                        if path in paths or self._exists(path)}
+
+    def update(self, paths, data, breached, weak):
+        """Record the findings of the audited entries.
+
+        :param list paths: All the paths in the audit, the removed ones are
+            forgotten.
+        :param dict data: The entries audited in this run.
+        :param list breached: Breached passwords found in ``data``.
+        :param list weak: Weak passwords found in ``data``.
+        """
+        for _ in self.track(data.items()):
+            pass
+        for path, _, count in breached:
+            self.found('breached', path, count)
+        for path, _, results in weak:
+            self.found('weak', path, results)
+        self.prune(paths)
+
+    def breached(self, paths):
+        """Get the previous breached passwords found in paths."""
+        breached = []
+        for path in paths:
+            count = self.entries.get(path, {}).get('breached')
+            if count:
+                breached.append((path, None, count))
+        return breached
+
+    def weak(self, paths):
+        """Get the previous weak passwords found in paths."""
+        weak = []
+        for path in paths:
+            entry = self.entries.get(path, {})
+            if entry.get('score') is not None:
+                details = {'score': entry['score'],
+                           'guesses': entry['guesses']}
+                weak.append((path, None, details))
+        return weak
+
+    def unevaluated(self, paths):
+        """Get the passwords of paths whose strength was not evaluated."""
+        return [path for path in paths
+                if self.entries.get(path, {}).get('unevaluated')]
+
+    def _indexed(self, paths=None):
+        """Index the digests of the recorded entries of paths, or all."""
+        if paths is None:
+            paths = list(self.entries)
+        index = self.index()
+        for path in paths:
+            entry = self.entries.get(path)
+            if entry is not None and entry['digest'] is not None:
+                signature = entry['signature']
+                if signature is not None:
+                    signature = bytes.fromhex(signature)
+                index.add(path, {**entry, 'signature': signature})
+        return index
+
+    def duplicates(self, paths=None):
+        """Check for duplicated passwords in the recorded entries of paths."""
+        return self._indexed(paths).duplicates()
+
+    def similar(self, paths=None):
+        """Check for similar passwords in the recorded entries of paths."""
+        return self._indexed(paths).similar()
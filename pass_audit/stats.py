@@ -0,0 +1,92 @@
+# -*- encoding: utf-8 -*-
+# pass audit - Password Store Extension (https://www.passwordstore.org/)
+# Copyright (C) 2018-2022 Alexandre PUJOL <alexandre@pujol.io>.
+#
+
+import time
+import threading
+from contextlib import contextmanager
+try:
+    import resource
+    RESOURCE = True
+except ImportError:  # Windows
+    RESOURCE = False
+
+# Per thread CPU time, the stages run concurrently (python >= 3.7).
+_cputime = getattr(time, 'thread_time', time.process_time)
+
+
+class Stats():
+    """Time spent in the stages of an audit and its counters.
+
+    The time of a stage is the sum of the time spent in it by all the
+    threads: with several jobs, it can be longer than the audit itself. The
+    CPU time is the one of the threads, the CPU time of the subprocesses (gpg,
+    pass and the zxcvbn workers) is counted apart, once they are finished. It
+    is not known on Windows.
+
+    The stages are: ``list``, ``keyring``, ``decrypt``, ``hash``, ``hibp``,
+    ``zxcvbn`` and ``duplicates``. The counters are the ``subprocesses``
+    spawned, the ``http_requests`` made, the ``http_bytes`` received, and the
+    hits and misses of the HIBP and zxcvbn caches.
+
+    """
+    stages = ('list', 'keyring', 'decrypt', 'hash', 'hibp', 'zxcvbn',
+              'duplicates')
+    counters = ('subprocesses', 'http_requests', 'http_bytes',
+                'hibp_cache_hits', 'hibp_cache_misses', 'zxcvbn_cache_hits',
+                'zxcvbn_cache_misses')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Reset all the times and counters."""
+        with self._lock:
+            self.times = {stage: {'wall': 0.0, 'cpu': 0.0, 'calls': 0}
+                          for stage in self.stages}
+            self.counts = dict.fromkeys(self.counters, 0)
+            self._children = self._childtime()
+
+    @staticmethod
+    def _childtime():
+        """Get the CPU time of the finished subprocesses, 0 if unknown."""
+        if not RESOURCE:
+            return 0.0
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return usage.ru_utime + usage.ru_stime
+
+    @contextmanager
+    def stage(self, name):
+        """Measure the time spent in a stage."""
+        start, cpu = time.perf_counter(), _cputime()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start
+            cpu = _cputime() - cpu
+            with self._lock:
+                self.times[name]['wall'] += wall
+                self.times[name]['cpu'] += cpu
+                self.times[name]['calls'] += 1
+
+    def count(self, name, value=1):
+        """Increment a counter."""
+        with self._lock:
+            self.counts[name] += value
+
+    def asdict(self):
+        """Get the times, in seconds, and the counters."""
+        with self._lock:
+            stages = {name: {'wall': round(times['wall'], 3),
+                             'cpu': round(times['cpu'], 3),
+                             'calls': times['calls']}
+                      for name, times in self.times.items()}
+            counters = dict(self.counts)
+        counters['subprocesses_cpu'] = round(
+            self._childtime() - self._children, 3)
+        return {'stages': stages, 'counters': counters}
+
+
+stats = Stats()
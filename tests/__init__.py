@@ -23,16 +23,25 @@ It provides:
   - tests.prefix Path to the reference audit repository.
   - tests.Tests() Base test class.
   - tests.captured() Context manager to capture stdout.
+  - tests.salted() Context manager to use a fixed salt.
   - tests.getdata() Get data from the reference repository.
-  - tests.mock_request() Mock HIBP API response.
+  - tests.PwnedServer() Local stand-in for the HIBP API.
+  - tests.pwned_dump() Write a local Pwned Passwords dump.
 """
 
 import os
 import sys
+import gzip
+import hashlib
+import secrets
 import shutil
+import threading
 import unittest
 from io import StringIO
 from contextlib import contextmanager
+from unittest import mock
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
 
 import pass_audit.__main__
 from pass_audit.passwordstore import PasswordStore
@@ -56,6 +65,18 @@ def captured():
         sys.stdout, sys.stderr = old_out, old_err
 
 
+@contextmanager
+def salted(salt=b'salt' * 4):
+    """Context manager to use a fixed salt for the password digests.
+
+    The similar passwords are estimated from their salted signatures, a
+    fixed salt makes the estimation reproducible.
+    """
+    with mock.patch.object(secrets, 'token_bytes', return_value=salt), \
+            mock.patch.object(secrets, 'token_hex', return_value=salt.hex()):
+        yield
+
+
 def getdata(root):
     """Get data from the reference repository."""
     data = {}
@@ -65,31 +86,108 @@ def getdata(root):
     return data
 
 
-def mock_request(*args, **kwargs):
-    """Mock HIBP API response."""
+class PwnedHandler(BaseHTTPRequestHandler):
+    """Serve the HIBP buckets of the server, the same one by default."""
+    data = [
+        "D5EE0CB1A41071812CCED2F1930E6E1A5D2:2",
+        "2DC183F740EE76F27B78EB39C8AD972A757:52579",
+        "CF164D7A51A1FD864B1BF9E1CE8A3EC171B:4",
+        "D0B910E7A3028703C0B30039795E908CEB2:7",
+        "AD6438836DBE526AA231ABDE2D0EEF74D42:3",
+        "EBAB0A7CE978E0194608B572E4F9404AA21:3",
+        "17727EAB0E800E62A776C76381DEFBC4145:120",
+        "5370372AC65308F03F6ED75EC6068C8E1BE:1386",
+        "1E4C9B93F3F0682250B6CF8331B7EE68FD8:3730471",
+        "437FAA5A7FCE15D1DDCB9EAEAEA377667B8:123422",
+        "944C22589AC652B0F47918D58CA0CDCCB63:411"
+    ]
+
+    def do_GET(self):  # noqa
+        """Answer to /range/<prefix> requests."""
+        with self.server.lock:
+            self.server.requests.append(self.path)
+            failure = self.server.failures > 0
+            if failure:
+                self.server.failures -= 1
+
+        if failure:
+            self.send_response(429)
+            self.send_header('Retry-After', '0')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if not self.path.startswith('/range/'):
+            self.send_error(404)
+            return
+
+        prefix = self.path[len('/range/'):].upper()
+        body = "\r\n".join(self.server.bucket(prefix)).encode()
+        etag = f'"{hashlib.sha256(body).hexdigest()[:16]}"'
+        if self.headers.get('If-None-Match') == etag:
+            with self.server.lock:
+                self.server.notmodified += 1
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        """Do not log the requests."""
+
+
+class PwnedServer(ThreadingMixIn, HTTPServer):
+    """Local stand-in for the HIBP API, running in a background thread.
+
+    :param int failures: Number of requests to reject with a 429 error.
+    :param list requests: Paths of the requests received.
+    :param int notmodified: Number of 304 responses sent.
 
-    class MockResponse:
-        def __init__(self):
-            data = [
-                "D5EE0CB1A41071812CCED2F1930E6E1A5D2:2",
-                "2DC183F740EE76F27B78EB39C8AD972A757:52579",
-                "CF164D7A51A1FD864B1BF9E1CE8A3EC171B:4",
-                "D0B910E7A3028703C0B30039795E908CEB2:7",
-                "AD6438836DBE526AA231ABDE2D0EEF74D42:3",
-                "EBAB0A7CE978E0194608B572E4F9404AA21:3",
-                "17727EAB0E800E62A776C76381DEFBC4145:120",
-                "5370372AC65308F03F6ED75EC6068C8E1BE:1386",
-                "1E4C9B93F3F0682250B6CF8331B7EE68FD8:3730471",
-                "437FAA5A7FCE15D1DDCB9EAEAEA377667B8:123422",
-                "944C22589AC652B0F47918D58CA0CDCCB63:411"
-            ]
-
-            self.text = "\r\n".join(data)
-
-        def raise_for_status(self):
-            pass
-
-    return MockResponse()
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), PwnedHandler)
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.requests = []
+        self.notmodified = 0
+        self.url = f"http://127.0.0.1:{self.server_port}"
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @staticmethod
+    def bucket(prefix):  # pylint: disable=unused-argument
+        """Get the lines of the bucket of prefix."""
+        return PwnedHandler.data
+
+    def start(self):
+        """Start the server."""
+        self.thread.start()
+
+    def stop(self):
+        """Stop the server."""
+        self.shutdown()
+        self.server_close()
+
+
+def pwned_dump(path, prefixes):
+    """Write a Pwned Passwords dump with the stand-in buckets of prefixes."""
+    lines = []
+    for prefix in prefixes:
+        lines.extend(prefix + item for item in PwnedHandler.data)
+    lines.sort()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as file:
+        file.write('\r\n'.join(lines) + '\r\n')
 
 
 class Test(unittest.TestCase):
@@ -109,6 +207,7 @@ class Test(unittest.TestCase):
         os.environ.pop('GPG_AGENT_INFO', None)
         os.environ.pop('PASSWORD_STORE_SIGNING_KEY', None)
         os.environ['GNUPGHOME'] = os.path.join(os.getcwd(), assets + 'gnupg')
+        os.environ['XDG_CACHE_HOME'] = os.path.join(tmp, 'cache')
 
     def _tmpdir(self, path=''):
         """Create a temporary test directory named after the testname."""
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+# pass audit - Password Store Extension (https://www.passwordstore.org/)
+# Copyright (C) 2018-2022 Alexandre PUJOL <alexandre@pujol.io>.
+#
+"""pass-audit benchmark.
+
+Generate synthetic password stores encrypted to the test key, audit them
+against a local stand-in of the HIBP API and record the throughput and the
+peak memory of every stage of the audit in a JSON file. Usage::
+
+    python3 -m tests.benchmark --sizes 1000 10000 --output benchmark.json
+    python3 -m tests.benchmark --compare benchmark.json
+
+The stages are:
+  - read: decrypt the store with pass_read().
+  - breach: PassAudit.password().
+  - strength: PassAudit.zxcvbn().
+  - duplicates: PassAudit.duplicates() and PassAudit.similar().
+  - stream: the full streamed audit, as run by pass audit.
+"""
+
+import os
+import sys
+import json
+import random
+import string
+import hashlib
+import multiprocessing
+import platform
+import resource
+import subprocess  # nosec
+import time
+from argparse import ArgumentParser
+
+import pass_audit
+from pass_audit.__main__ import pass_read
+from pass_audit.audit import PassAudit, StrongFilter
+from pass_audit.msg import Msg
+from pass_audit.passwordstore import PasswordStore
+from pass_audit.pwned import PwnedAPI
+import tests
+
+WORDS = ['summer', 'winter', 'dragon', 'monkey', 'football', 'sunshine',
+         'princess', 'welcome', 'shadow', 'master', 'letmein', 'trustno1',
+         'password', 'baseball', 'superman', 'michael', 'charlie', 'hunter']
+
+
+class BenchServer(tests.PwnedServer):
+    """Stand-in for the HIBP API with realistic buckets.
+
+    Every bucket has about 800 random suffixes, as the real ones, and the
+    suffixes of the breached passwords of its prefix. The server runs in its
+    own process, not to share the CPU time of the audit.
+
+    :param set breached: SHA-1 hashes of the breached passwords.
+
+    """
+
+    def __init__(self, breached, size=800):
+        super().__init__()
+        self.size = size
+        self.breached = {}
+        for phash in breached:
+            self.breached.setdefault(phash[:5], []).append(phash[5:])
+
+    def start(self):
+        """Start the server in a child process."""
+        context = multiprocessing.get_context('fork')
+        self.process = context.Process(target=self.serve_forever, daemon=True)
+        self.process.start()
+
+    def stop(self):
+        """Stop the server."""
+        self.process.terminate()
+        self.process.join()
+        self.server_close()
+
+    def bucket(self, prefix):
+        """Get the lines of the bucket of prefix."""
+        rand = random.Random(prefix)
+        suffixes = {'%035X' % rand.getrandbits(140) for _ in range(self.size)}
+        suffixes.update(self.breached.get(prefix, []))
+        return [f"{suffix}:{rand.randint(1, 1000)}"
+                for suffix in sorted(suffixes)]
+
+
+def password(rand, weak):
+    """Generate a random strong password or a common weak one."""
+    if weak:
+        word = rand.choice(WORDS)
+        return f"{word.title()}{rand.randint(0, 9999)}{rand.choice('!?.')}"
+    chars = string.ascii_letters + string.digits + string.punctuation
+    return ''.join(rand.choices(chars, k=rand.randint(14, 24)))
+
+
+def generate(prefix, size, duplicates, weak, breached, seed=42):
+    """Generate a password store, if it does not exist yet.
+
+    :return set: The SHA-1 hashes of the breached passwords.
+    """
+    rand = random.Random(seed)
+    passwords = []
+    for _ in range(size):
+        if passwords and rand.random() < duplicates:
+            passwords.append(rand.choice(passwords))
+        else:
+            passwords.append(password(rand, rand.random() < weak))
+    hashes = {hashlib.sha1(item.encode()).hexdigest().upper()  # nosec
+              for item in passwords if rand.random() < breached}
+
+    if os.path.isfile(os.path.join(prefix, '.gpg-id')):
+        return hashes
+    files = []
+    for index, item in enumerate(passwords):
+        path = os.path.join(prefix, f"group{index % 100}", f"entry{index}")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as file:
+            file.write(f"{item}\nlogin: user{index}\nurl: site{index}.com\n")
+        files.append(path)
+
+    command = ['gpg', '--batch', '--yes', '--quiet', '--compress-algo=none',
+               '--no-encrypt-to', '--trust-model', 'always',
+               '--recipient', tests.Test.gpgids[0], '--multifile',
+               '--encrypt']
+    for start in range(0, len(files), 1000):
+        subprocess.run(command + files[start:start + 1000],  # nosec
+                       check=True, stderr=subprocess.DEVNULL)
+    for path in files:
+        os.remove(path)
+    with open(os.path.join(prefix, '.gpg-id'), 'w') as file:
+        file.write(tests.Test.gpgids[0] + '\n')
+    return hashes
+
+
+def peak():
+    """Get the peak resident memory of the process, in bytes."""
+    try:
+        with open('/proc/self/status') as file:
+            for line in file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def reset():
+    """Reset the peak resident memory of the process, if possible."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as file:
+            file.write('5')
+    except OSError:
+        pass
+
+
+def measure(stages, name, size, func):
+    """Run a stage of the benchmark and record its performances."""
+    reset()
+    start, cpu = time.perf_counter(), time.process_time()
+    result = func()
+    elapsed = time.perf_counter() - start
+    stages[name] = {
+        'time': round(elapsed, 3),
+        'cpu': round(time.process_time() - cpu, 3),
+        'rate': round(size / elapsed, 1) if elapsed else None,
+        'peak_rss': peak(),
+    }
+    return result
+
+
+def bench(arg, size):
+    """Benchmark the audit of a store of size entries."""
+    prefix = os.path.join(arg.dir, f"store-{size}-{arg.duplicates}-"
+                          f"{arg.weak}-{arg.breached}")
+    start = time.perf_counter()
+    hashes = generate(prefix, size, arg.duplicates, arg.weak, arg.breached)
+    print(f"Store of {size} entries ready in "
+          f"{time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+    server = BenchServer(hashes)
+    server.start()
+    try:
+        msg = Msg(quiet=True)
+        store = PasswordStore(prefix, arg.backend)
+        paths = store.list()
+        stages = {}
+        data = measure(stages, 'read', size, lambda: dict(
+            pass_read(msg, store, paths, arg.jobs)))
+        audit = PassAudit(data, False, PwnedAPI(server.url), jobs=arg.jobs,
+                          strong=StrongFilter())
+        breached = measure(stages, 'breach', size, audit.password)
+        weak = measure(stages, 'strength', size, audit.zxcvbn)
+        duplicated = measure(stages, 'duplicates', size, lambda: (
+            audit.duplicates(), audit.similar()))
+        del data
+
+        def stream():
+            audit = PassAudit({}, False, PwnedAPI(server.url), jobs=arg.jobs,
+                              strong=StrongFilter())
+            entries = pass_read(msg, store, paths, arg.jobs)
+            return sum(1 for _ in audit.stream(entries))
+
+        findings = measure(stages, 'stream', size, stream)
+    finally:
+        server.stop()
+
+    return {
+        'entries': size,
+        'stages': stages,
+        'findings': {
+            'breached': len(breached),
+            'weak': len(weak),
+            'duplicated': len(duplicated[0]),
+            'similar': len(duplicated[1]),
+            'streamed': findings,
+        },
+    }
+
+
+def compare(results, reference, tolerance):
+    """Compare the stage times to a reference, get the regressions."""
+    previous = {result['entries']: result['stages']
+                for result in reference['results']}
+    regressions = []
+    for result in results['results']:
+        for name, stage in result['stages'].items():
+            ref = previous.get(result['entries'], {}).get(name)
+            if not ref or not ref['time']:
+                continue
+            ratio = stage['time'] / ref['time']
+            print(f"{result['entries']:>7} {name:<10} {ref['time']:>8.2f}s "
+                  f"-> {stage['time']:>8.2f}s ({ratio:.2f}x)")
+            if ratio > 1 + tolerance:
+                regressions.append(f"{name} ({result['entries']})")
+    return regressions
+
+
+def main():
+    """Run the benchmark."""
+    parser = ArgumentParser(prog='python3 -m tests.benchmark',
+                            description="Benchmark the stages of pass audit "
+                            "on synthetic password stores.")
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1000, 10000, 100000],
+                        help="Number of entries of the stores.")
+    parser.add_argument('--duplicates', type=float, default=0.05,
+                        help="Share of duplicated passwords.")
+    parser.add_argument('--weak', type=float, default=0.1,
+                        help="Share of weak passwords.")
+    parser.add_argument('--breached', type=float, default=0.1,
+                        help="Share of breached passwords.")
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                        help="Number of jobs of the audit.")
+    parser.add_argument('--backend', choices=PasswordStore.backends,
+                        default='gpg', help="Decryption backend.")
+    parser.add_argument('--dir', default=os.path.join(tests.tmp, 'benchmark'),
+                        help="Directory of the generated stores.")
+    parser.add_argument('--output', default='benchmark.json',
+                        help="JSON file of the results.")
+    parser.add_argument('--compare', metavar='PATH',
+                        help="Compare to the results of a previous run.")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="Slowdown of a stage reported as a regression.")
+    arg = parser.parse_args()
+    reference = None
+    if arg.compare:
+        with open(arg.compare) as file:
+            reference = json.load(file)
+
+    os.environ.pop('GPG_AGENT_INFO', None)
+    os.environ['GNUPGHOME'] = os.path.join(tests.assets, 'gnupg')
+    os.environ['XDG_CACHE_HOME'] = os.path.join(tests.tmp, 'cache')
+    results = {
+        'version': pass_audit.__version__,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'parameters': {
+            'duplicates': arg.duplicates,
+            'weak': arg.weak,
+            'breached': arg.breached,
+            'jobs': arg.jobs,
+            'backend': arg.backend,
+        },
+        'results': [bench(arg, size) for size in arg.sizes],
+    }
+    with open(arg.output, 'w') as file:
+        json.dump(results, file, indent=2)
+        file.write('\n')
+    print(f"Results written in {arg.output}", file=sys.stderr)
+
+    if reference:
+        regressions = compare(results, reference, arg.tolerance)
+        if regressions:
+            print(f"Regressions: {', '.join(regressions)}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,10 +3,18 @@
 # Copyright (C) 2018-2022 Alexandre PUJOL <alexandre@pujol.io>.
 #
 
+import os
+import random
+import signal
+import string
+import time
+import hashlib
 from unittest import mock
 
 import pass_audit.audit
 import pass_audit.msg
+from pass_audit.pwned import PwnedAPI, PwnedFile, PwnedFilter
+from pass_audit.stats import stats
 import tests
 
 
@@ -14,20 +22,30 @@ class TestPassAudit(tests.Test):
     """Test the PassAudit class."""
     passwords_nb = 7
 
-    @mock.patch('requests.get', tests.mock_request)
+    @classmethod
+    def setUpClass(cls):
+        cls.server = tests.PwnedServer()
+        cls.server.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.api = PwnedAPI(self.server.url)
+
     def test_password_notpwned(self):
         """Testing: pass audit for password not breached with K-anonymity."""
         data = tests.getdata('Password/notpwned')
-        audit = pass_audit.audit.PassAudit(data, True)
+        audit = pass_audit.audit.PassAudit(data, True, self.api)
         breached = audit.password()
         self.assertTrue(len(breached) == 0)
 
-    @mock.patch('requests.get', tests.mock_request)
     def test_password_pwned(self):
         """Testing: pass audit for password breached with K-anonymity."""
         ref_counts = [52579, 3, 120, 1386, 3730471, 123422, 411]
         data = tests.getdata('Password/pwned')
-        audit = pass_audit.audit.PassAudit(data, True)
+        audit = pass_audit.audit.PassAudit(data, True, self.api)
         breached = audit.password()
         self.assertTrue(len(breached) == self.passwords_nb)
         for path, password, count in breached:
@@ -36,6 +54,42 @@ class TestPassAudit(tests.Test):
             ref_index = int(path[-1:]) - 1
             self.assertTrue(ref_counts[ref_index] == count)
 
+    def test_password_offline(self):
+        """Testing: pass audit for breached password with a local dump."""
+        data = tests.getdata('Password')
+        online = pass_audit.audit.PassAudit(data, True, self.api).password()
+
+        self._tmpdir()
+        path = os.path.join(self.prefix, 'pwned-passwords.txt')
+        tests.pwned_dump(path, sorted({
+            hashlib.sha1(entry['password'].encode()).hexdigest()[:5].upper()
+            for entry in data.values()}))  # nosec
+        api = PwnedFile(path)
+        offline = pass_audit.audit.PassAudit(data, True, api).password()
+        self.assertTrue(len(offline) == self.passwords_nb)
+        self.assertEqual(offline, online)
+
+    def test_password_prefilter(self):
+        """Testing: only retrieve the buckets of the filter hits."""
+        data = tests.getdata('Password')
+        pwned = tests.getdata('Password/pwned')
+        online = pass_audit.audit.PassAudit(data, True, self.api).password()
+
+        self._tmpdir()
+        path = os.path.join(self.prefix, 'pwned-passwords.txt')
+        prefixes = sorted({
+            hashlib.sha1(entry['password'].encode()).hexdigest()[:5].upper()
+            for entry in pwned.values()})  # nosec
+        tests.pwned_dump(path, prefixes)
+        bloom = os.path.join(self.prefix, 'pwned-passwords.bloom')
+        PwnedFilter.build(PwnedFile(path), bloom, 0.001)
+
+        self.server.requests = []
+        audit = pass_audit.audit.PassAudit(data, True, self.api,
+                                           PwnedFilter(bloom))
+        self.assertEqual(audit.password(), online)
+        self.assertEqual(len(self.server.requests), len(prefixes))
+
     def test_zxcvbn_weak(self):
         """Testing: pass audit for weak password with zxcvbn."""
         data = tests.getdata('Password/pwned/1')
@@ -51,6 +105,243 @@ class TestPassAudit(tests.Test):
         weak = audit.zxcvbn()
         self.assertTrue(len(weak) == 0)
 
+    def test_zxcvbn_jobs(self):
+        """Testing: pass audit for weak password with several processes."""
+        data = tests.getdata('Password/')
+        audit = pass_audit.audit.PassAudit(data, False)
+        ref = audit.zxcvbn()
+        for jobs in (2, 3, 32):
+            audit = pass_audit.audit.PassAudit(data, False, jobs=jobs)
+            weak = audit.zxcvbn()
+            self.assertEqual([(path, password, res['score'], res['guesses'])
+                              for path, password, res in weak],
+                             [(path, password, res['score'], res['guesses'])
+                              for path, password, res in ref])
+
+    def test_zxcvbn_cache(self):
+        """Testing: pass audit for weak password with a cache."""
+        data = tests.getdata('Password/pwned/')
+        for index in range(10):
+            data[f'Copy/clone{index}'] = data['Password/pwned/1']
+        audit = pass_audit.audit.PassAudit(data, False)
+        weak = audit.zxcvbn()
+        self.assertEqual(audit.cache.misses, 8)
+        self.assertEqual(audit.cache.hits, 9)
+        self.assertEqual(len(weak), 15)
+        for _, _, results in weak[6:]:
+            self.assertIs(results, weak[5][2])
+
+        weak = audit.zxcvbn()
+        self.assertEqual(audit.cache.misses, 8)
+        self.assertEqual(audit.cache.hits, 26)
+        self.assertEqual(len(weak), 15)
+
+    def test_zxcvbn_cache_key(self):
+        """Testing: only the relevant user inputs are in the cache key."""
+        key = pass_audit.audit.StrengthCache.key
+        self.assertEqual(key('correct horse', ['battery', 'staple']),
+                         key('correct horse', ['Password', 'good', '1']))
+        self.assertNotEqual(key('correct horse', ['horse']),
+                            key('correct horse', ['battery']))
+        self.assertNotEqual(key('c0rr3ct', ['correct']),
+                            key('c0rr3ct', ['battery']))
+        self.assertNotEqual(key('esroh', ['horse']),
+                            key('esroh', ['battery']))
+        self.assertNotEqual(key('horse', ['horse', 'a']),
+                            key('horse', ['a', 'horse']))
+        self.assertNotEqual(key('correct', []), key('horse', []))
+
+    def test_zxcvbn_cache_size(self):
+        """Testing: the zxcvbn cache is bounded."""
+        cache = pass_audit.audit.StrengthCache(2)
+        for index in range(3):
+            cache[index] = index
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache[2], 2)
+        with self.assertRaises(KeyError):
+            cache[0]  # pylint: disable=pointless-statement
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_zxcvbn_strong_filter(self):
+        """Testing: pass audit with the strong passwords fast path."""
+        data = tests.getdata('Password/')
+        audit = pass_audit.audit.PassAudit(data, False)
+        ref = audit.zxcvbn()
+        strong = pass_audit.audit.StrongFilter()
+        audit = pass_audit.audit.PassAudit(data, False, strong=strong)
+        weak = audit.zxcvbn()
+        self.assertEqual([path for path, _, _ in weak],
+                         [path for path, _, _ in ref])
+        self.assertGreater(strong.skipped, 0)
+
+    def test_zxcvbn_max_length(self):
+        """Testing: pass audit does not check too long passwords."""
+        data = tests.getdata('Password/pwned/')
+        audit = pass_audit.audit.PassAudit(data, False, max_length=8)
+        weak = audit.zxcvbn()
+        self.assertEqual(audit.unevaluated, ['Password/pwned/2',
+                                             'Password/pwned/3',
+                                             'Password/pwned/7'])
+        self.assertEqual(len(weak), 4)
+
+    def test_zxcvbn_timeout(self):
+        """Testing: pass audit stops zxcvbn when over its time budget."""
+        password = 'Wd6]i@Ba=O?X{"M&j5]*|Mw$<' * 2
+        data = {'long': {'password': password}}
+        for jobs in (1, 2):
+            audit = pass_audit.audit.PassAudit(data, False, jobs=jobs,
+                                               timeout=0.001)
+            self.assertEqual(audit.zxcvbn(), [])
+            self.assertEqual(audit.unevaluated, ['long'])
+        self.assertEqual(signal.getsignal(signal.SIGVTALRM), signal.SIG_DFL)
+
+        audit = pass_audit.audit.PassAudit(data, False, timeout=10)
+        audit.zxcvbn()
+        self.assertEqual(audit.unevaluated, [])
+
+    def test_zxcvbn_processes(self):
+        """Testing: pass audit estimates with a budget in its own process."""
+        PassAudit = pass_audit.audit.PassAudit
+        self.assertEqual(PassAudit({}, False, jobs=4).processes, 4)
+        self.assertEqual(PassAudit({}, False, timeout=2).processes, 1)
+        self.assertEqual(PassAudit({}, False).processes, 0)
+        with mock.patch.object(pass_audit.audit, 'TIMER', False):
+            self.assertEqual(PassAudit({}, False, timeout=2).processes, 0)
+
+    def test_zxcvbn_timeout_unavailable(self):
+        """Testing: pass audit has no time budget without a virtual timer."""
+        item = ('Wd6]i@Ba=O?X{"M&j5]*|Mw$<', [])
+        with mock.patch.object(pass_audit.audit, 'TIMER', False):
+            self.assertIsNotNone(pass_audit.audit.strength(item, 0.001))
+
+    def test_strong_filter_generated(self):
+        """Testing: most generated passwords are found strong."""
+        rand = random.Random(42)
+        chars = string.ascii_letters + string.digits + string.punctuation
+        strong = pass_audit.audit.StrongFilter()
+        skipped = 0
+        for _ in range(200):
+            password = ''.join(rand.choice(chars) for _ in range(25))
+            if strong.isstrong(password, ['Password', 'good', '1']):
+                skipped += 1
+        self.assertGreater(skipped, 180)
+        self.assertFalse(strong.isstrong('a' * 25, []))
+        self.assertFalse(pass_audit.audit.StrongFilter(0).isstrong(
+            'Wd6]i@Ba=O?X{"M&j5]*|Mw$<', []))
+
+    def test_strong_filter_conservative(self):
+        """Testing: a password scored 2 or less is never skipped."""
+        rand = random.Random(42)
+        chars = string.ascii_letters + string.digits + string.punctuation
+        words = ['password', 'dragon', 'monkey', 'correct', 'horse', 'love',
+                 'Password', 'jennifer', 'michael', 'qwerty', 'sunshine']
+        patterns = ['qwertyuiop', 'asdfghjkl', 'zxcvbnm', '1234567890',
+                    'abcdefghijk', '!@#$%^&*()', '97531', '2019-12-31',
+                    '19851231', '1qaz2wsx3edc', 'aaaaaaaaaa', 'abcabcabc']
+
+        def noise(low, high):
+            length = rand.randint(low, high)
+            return ''.join(rand.choice(chars) for _ in range(length))
+
+        def password():
+            kind = rand.randrange(4)
+            if kind == 0:
+                return noise(6, 30)
+            if kind == 1:
+                sep = rand.choice(['', '-', ' ', '.'])
+                parts = [rand.choice(words) for _ in range(rand.randint(1, 4))]
+                part = sep.join(parts)
+                if rand.random() < 0.5:
+                    part = part.translate(str.maketrans('aeiost', '4310$7'))
+                if rand.random() < 0.5:
+                    part = part[::-1]
+                return noise(0, 10) + part + noise(0, 10)
+            if kind == 2:
+                return noise(0, 10) + noise(1, 4) * rand.randint(2, 6)
+            return noise(0, 12) + rand.choice(patterns) + noise(0, 12)
+
+        strong = pass_audit.audit.StrongFilter(1)
+        skipped = 0
+        for _ in range(600):
+            user_input = ['Password', 'weak', rand.choice(words)]
+            pwd = password()
+            if strong.isstrong(pwd, user_input):
+                skipped += 1
+                results = pass_audit.audit.strength((pwd, user_input))
+                self.assertGreaterEqual(results['score'], 3, pwd)
+        self.assertGreater(skipped, 100)
+
+    @tests.salted()
+    def test_stream(self):
+        """Testing: pass audit stream gives the same findings."""
+        data = tests.getdata('Password/')
+        data['Password/notpwned/copy'] = data['Password/notpwned/1']
+        audit = pass_audit.audit.PassAudit(data, False, self.api)
+        breached = audit.password()
+        weak = audit.zxcvbn()
+        duplicated = audit.duplicates()
+        similar = audit.similar()
+        for jobs in (1, 2):
+            audit = pass_audit.audit.PassAudit({}, False, self.api, jobs=jobs)
+            findings = list(audit.stream(data.items(), lookups=2,
+                                         chunksize=2))
+            self.assertEqual(audit.total, len(data))
+            self.assertEqual([(path, password, count)
+                              for check, path, password, count in findings
+                              if check == 'breached'], breached)
+            self.assertEqual([(path, password, results['score'])
+                              for check, path, password, results in findings
+                              if check == 'weak'],
+                             [(path, password, results['score'])
+                              for path, password, results in weak])
+            self.assertEqual([paths for check, _, _, paths in findings
+                              if check == 'duplicated'], duplicated)
+            self.assertEqual([paths for check, _, _, paths in findings
+                              if check == 'similar'], similar)
+
+    def test_stream_prefetch(self):
+        """Testing: pass audit stream requests the buckets early."""
+        data = tests.getdata('Password/pwned/')
+        prefetched = []
+
+        def entries():
+            # The next entries are held until the first bucket is requested.
+            for path, entry in data.items():
+                yield path, entry
+                timeout = time.time() + 5
+                while not self.server.requests and time.time() < timeout:
+                    time.sleep(0.01)
+                prefetched.append(len(self.server.requests) > 0)
+
+        self.server.requests = []
+        audit = pass_audit.audit.PassAudit({}, False, self.api)
+        findings = list(audit.stream(entries()))
+        self.assertTrue(all(prefetched))
+        self.assertEqual(len([finding for finding in findings
+                              if finding[0] == 'breached']), 7)
+
+    def test_stream_reused(self):
+        """Testing: pass audit stream checks a reused password once."""
+        data = tests.getdata('Password/pwned/')
+        entries = list(data.items())
+        entries += [(f"Copy/{path}", entry) for path, entry in data.items()]
+        self.server.requests = []
+        audit = pass_audit.audit.PassAudit({}, False, self.api)
+        findings = list(audit.stream(entries, lookups=1))
+        self.assertEqual(len(self.server.requests), len(data))
+        self.assertEqual(len([finding for finding in findings
+                              if finding[0] == 'breached']), 2 * len(data))
+
+    def test_stream_stages(self):
+        """Testing: pass audit stream times the dedupe apart from the hash."""
+        data = tests.getdata('Password/pwned/')
+        stats.reset()
+        audit = pass_audit.audit.PassAudit({}, False, checks=['duplicates'])
+        list(audit.stream(data.items()))
+        stages = stats.asdict()['stages']
+        self.assertEqual(stages['hash']['calls'], 0)
+        self.assertEqual(stages['duplicates']['calls'], len(data) + 1)
+
     def test_duplicates_yes(self):
         """Testing: pass audit for duplicated passwords."""
         data = tests.getdata('Password/notpwned/1')
@@ -59,6 +350,15 @@ class TestPassAudit(tests.Test):
         duplicated = audit.duplicates()
         self.assertTrue(len(duplicated) == 1)
 
+    @tests.salted()
+    def test_similar(self):
+        """Testing: pass audit for similar passwords."""
+        data = tests.getdata('Password/pwned/')
+        audit = pass_audit.audit.PassAudit(data, True)
+        self.assertEqual(audit.similar(),
+                         [['Password/pwned/2', 'Password/pwned/3']])
+        self.assertEqual(audit.duplicates(), [])
+
     def test_duplicates_no(self):
         """Testing: pass audit for not duplicated passwords."""
         data = tests.getdata('Password/notpwned/')
@@ -69,7 +369,7 @@ class TestPassAudit(tests.Test):
     def test_empty(self):
         """Testing: pass audit for empty password."""
         data = {'empty': {'password': ''}}
-        audit = pass_audit.audit.PassAudit(data, True)
+        audit = pass_audit.audit.PassAudit(data, True, self.api)
         weak = audit.zxcvbn()
         breached = audit.password()
         duplicated = audit.duplicates()
@@ -0,0 +1,30 @@
+# -*- encoding: utf-8 -*-
+# pass-audit - test suite
+# Copyright (C) 2018-2022 Alexandre PUJOL <alexandre@pujol.io>.
+#
+
+from pass_audit.passwordstore import PasswordStore
+from tests.benchmark import BenchServer, generate
+import tests
+
+
+class TestBenchmark(tests.Test):
+    """Test the synthetic stores of the benchmark."""
+
+    def test_generate(self):
+        """Testing: synthetic store encrypted to the test key."""
+        self._tmpdir()
+        hashes = generate(self.prefix, 50, 0.2, 0.5, 0.5)
+        self.assertEqual(generate(self.prefix, 50, 0.2, 0.5, 0.5), hashes)
+        store = PasswordStore(self.prefix, 'gpg')
+        paths = store.list()
+        self.assertEqual(len(paths), 50)
+        self.assertTrue(store.show(paths[0])['password'])
+
+        server = BenchServer(hashes)
+        server.server_close()
+        phash = sorted(hashes)[0]
+        bucket = server.bucket(phash[:5])
+        self.assertIn(phash[5:], [line.split(':')[0] for line in bucket])
+        self.assertGreater(len(bucket), 800)
+        self.assertEqual(bucket, server.bucket(phash[:5]))
@@ -0,0 +1,105 @@
+# -*- encoding: utf-8 -*-
+# pass-audit - test suite
+# Copyright (C) 2018-2022 Alexandre PUJOL <alexandre@pujol.io>.
+#
+
+import random
+import string
+
+from pass_audit.duplicates import DuplicateIndex
+import tests
+
+
+class TestDuplicateIndex(tests.Test):
+    """Test the DuplicateIndex class."""
+
+    @staticmethod
+    def index(passwords, salt=b'salt'):
+        """Index passwords under the paths ``p/<index>``."""
+        index = DuplicateIndex(salt)
+        for number, password in enumerate(passwords):
+            index.add(f"p/{number}", index.record(password))
+        return index
+
+    def test_record(self):
+        """Testing: the records only contain salted digests."""
+        index = DuplicateIndex(b'salt')
+        record = index.record('Summer2023!')
+        self.assertNotIn('summer', str(record).lower())
+        self.assertEqual(record, index.record('Summer2023!'))
+        self.assertEqual(len(record['signature']), 2 * index.hashes)
+        self.assertNotEqual(record['digest'],
+                            index.record('Summer2024!')['digest'])
+        self.assertEqual(record['skeleton'],
+                         index.record('summer1?')['skeleton'])
+        self.assertNotEqual(record, DuplicateIndex(b'other').record(
+            'Summer2023!'))
+        self.assertEqual(DuplicateIndex.normalize('Summer2023!!'), 'summer0!')
+
+    def test_duplicates(self):
+        """Testing: the duplicated passwords are exact matches."""
+        index = self.index(['Summer2023!', 'Summer2024!', 'Summer2023!',
+                            'summer2023!'])
+        self.assertEqual(index.duplicates(), [['p/0', 'p/2']])
+
+    def test_similar(self):
+        """Testing: the similar passwords are clustered."""
+        index = self.index(['Summer2023!', 'correct horse battery staple',
+                            'Summer2024!', 'Tr0ub4dor&3', 'SUMMER-2025',
+                            'correcthorsebatterystaple', 'Summer2023!',
+                            'winter', 'winter'])
+        self.assertEqual(index.similar(),
+                         [['p/0', 'p/6', 'p/2', 'p/4'], ['p/1', 'p/5']])
+
+    def test_similar_short(self):
+        """Testing: the variants of short words have the same skeleton."""
+        index = self.index(['Blue2023!', 'Hello123', 'MyDog#2023', '1234',
+                            'Blue2024!', 'Hello124', 'MyDog#2024', '5678',
+                            'ab12', 'ab34'])
+        self.assertEqual(index.similar(), [['p/0', 'p/4'], ['p/1', 'p/5'],
+                                           ['p/2', 'p/6']])
+        self.assertIsNone(index.record('1234')['skeleton'])
+
+    def test_similar_random(self):
+        """Testing: the random passwords are not similar."""
+        rand = random.Random(42)
+        chars = string.ascii_letters + string.digits + string.punctuation
+        passwords = [''.join(rand.choices(chars, k=16)) for _ in range(5000)]
+        self.assertEqual(self.index(passwords).similar(), [])
+
+    def test_similar_scale(self):
+        """Testing: the similar passwords of 50k entries."""
+        rand = random.Random(42)
+        passwords = []
+        for _ in range(25000):
+            word = ''.join(rand.choices(string.ascii_lowercase, k=8))
+            passwords.append(f"{word.title()}{rand.randrange(100)}!")
+            passwords.append(''.join(rand.choices(string.ascii_letters,
+                                                  k=12)))
+        passwords[10] = passwords[0].replace('!', '?')
+        similar = self.index(passwords).similar()
+        self.assertIn(['p/0', 'p/10'], similar)
+        self.assertLess(len(similar), 10)
+
+    def test_similar_chained(self):
+        """Testing: the clusters are not chained through their members."""
+        rand = random.Random(42)
+        syllables = ['con', 'ver', 'sa', 'tion', 'de', 'gree', 'dis', 'co',
+                     'ry', 'no', 'ta', 'pro', 'gram', 'ment', 'in', 'ter']
+        chars = string.ascii_letters + string.digits + string.punctuation
+        passwords = []
+        for _ in range(5000):
+            word = ''.join(rand.choices(syllables, k=rand.randint(2, 4)))
+            passwords.append(f"{word.title()}{rand.randrange(10000)}"
+                             f"{rand.choice('!?.')}")
+            passwords.append(''.join(rand.choices(chars, k=20)))
+        index = self.index(passwords)
+        records = [index.record(password) for password in passwords]
+        for paths in index.similar():
+            leader, *members = [records[int(path[2:])] for path in paths]
+            for record in members:
+                if record['skeleton'] != leader['skeleton']:
+                    self.assertGreaterEqual(
+                        index.similarity(leader['signature'],
+                                         record['signature']),
+                        index.threshold)
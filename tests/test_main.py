@@ -4,10 +4,17 @@
 #
 
 import os
+import sys
+import json
 import shutil
+import subprocess  # nosec
 from unittest import mock
 
+from pass_audit.__main__ import pass_read
+from pass_audit.msg import Msg
 from pass_audit.passwordstore import PasswordStore
+from pass_audit.pwned import PwnedAPI
+from pass_audit.server import RangeServer
 import tests
 
 
@@ -20,6 +27,15 @@ class TestMain(tests.Test):
         cls.store = PasswordStore(tests.prefix)
         os.environ['PASSWORD_STORE_DIR'] = tests.prefix
         os.environ['_PASSWORD_STORE_EXTENSION'] = 'audit'  # nosec
+        cls.server = tests.PwnedServer()
+        cls.server.start()
+        cls.patcher = mock.patch.object(PwnedAPI, 'url', cls.server.url)
+        cls.patcher.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.patcher.stop()
+        cls.server.stop()
 
     def test_main_help(self):
         """Testing: pass audit --help."""
@@ -70,19 +86,207 @@ class TestMain(tests.Test):
         cmd = ['not_a_file']
         self.main(cmd, 1, 'not_a_file is not in the password store.')
 
-    @mock.patch('requests.get', tests.mock_request)
+    def test_main_invalid_jobs(self):
+        """Testing: pass audit --jobs 0."""
+        cmd = ['Password/', '--jobs', '0']
+        self.main(cmd, 1, 'invalid number of jobs: 0.')
+
+    def test_main_invalid_workers(self):
+        """Testing: pass audit --hibp-workers 0."""
+        cmd = ['Password/', '--hibp-workers', '0']
+        self.main(cmd, 1, 'invalid number of workers: 0.')
+
+    def test_main_invalid_entropy(self):
+        """Testing: pass audit --fast-entropy -1."""
+        cmd = ['Password/', '--fast-entropy', '-1']
+        self.main(cmd, 1, 'invalid entropy: -1.0.')
+
+    def test_main_invalid_timeout(self):
+        """Testing: pass audit --zxcvbn-timeout -1."""
+        cmd = ['Password/', '--zxcvbn-timeout', '-1']
+        self.main(cmd, 1, 'invalid timeout: -1.0.')
+
+    def test_main_invalid_max_length(self):
+        """Testing: pass audit --zxcvbn-max-length 0."""
+        cmd = ['Password/', '--zxcvbn-max-length', '0']
+        self.main(cmd, 1, 'invalid maximum length: 0.')
+
+    def test_main_max_length(self):
+        """Testing: pass audit Password/pwned --zxcvbn-max-length 8."""
+        cmd = ['Password/pwned/', '--zxcvbn-max-length', '8']
+        with tests.captured() as (out, _):
+            self.main(cmd)
+        self.assertIn('3 passwords not evaluated, they are too long or too '
+                      'slow to check with zxcvbn: Password/pwned/2, '
+                      'Password/pwned/3, Password/pwned/7', out.getvalue())
+
+    def test_main_pass_read(self):
+        """Testing: parallel read of the password store."""
+        msg = Msg()
+        paths = self.store.list('Password')
+        paths.insert(3, 'Password/not_a_file')
+        with tests.captured() as (out, _):
+            data = dict(pass_read(msg, self.store, paths, 4))
+        self.assertIn('Impossible to read Password/not_a_file', out.getvalue())
+        paths.remove('Password/not_a_file')
+        self.assertEqual(list(data.keys()), paths)
+        self.assertEqual(data, tests.getdata('Password'))
+
+    def test_main_passwords_jobs(self):
+        """Testing: pass audit Password/ --jobs 2."""
+        cmd = ['Password/', '--jobs', '2']
+        self.main(cmd)
+
+    def test_main_passwords_backend_gpg(self):
+        """Testing: pass audit Password/ --backend gpg."""
+        cmd = ['Password/', '--backend', 'gpg']
+        self.main(cmd)
+
+    def test_main_passwords_backend_gpgme(self):
+        """Testing: pass audit Password/ --backend gpgme."""
+        cmd = ['Password/', '--backend', 'gpgme']
+        self.main(cmd)
+
+    def test_main_passwords_offline(self):
+        """Testing: pass audit Password/ --hibp-file <path>."""
+        self._tmpdir()
+        path = os.path.join(self.prefix, 'pwned-passwords.txt')
+        tests.pwned_dump(path, ['21BD1'])
+        cmd = ['Password/', '--hibp-file', path]
+        self.main(cmd)
+
+    def test_main_hibp_file_missing(self):
+        """Testing: pass audit --hibp-file not_a_file."""
+        cmd = ['Password/', '--hibp-file', 'not_a_file']
+        self.main(cmd, 1, 'impossible to read not_a_file')
+
+    def test_main_hibp_url(self):
+        """Testing: pass audit --hibp-url <url>."""
+        server = tests.PwnedServer()
+        server.start()
+        try:
+            cmd = ['Password/pwned', '--hibp-url', server.url, '--no-cache']
+            self.main(cmd)
+            self.assertEqual(len(server.requests), 7)
+        finally:
+            server.stop()
+
+    def test_main_serve_ranges(self):
+        """Testing: pass audit serve-ranges --hibp-file <path>."""
+        self._tmpdir()
+        source = os.path.join(self.prefix, 'pwned-passwords.txt')
+        tests.pwned_dump(source, ['21BD1'])
+        cmd = ['serve-ranges', '--hibp-file', source, '--port', '8081']
+        with mock.patch.object(RangeServer, 'serve') as serve:
+            with tests.captured() as (out, _):
+                self.main(cmd)
+        serve.assert_called_once_with('127.0.0.1', 8081)
+        self.assertIn('on http://127.0.0.1:8081', out.getvalue())
+
+        with tests.captured():
+            self.main(['serve-ranges'], 2)
+        cmd = ['serve-ranges', '--hibp-file', 'not_a_file']
+        self.main(cmd, 1, 'impossible to read not_a_file')
+
+    def test_main_build_index(self):
+        """Testing: pass audit --hibp-file <path> --build-index <path>."""
+        self._tmpdir()
+        source = os.path.join(self.prefix, 'pwned-passwords.txt')
+        path = os.path.join(self.prefix, 'pwned-passwords.idx')
+        tests.pwned_dump(source, ['21BD1'])
+        cmd = ['--hibp-file', source, '--build-index', path]
+        self.main(cmd)
+        self.assertTrue(os.path.isfile(path))
+
+        cmd = ['Password/', '--hibp-index', path]
+        self.main(cmd)
+
+    def test_main_build_filter(self):
+        """Testing: pass audit --hibp-file <path> --build-filter <path>."""
+        self._tmpdir()
+        source = os.path.join(self.prefix, 'pwned-passwords.txt')
+        path = os.path.join(self.prefix, 'pwned-passwords.bloom')
+        tests.pwned_dump(source, ['21BD1'])
+        cmd = ['--hibp-file', source, '--build-filter', path,
+               '--fp-rate', '0.001']
+        self.main(cmd)
+        self.assertTrue(os.path.isfile(path))
+
+        cmd = ['Password/', '--hibp-filter', path]
+        self.main(cmd)
+
+    def test_main_build_filter_no_source(self):
+        """Testing: pass audit --build-filter <path>."""
+        cmd = ['--build-filter', 'pwned-passwords.bloom']
+        self.main(cmd, 1, '--build-filter requires a Pwned Passwords file')
+
+    def test_main_hibp_filter_missing(self):
+        """Testing: pass audit --hibp-filter not_a_file."""
+        cmd = ['Password/', '--hibp-filter', 'not_a_file']
+        self.main(cmd, 1, 'impossible to read not_a_file')
+
+    def test_main_build_index_no_source(self):
+        """Testing: pass audit --build-index <path>."""
+        cmd = ['--build-index', 'pwned-passwords.idx']
+        self.main(cmd, 1, '--build-index requires a Pwned Passwords file')
+
+    def test_main_build_index_error(self):
+        """Testing: pass audit --hibp-file not_a_file --build-index <path>."""
+        self._tmpdir()
+        path = os.path.join(self.prefix, 'pwned-passwords.idx')
+        cmd = ['--hibp-file', 'not_a_file', '--build-index', path]
+        self.main(cmd, 1, f'impossible to build {path}')
+
+    def test_main_passwords_no_cache(self):
+        """Testing: pass audit Password/ --no-cache."""
+        cmd = ['Password/', '--no-cache']
+        self.main(cmd)
+
+    def test_main_passwords_incremental(self):
+        """Testing: pass audit Password/ --incremental."""
+        cmd = ['Password/', '--incremental', '--backend', 'gpg', '-v']
+        shutil.rmtree(os.path.join(os.environ['XDG_CACHE_HOME'],
+                                   'pass-audit', 'state'), ignore_errors=True)
+        with tests.captured() as (out, _):
+            self.main(cmd)
+        self.assertIn('Reading Password/good/1', out.getvalue())
+
+        with tests.captured() as (out, err):
+            self.main(cmd)
+        self.assertIn('Skipping 17 unchanged passwords', out.getvalue())
+        self.assertNotIn('Reading Password/good/1', out.getvalue())
+        self.assertIn('17 passwords tested and 7 breached', err.getvalue())
+
+        # An audit of a folder does not forget the rest of the store.
+        self.main(['Password/good', '--incremental', '--backend', 'gpg'])
+        with tests.captured() as (out, err):
+            self.main(cmd)
+        self.assertIn('Skipping 17 unchanged passwords', out.getvalue())
+
+    def test_main_passwords_incremental_unevaluated(self):
+        """Testing: pass audit --incremental keeps the unevaluated ones."""
+        cmd = ['Password/good', '--incremental', '--backend', 'gpg',
+               '--zxcvbn-max-length', '1', '-v']
+        shutil.rmtree(os.path.join(os.environ['XDG_CACHE_HOME'],
+                                   'pass-audit', 'state'), ignore_errors=True)
+        for _ in range(2):
+            with tests.captured() as (out, _):
+                self.main(cmd)
+            self.assertIn('passwords not evaluated', out.getvalue())
+            self.assertIn('check with zxcvbn: Password/good/1',
+                          out.getvalue())
+        self.assertIn('unchanged passwords', out.getvalue())
+
     def test_main_passwords_notpwned(self):
         """Testing: pass audit Password/notpwned."""
         cmd = ['Password/notpwned']
         self.main(cmd)
 
-    @mock.patch('requests.get', tests.mock_request)
     def test_main_passwords_pwned(self):
         """Testing: pass audit Password/pwned."""
         cmd = ['Password/pwned']
         self.main(cmd)
 
-    @mock.patch('requests.get', tests.mock_request)
     def test_main_passwords_duplicate(self):
         """Testing: pass audit for duplicates."""
         shutil.copy(os.path.join(self.store.prefix, 'Password/good/1.gpg'),
@@ -91,13 +295,145 @@ class TestMain(tests.Test):
         self.main(cmd)
         os.remove(os.path.join(self.store.prefix, 'Password/good/10.gpg'))
 
-    @mock.patch('requests.get', tests.mock_request)
+    @tests.salted()
+    def test_main_passwords_similar(self):
+        """Testing: pass audit for similar passwords."""
+        cmd = ['Password/pwned']
+        with tests.captured() as (out, err):
+            self.main(cmd)
+        self.assertIn('Similar passwords detected in Password/pwned/2, '
+                      'Password/pwned/3', out.getvalue())
+        self.assertIn('0 duplicated and 1 similar passwords found',
+                      err.getvalue())
+
+    def test_main_stores(self):
+        """Testing: pass audit --store for reuse across stores."""
+        self._tmpdir()
+        team = os.path.join(self.prefix, 'team')
+        shutil.copytree(self.store.prefix, team)
+        cmd = ['Password/good', '--store', team, '--store',
+               f'infra={team}']
+        with tests.captured() as (out, _):
+            self.main(cmd)
+        self.assertIn('Duplicated passwords detected in audit-store:Password'
+                      '/good/1, team:Password/good/1, infra:Password/good/1',
+                      out.getvalue())
+
+        # The unchanged entries of every store are skipped.
+        for _ in range(2):
+            with tests.captured() as (out, _):
+                self.main(cmd + ['--incremental', '-v'])
+        self.assertIn('Skipping 9 unchanged passwords', out.getvalue())
+        self.assertIn('infra:Password/good/1', out.getvalue())
+
+    def test_main_stores_invalid(self):
+        """Testing: pass audit --store with invalid stores."""
+        self._tmpdir()
+        self.main(['--store', self.store.prefix], 1,
+                  'invalid store name: audit-store, use --store NAME=PATH.')
+        self.main(['--store', f'team={self.prefix}'], 1,
+                  f'no password store to audit in {self.prefix}.')
+
+    def test_main_ndjson(self):
+        """Testing: pass audit --format ndjson."""
+        cmd = ['Password/pwned', '--format', 'ndjson', '-v']
+        with tests.captured() as (out, err):
+            self.main(cmd)
+        records = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(len([record for record in records
+                              if record['check'] == 'breached']), 7)
+        self.assertEqual(records[-1]['check'], 'summary')
+        self.assertEqual(records[-1]['total'], 7)
+        self.assertIn('Checking the passwords', err.getvalue())
+
+    def test_main_json(self):
+        """Testing: pass audit --format json --with-passwords."""
+        cmd = ['Password/pwned', '--format', 'json', '--with-passwords']
+        with tests.captured() as (out, _):
+            self.main(cmd)
+        document = json.loads(out.getvalue())
+        self.assertEqual(document['summary']['breached'], 7)
+        self.assertIn('password', document['findings'][0])
+
+    def test_main_stats(self):
+        """Testing: pass audit --stats."""
+        cmd = ['Password/pwned', '--stats', '--backend', 'gpg']
+        with tests.captured() as (out, _):
+            self.main(cmd)
+        self.assertIn('decrypt', out.getvalue())
+        self.assertIn('http requests: ', out.getvalue())
+
+        cmd = ['Password/pwned', '--stats', '--format', 'ndjson',
+               '--backend', 'gpg', '--no-cache']
+        with tests.captured() as (out, _):
+            self.main(cmd)
+        records = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(records[-2]['check'], 'stats')
+        self.assertEqual(records[-2]['stages']['decrypt']['calls'], 7)
+        self.assertEqual(records[-2]['stages']['list']['calls'], 8)
+        self.assertGreater(records[-2]['stages']['hibp']['calls'], 0)
+        self.assertGreaterEqual(records[-2]['counters']['subprocesses'], 7)
+        self.assertEqual(records[-2]['counters']['http_requests'], 7)
+
     def test_main_passwords_good(self):
         """Testing: pass audit Password/good."""
         cmd = ['Password/good']
         self.main(cmd)
 
-    @mock.patch('requests.get', tests.mock_request)
+    def test_main_passwords_paths(self):
+        """Testing: pass audit Password/good Password/notpwned/1."""
+        cmd = ['Password/good', 'Password/notpwned/1', '-v']
+        with tests.captured() as (out, _):
+            self.main(cmd)
+        self.assertIn('Reading Password/good/3', out.getvalue())
+        self.assertIn('Reading Password/notpwned/1', out.getvalue())
+        self.assertNotIn('Reading Password/notpwned/2', out.getvalue())
+        self.assertIn('None of the 4 passwords', out.getvalue())
+
+    @tests.salted()
+    def test_main_checks(self):
+        """Testing: pass audit --checks duplicates, --skip breach."""
+        cmd = ['Password/', '--checks', 'duplicates', '--format', 'ndjson',
+               '--backend', 'gpg']
+        with mock.patch.object(PwnedAPI, 'password_range',
+                               side_effect=AssertionError):
+            with tests.captured() as (out, _):
+                self.main(cmd)
+        records = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(records[-1]['breached'], 0)
+        self.assertEqual(records[-1]['weak'], 0)
+        self.assertEqual(records[-1]['similar'], 1)
+
+        cmd = ['Password/', '--skip', 'breach, duplicates', '--format',
+               'ndjson', '--backend', 'gpg']
+        with mock.patch.object(PwnedAPI, 'password_range',
+                               side_effect=AssertionError):
+            with tests.captured() as (out, _):
+                self.main(cmd)
+        records = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual({record['check'] for record in records[:-1]},
+                         {'weak'})
+
+    def test_main_checks_imports(self):
+        """Testing: requests, zxcvbn and gpg are only imported when needed."""
+        code = ("import sys; import pass_audit.__main__ as main; "
+                "sys.argv = ['', 'Password/good', '--checks', 'duplicates', "
+                "'--backend', 'gpg', '-q']; main.main(); "
+                "print(sorted({'requests', 'zxcvbn', 'gpg'} & "
+                "set(sys.modules)))")
+        res = subprocess.run([sys.executable, '-c', code],  # nosec
+                             stdout=subprocess.PIPE, check=True,
+                             universal_newlines=True)
+        self.assertEqual(res.stdout.splitlines()[-1], '[]')
+
+    def test_main_invalid_checks(self):
+        """Testing: pass audit --checks not-a-check, --skip all checks."""
+        cmd = ['Password/', '--checks', 'breach,not-a-check']
+        self.main(cmd, 1, 'invalid check: not-a-check, use breach, strength, '
+                  'duplicates.')
+        cmd = ['Password/', '--checks', 'breach', '--skip', 'breach']
+        self.main(cmd, 1, 'no check to run.')
+
     def test_main_passwords_all(self):
         """Testing: pass audit ."""
         cmd = ['']
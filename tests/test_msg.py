@@ -100,3 +100,13 @@ class TestMsg(tests.Test):
         self.assertEqual(
             message,
             '\x1b[1m\x1b[91m [x] \x1b[0m\x1b[1mError: \x1b[0mcritical error')
+
+    def test_stderr(self):
+        """Testing: messages on stderr, stdout is used by a report."""
+        msg = pass_audit.msg.Msg(1, stderr=True)
+        with tests.captured() as (out, err):
+            msg.verbose('verbose message')
+            msg.warning('warning message')
+        self.assertEqual(out.getvalue(), '')
+        self.assertIn('verbose message', err.getvalue())
+        self.assertIn('warning message', err.getvalue())
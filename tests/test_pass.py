@@ -5,7 +5,9 @@
 
 import os
 
-from pass_audit.passwordstore import PasswordStore, PasswordStoreError
+from pass_audit.passwordstore import (GPGME, PasswordStore, PasswordStoreError,
+                                      PasswordStores)
+from pass_audit.stats import stats
 import tests
 
 
@@ -39,6 +41,11 @@ class TestExportPassGeneral(tests.Test):
         store.prefix = self.store.prefix
         self.assertEqual(store.env['PASSWORD_STORE_DIR'], self.store.prefix)
 
+    def test_pass_backend(self):
+        """Testing: unknown backend."""
+        with self.assertRaises(PasswordStoreError):
+            PasswordStore(self.prefix, 'not-a-backend')
+
     def test_pass_exist(self):
         """Testing: store not initialized."""
         self.assertFalse(self.store.exist())
@@ -47,6 +54,31 @@ class TestExportPassGeneral(tests.Test):
         self._init_pass()
         self.assertTrue(self.store.exist())
 
+    def test_pass_walk(self):
+        """Testing: the hidden folders are not entered, paths are sorted."""
+        for path in ['Team/b', 'Team.c', 'Team/a/z', '.git/objects/x',
+                     'Team/.hidden', 'a']:
+            path = os.path.join(self.prefix, path + '.gpg')
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            open(path, 'w').close()
+        paths = self.store.walk()
+        self.assertEqual(next(paths), 'Team.c')
+        self.assertEqual(list(paths), ['Team/a/z', 'Team/b', 'a'])
+        self.assertEqual(self.store.list(), sorted(self.store.list()))
+
+    def test_pass_walk_links(self):
+        """Testing: the linked folders are not entered."""
+        for path in ['Team.gpg', 'Team/a.gpg', 'Team/b/c.gpg']:
+            path = os.path.join(self.prefix, path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            open(path, 'w').close()
+        os.symlink(os.pardir, os.path.join(self.prefix, 'Team', 'loop'))
+        os.symlink('Team', os.path.join(self.prefix, 'link'))
+        self.assertEqual(self.store.list(), ['Team', 'Team/a', 'Team/b/c'])
+        self.assertEqual(self.store.list('Team'), ['Team'])
+        self.assertEqual(self.store.list('Team/'), ['Team/a', 'Team/b/c'])
+        self.assertEqual(self.store.list('link'), ['link/a', 'link/b/c'])
+
     def test_pass_valid_credentials(self):
         """Testing: valid credentials."""
         self.gpgids = ['D4C78DB7920E1E27F5416B81CC9DB947CF90C77B',
@@ -63,6 +95,76 @@ class TestExportPassGeneral(tests.Test):
         self._init_pass()
         self.assertFalse(self.store.isvalid())
 
+    def test_pass_nested_credentials(self):
+        """Testing: the .gpg-id files of the subfolders are checked."""
+        self._init_pass()
+        os.makedirs(os.path.join(self.prefix, 'Team', '.git'))
+        with open(os.path.join(self.prefix, 'Team', '.git', '.gpg-id'),
+                  'w') as file:
+            file.write('FFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF\n')
+        self.assertEqual(self.store.gpgidpaths(), [''])
+
+        with open(os.path.join(self.prefix, 'Team', '.gpg-id'), 'w') as file:
+            file.write('0x95C4B715EB7D54A8 # key 3\npass test key 2\n')
+        self.assertEqual(self.store.gpgidpaths(), ['', 'Team'])
+        self.assertEqual(self.store.gpgids('Team'),
+                         ['0x95C4B715EB7D54A8', 'pass test key 2'])
+        self.assertTrue(self.store.isvalid())
+
+        with open(os.path.join(self.prefix, 'Team', '.gpg-id'), 'a') as file:
+            file.write('FFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF\n')
+        self.assertFalse(self.store.isvalid())
+
+    def test_pass_governing_credentials(self):
+        """Testing: only the .gpg-id files of the pass-names are checked."""
+        self._init_pass()
+        for path in ['Team/a/b.gpg', 'Team/a/c/d.gpg', 'Other/e.gpg']:
+            path = os.path.join(self.prefix, path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            open(path, 'w').close()
+        for path in ['Team', 'Team/a/c', 'Other']:
+            with open(os.path.join(self.prefix, path, '.gpg-id'),
+                      'w') as file:
+                file.write('FFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF\n')
+        self.assertEqual(self.store.gpgidpaths(),
+                         ['', 'Other', 'Team', 'Team/a/c'])
+        self.assertEqual(self.store.gpgidpaths(['Team/a/b']), ['Team'])
+        self.assertEqual(self.store.gpgidpaths(['Team/a/']),
+                         ['Team', 'Team/a/c'])
+        self.assertEqual(self.store.gpgidpaths(['Password', 'Other/e']),
+                         ['', 'Other'])
+        self.assertFalse(self.store.isvalid(paths=['Team']))
+        os.remove(os.path.join(self.prefix, 'Team', '.gpg-id'))
+        self.assertTrue(self.store.isvalid(paths=['Team/a/b', 'Password']))
+        self.assertFalse(self.store.isvalid(paths=['Team/a']))
+
+        # The nested .gpg-id files are checked as the walk enters them.
+        self.assertTrue(self.store.isvalid(paths=['Team/a'], nested=False))
+        paths = self.store.walk(['Team/a'], valid=True)
+        self.assertEqual(next(paths), 'Team/a/b')
+        with self.assertRaises(PasswordStoreError):
+            next(paths)
+
+    def test_pass_cached_credentials(self):
+        """Testing: a single call to gpg, then the keyring is cached."""
+        self.gpgids = ['D4C78DB7920E1E27F5416B81CC9DB947CF90C77B',
+                       '70BD448330ACF0653645B8F2B4DDBFF0D774A374',
+                       '62EBE74BE834C2EC71E6414595C4B715EB7D54A8', '']
+        self._init_pass()
+        cache = os.path.join(self.prefix, 'keyring')
+        stats.reset()
+        self.assertTrue(self.store.isvalid(cache))
+        self.assertEqual(stats.asdict()['counters']['subprocesses'], 1)
+        self.assertTrue(self.store.isvalid(cache))
+        self.assertEqual(stats.asdict()['counters']['subprocesses'], 1)
+
+        self.gpgids = self.gpgids[:1] + ['']
+        self._init_pass()
+        self.assertTrue(self.store.isvalid(cache))
+        self.assertEqual(stats.asdict()['counters']['subprocesses'], 2)
+        with open(cache) as file:
+            self.assertEqual(len(file.read().split()), 2)
+
     def test_pass_empty_credentials(self):
         """Testing: empty credentials."""
         self.gpgids = ['']
@@ -104,6 +206,14 @@ class TestExportPassShow(tests.Test):
         ref = ['Emails/WS/dpbx@fner.ws', 'Emails/WS/dpbx@mnyfymt.ws']
         self.assertEqual(self.store.list('Emails/WS'), ref)
 
+    def test_pass_walk_paths(self):
+        """Testing: pass list of several pass-names."""
+        paths = ['Social/twitter.com', 'Emails/WS', 'Emails', 'not_a_file']
+        ref = ['Social/twitter.com', 'Emails/WS/dpbx@fner.ws',
+               'Emails/WS/dpbx@mnyfymt.ws', 'Emails/dpbx@afoqwdr.tx',
+               'Emails/dpbx@klivak.xb']
+        self.assertEqual(list(self.store.walk(paths)), ref)
+
     def test_pass_list_limit_filename(self):
         """Testing: pass list **/<filename>"""
         prefix = tests.assets + 'audit-store'
@@ -145,3 +255,53 @@ class TestExportPassShow(tests.Test):
                               ' sift.')}
 
         self.assertEqual(self.store.show(path), entry)
+
+    def test_pass_show_gpg(self):
+        """Testing: gpg backend show Social/mastodon.social."""
+        path = "Social/mastodon.social"
+        store = PasswordStore(self.store.prefix, 'gpg')
+        entry = {'group': 'Social',
+                 'login': 'ostqxi',
+                 'otpauth': ('otpauth://totp/mastodon.social:ostqxi?secret='
+                             'JBSWY3DPEHPK3PXP'),
+                 'password': "D<INNeT?#?Bf4%`zA/4i!/'$T",
+                 'title': 'mastodon.social',
+                 'url': 'mastodon.social/'}
+        self.assertEqual(store.show(path), entry)
+        with self.assertRaises(PasswordStoreError):
+            store.show('not_a_file')
+
+    def test_pass_show_backends(self):
+        """Testing: pass and gpg backends read identical entries."""
+        store = PasswordStore(self.store.prefix, 'gpg')
+        for path in self.store.list():
+            self.assertEqual(store.show(path), self.store.show(path))
+
+    def test_pass_show_gpgme(self):
+        """Testing: gpgme backend read the same entries than pass."""
+        store = PasswordStore(self.store.prefix, 'gpgme')
+        self.assertEqual(store.backend, 'gpgme' if GPGME else 'gpg')
+        for path in self.store.list():
+            self.assertEqual(store.show(path), self.store.show(path))
+        with self.assertRaises(PasswordStoreError):
+            store.show('not_a_file')
+
+    def test_pass_stores(self):
+        """Testing: several password stores with qualified paths."""
+        audit = PasswordStore(tests.prefix)
+        stores = PasswordStores({'pass': self.store, 'audit': audit})
+        self.assertEqual(PasswordStores.name(tests.prefix), 'audit-store')
+        self.assertEqual(PasswordStores.name('~/.password-store/'),
+                         'password-store')
+        self.assertEqual(stores.list(filename='1'),
+                         ['audit:Password/good/1', 'audit:Password/notpwned/1',
+                          'audit:Password/pwned/1'])
+        self.assertEqual(stores.list('Emails/WS'),
+                         ['pass:Emails/WS/dpbx@fner.ws',
+                          'pass:Emails/WS/dpbx@mnyfymt.ws'])
+        self.assertEqual(stores.show('pass:Social/mastodon.social'),
+                         self.store.show('Social/mastodon.social'))
+        self.assertEqual(stores.show('audit:Password/good/1'),
+                         audit.show('Password/good/1'))
+        self.assertEqual(stores.passfile('audit:dummy'),
+                         os.path.join(tests.prefix, 'dummy.gpg'))
@@ -3,25 +3,285 @@
 # Copyright (C) 2018-2022 Alexandre PUJOL <alexandre@pujol.io>.
 #
 
-from unittest import mock
+import os
+import hashlib
 
-import pass_audit.audit
+import requests
+
+import pass_audit.pwned
 import tests
 
 
+class TestBucket(tests.Test):
+    """Test the Bucket class."""
+
+    def setUp(self):
+        text = '\r\n'.join(tests.PwnedHandler.data)
+        self.bucket = pass_audit.pwned.Bucket.from_text('21BD1', text)
+
+    def test_count(self):
+        """Testing: count lookup in a bucket."""
+        for item in tests.PwnedHandler.data:
+            suffix, count = item.split(':')
+            phash = '21BD1' + suffix
+            self.assertEqual(self.bucket.count(phash), int(count))
+            self.assertEqual(self.bucket.count(phash.lower()), int(count))
+            self.assertIn(phash, self.bucket)
+        self.assertEqual(self.bucket.count('21BD1' + '0' * 35), 0)
+        self.assertEqual(self.bucket.count('21BD1' + 'F' * 35), 0)
+        self.assertNotIn('21BD2' + tests.PwnedHandler.data[0][:35],
+                         self.bucket)
+
+    def test_iter(self):
+        """Testing: iterate over a bucket, in hash order."""
+        ref = sorted(('21BD1' + item.split(':')[0], int(item.split(':')[1]))
+                     for item in tests.PwnedHandler.data)
+        self.assertEqual(list(self.bucket), ref)
+        self.assertTrue(len(self.bucket) == 11)
+
+    def test_from_records(self):
+        """Testing: a bucket is the same whatever its origin."""
+        records = [(bytes.fromhex(phash), count)
+                   for phash, count in self.bucket]
+        bucket = pass_audit.pwned.Bucket.from_records('21BD1', records[::-1])
+        self.assertEqual(bucket, self.bucket)
+
+    def test_empty(self):
+        """Testing: empty bucket."""
+        bucket = pass_audit.pwned.Bucket('00000')
+        self.assertTrue(len(bucket) == 0)
+        self.assertEqual(bucket.count('0' * 40), 0)
+
+
 class TestPwnedAPI(tests.Test):
     """Test the PwnedAPI class."""
 
+    @classmethod
+    def setUpClass(cls):
+        cls.server = tests.PwnedServer()
+        cls.server.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
     def setUp(self):
-        self.api = pass_audit.audit.PwnedAPI()
+        self.server.requests = []
+        self.api = pass_audit.pwned.PwnedAPI(self.server.url)
 
-    @mock.patch('requests.get', tests.mock_request)
     def test_password_range(self):
         """Testing: https://api.haveibeenpwned.com/range API."""
         prefix = '21BD1'
         phash = '21BD12DC183F740EE76F27B78EB39C8AD972A757'
-        hashes, counts = self.api.password_range(prefix)
-        self.assertIn(phash, hashes)
-        self.assertTrue(counts[hashes.index(phash)] == 52579)
-        self.assertTrue(len(hashes) == len(counts))
-        self.assertTrue(len(hashes) == 11)
+        bucket = self.api.password_range(prefix)
+        self.assertIn(phash, bucket)
+        self.assertTrue(bucket.count(phash) == 52579)
+        self.assertTrue(len(bucket) == 11)
+        self.assertEqual(self.server.requests, ['/range/21BD1'])
+
+    def test_password_ranges(self):
+        """Testing: concurrent retrieval of several buckets."""
+        prefixes = ['21BD1', '5BAA6', 'CBFDA', '00000']
+        buckets = dict(self.api.password_ranges(prefixes))
+        self.assertEqual(list(buckets.keys()), prefixes)
+        for prefix, bucket in buckets.items():
+            self.assertTrue(len(bucket) == 11)
+            self.assertEqual(bucket.prefix, prefix)
+        self.assertEqual(sorted(self.server.requests),
+                         sorted(f"/range/{prefix}" for prefix in prefixes))
+
+    def test_password_range_retry(self):
+        """Testing: retry the requests rejected with a 429 error."""
+        self.server.failures = 2
+        bucket = self.api.password_range('21BD1')
+        self.assertTrue(len(bucket) == 11)
+        self.assertTrue(len(self.server.requests) == 3)
+
+    def test_password_range_too_many_retries(self):
+        """Testing: give up after too many 429 errors."""
+        self.server.failures = 3
+        api = pass_audit.pwned.PwnedAPI(self.server.url, retries=1)
+        with self.assertRaises(requests.exceptions.RetryError):
+            api.password_range('21BD1')
+        self.server.failures = 0
+
+
+class TestPwnedCache(tests.Test):
+    """Test the PwnedCache class."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = tests.PwnedServer()
+        cls.server.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self._tmpdir()
+        self.server.requests = []
+        self.server.notmodified = 0
+
+    def api(self, ttl=3600, size=2**20):
+        """Get a client using a cache in the test directory."""
+        cache = pass_audit.pwned.PwnedCache(self.prefix, ttl, size)
+        return pass_audit.pwned.PwnedAPI(self.server.url, cache=cache)
+
+    def test_cache_default_path(self):
+        """Testing: cache in XDG_CACHE_HOME."""
+        cache = pass_audit.pwned.PwnedCache()
+        self.assertEqual(cache.path, os.path.join(
+            os.environ['XDG_CACHE_HOME'], 'pass-audit', 'ranges'))
+
+    def test_cache_fresh(self):
+        """Testing: a fresh bucket is not retrieved again."""
+        api = self.api()
+        ref = api.password_range('21BD1')
+        self.assertEqual(api.password_range('21BD1'), ref)
+        self.assertEqual(self.api().password_range('21BD1'), ref)
+        self.assertEqual(self.server.requests, ['/range/21BD1'])
+        self.assertEqual(os.listdir(self.prefix), ['21BD1'])
+
+    def test_cache_revalidate(self):
+        """Testing: an expired bucket is revalidated with its ETag."""
+        api = self.api(ttl=0)
+        ref = api.password_range('21BD1')
+        self.assertEqual(api.password_range('21BD1'), ref)
+        self.assertTrue(len(self.server.requests) == 2)
+        self.assertTrue(self.server.notmodified == 1)
+
+    def test_cache_eviction(self):
+        """Testing: the least recently used buckets are evicted."""
+        api = self.api(size=1600)
+        for prefix in ['00000', '11111', '22222']:
+            api.password_range(prefix)
+        os.utime(os.path.join(self.prefix, '00000'), (0, 0))
+        api.password_range('33333')
+        self.assertEqual(sorted(os.listdir(self.prefix)),
+                         ['11111', '22222', '33333'])
+
+
+class TestPwnedFile(tests.Test):
+    """Test the PwnedFile class."""
+    prefixes = ['00000', '21BD1', '5BAA6', 'CBFDA', 'FFFFF']
+
+    def setUp(self):
+        self._tmpdir()
+        self.path = os.path.join(self.prefix, 'pwned-passwords.txt')
+        tests.pwned_dump(self.path, self.prefixes)
+        self.api = pass_audit.pwned.PwnedFile(self.path)
+
+    def test_password_range(self):
+        """Testing: retrieve a bucket from a local dump."""
+        phash = '21BD12DC183F740EE76F27B78EB39C8AD972A757'
+        for prefix in self.prefixes:
+            bucket = self.api.password_range(prefix)
+            self.assertTrue(len(bucket) == 11)
+            for item, _ in bucket:
+                self.assertTrue(item.startswith(prefix))
+        bucket = self.api.password_range('21BD1')
+        self.assertTrue(bucket.count(phash) == 52579)
+
+    def test_password_range_missing(self):
+        """Testing: retrieve a bucket not in the local dump."""
+        for prefix in ['00001', '21BD0', '21BD2', 'FFFFE']:
+            bucket = self.api.password_range(prefix)
+            self.assertTrue(len(bucket) == 0)
+            self.assertEqual(bucket.prefix, prefix)
+
+    def test_password_ranges(self):
+        """Testing: retrieve several buckets from a local dump."""
+        buckets = dict(self.api.password_ranges(['21BD1', '21BD2']))
+        self.assertEqual(list(buckets.keys()), ['21BD1', '21BD2'])
+        self.assertTrue(len(buckets['21BD1']) == 11)
+        self.assertTrue(len(buckets['21BD2']) == 0)
+
+
+class TestPwnedIndex(tests.Test):
+    """Test the PwnedIndex class."""
+    prefixes = ['00000', '21BD1', '5BAA6', 'CBFDA', 'FFFFF']
+
+    def setUp(self):
+        self._tmpdir()
+        self.source = os.path.join(self.prefix, 'pwned-passwords.txt')
+        self.path = os.path.join(self.prefix, 'pwned-passwords.idx')
+        tests.pwned_dump(self.source, self.prefixes)
+
+    def test_build(self):
+        """Testing: build a binary index from a local dump."""
+        total = pass_audit.pwned.PwnedIndex.build(self.source, self.path)
+        self.assertTrue(total == 11 * len(self.prefixes))
+        self.assertTrue(os.path.getsize(self.path) <
+                        os.path.getsize(self.source) + 4 * (2**20 + 2))
+
+    def test_build_not_ordered(self):
+        """Testing: build a binary index from an unordered dump."""
+        with open(self.source, 'a') as file:
+            file.write('0000000000000000000000000000000000000000:1\r\n')
+        with self.assertRaises(ValueError):
+            pass_audit.pwned.PwnedIndex.build(self.source, self.path)
+
+    def test_not_an_index(self):
+        """Testing: open a file that is not a binary index."""
+        with self.assertRaises(ValueError):
+            pass_audit.pwned.PwnedIndex(self.source)
+
+    def test_password_range(self):
+        """Testing: the index returns the same buckets than the dump."""
+        pass_audit.pwned.PwnedIndex.build(self.source, self.path)
+        index = pass_audit.pwned.PwnedIndex(self.path)
+        dump = pass_audit.pwned.PwnedFile(self.source)
+        prefixes = self.prefixes + ['00001', '21BD0', '21BD2', 'FFFFE']
+        self.assertEqual(list(index.password_ranges(prefixes)),
+                         list(dump.password_ranges(prefixes)))
+
+
+class TestPwnedFilter(tests.Test):
+    """Test the PwnedFilter class."""
+    prefixes = ['00000', '21BD1', '5BAA6', 'CBFDA', 'FFFFF']
+
+    def setUp(self):
+        self._tmpdir()
+        self.source = os.path.join(self.prefix, 'pwned-passwords.txt')
+        self.path = os.path.join(self.prefix, 'pwned-passwords.bloom')
+        tests.pwned_dump(self.source, self.prefixes)
+        self.dump = pass_audit.pwned.PwnedFile(self.source)
+
+    def test_build(self):
+        """Testing: build a filter from a local dump and index."""
+        size = pass_audit.pwned.PwnedFilter.build(self.dump, self.path)
+        self.assertEqual(size, os.path.getsize(self.path))
+
+        index = os.path.join(self.prefix, 'pwned-passwords.idx')
+        pass_audit.pwned.PwnedIndex.build(self.source, index)
+        index = pass_audit.pwned.PwnedIndex(index)
+        path = os.path.join(self.prefix, 'pwned-passwords-index.bloom')
+        pass_audit.pwned.PwnedFilter.build(index, path)
+        with open(self.path, 'rb') as ref, open(path, 'rb') as file:
+            self.assertEqual(ref.read(), file.read())
+
+    def test_build_invalid_rate(self):
+        """Testing: build a filter with an invalid false positive rate."""
+        for rate in [0, 1, 2]:
+            with self.assertRaises(ValueError):
+                pass_audit.pwned.PwnedFilter.build(self.dump, self.path, rate)
+
+    def test_not_a_filter(self):
+        """Testing: open a file that is not a filter."""
+        with self.assertRaises(ValueError):
+            pass_audit.pwned.PwnedFilter(self.source)
+
+    def test_contains(self):
+        """Testing: no false negative and a bounded false positive rate."""
+        pass_audit.pwned.PwnedFilter.build(self.dump, self.path, 0.01)
+        bloom = pass_audit.pwned.PwnedFilter(self.path)
+        for _, bucket in self.dump.password_ranges(self.prefixes):
+            for phash, _ in bucket:
+                self.assertIn(phash, bloom)
+
+        positives = 0
+        for index in range(10000):
+            phash = hashlib.sha1(str(index).encode()).hexdigest()  # nosec
+            positives += phash in bloom
+        self.assertLess(positives, 300)
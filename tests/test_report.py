@@ -0,0 +1,106 @@
+# -*- encoding: utf-8 -*-
+# pass-audit - test suite
+# Copyright (C) 2018-2022 Alexandre PUJOL <alexandre@pujol.io>.
+#
+
+import json
+
+from pass_audit.msg import Msg
+from pass_audit.report import JSONReport, NDJSONReport, Report
+import tests
+
+
+class TestReport(tests.Test):
+    """Test the reports of the findings."""
+    weak = {'score': 1, 'guesses': 1000,
+            'sequence': [{'token': 'secret', 'pattern': 'dictionary'}]}
+
+    def findings(self, report):
+        """Report a finding of every check."""
+        report.finding('breached', 'Password/1', 'secret', 42)
+        report.finding('weak', 'Password/1', 'secret', self.weak)
+        report.finding('duplicated', None, None, ['Password/1', 'Copy/1'])
+        report.finding('similar', None, None, ['Password/1', 'Password/2'])
+        report.unevaluated(['Password/3'])
+        report.summary(4)
+
+    def test_text(self):
+        """Testing: text report."""
+        with tests.captured() as (out, err):
+            self.findings(Report(Msg()))
+        self.assertIn('Password breached: secret from Password/1 has been '
+                      'breached 42 time(s).', out.getvalue())
+        self.assertIn('Score 1 (1000 guesses). This estimate is based on the '
+                      'sequence secret(dictionary)', out.getvalue())
+        self.assertIn('4 passwords tested and 1 breached, 1 weak passwords '
+                      'found, 1 duplicated and 1 similar passwords found.',
+                      err.getvalue())
+
+        with tests.captured() as (out, _):
+            Report(Msg(), passwords=False).finding('breached', 'Password/1',
+                                                   'secret', 42)
+        self.assertIn('the password of Password/1', out.getvalue())
+
+    def test_json(self):
+        """Testing: json report, without the passwords by default."""
+        with tests.captured() as (out, _):
+            self.findings(JSONReport(Msg()))
+        self.assertNotIn('secret', out.getvalue())
+        document = json.loads(out.getvalue())
+        findings = document['findings']
+        self.assertEqual([record['check'] for record in findings],
+                         ['breached', 'weak', 'duplicated', 'similar',
+                          'unevaluated'])
+        self.assertEqual(findings[0]['path'], 'Password/1')
+        self.assertEqual(findings[0]['count'], 42)
+        self.assertEqual(findings[1]['score'], 1)
+        self.assertEqual(findings[1]['patterns'], ['dictionary'])
+        self.assertEqual(findings[2]['paths'], ['Password/1', 'Copy/1'])
+        self.assertEqual(findings[4]['paths'], ['Password/3'])
+        self.assertIn('time', findings[0])
+        self.assertEqual(document['summary']['total'], 4)
+        self.assertEqual(document['summary']['breached'], 1)
+
+        with tests.captured() as (out, _):
+            self.findings(JSONReport(Msg(), passwords=True))
+        findings = json.loads(out.getvalue())['findings']
+        self.assertEqual(findings[0]['password'], 'secret')
+        self.assertEqual(findings[1]['sequence'], ['secret'])
+
+    def test_ndjson(self):
+        """Testing: ndjson report, a record per line."""
+        with tests.captured() as (out, _):
+            report = NDJSONReport(Msg())
+            report.finding('breached', 'Password/1', 'secret', 42)
+            self.assertEqual(json.loads(out.getvalue())['count'], 42)
+            self.findings(report)
+        records = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(len(records), 7)
+        self.assertEqual(records[-1]['check'], 'summary')
+        self.assertEqual(records[-1]['breached'], 2)
+        self.assertNotIn('secret', out.getvalue())
+
+    def test_stats(self):
+        """Testing: report of the time and the counters of the audit."""
+        stats = {'stages': {'decrypt': {'wall': 1.5, 'cpu': 0.25,
+                                        'calls': 3}},
+                 'counters': {'http_requests': 2}}
+        with tests.captured() as (out, _):
+            Report(Msg()).stats(stats)
+        self.assertIn('decrypt          1.500     0.250       3',
+                      out.getvalue())
+        self.assertIn('Counters: http requests: 2', out.getvalue())
+
+        with tests.captured() as (out, _):
+            report = JSONReport(Msg())
+            report.stats(stats)
+            report.summary(3)
+        self.assertEqual(json.loads(out.getvalue())['stats'], stats)
+
+        with tests.captured() as (out, _):
+            report = NDJSONReport(Msg())
+            report.stats(stats)
+            report.summary(3)
+        records = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(records[0], {'check': 'stats', **stats})
+        self.assertEqual(records[1]['check'], 'summary')
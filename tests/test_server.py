@@ -0,0 +1,99 @@
+# -*- encoding: utf-8 -*-
+# pass-audit - test suite
+# Copyright (C) 2018-2022 Alexandre PUJOL <alexandre@pujol.io>.
+#
+
+import os
+import asyncio
+import threading
+from http.client import HTTPConnection
+
+from pass_audit.pwned import PwnedAPI, PwnedCache, PwnedFile
+from pass_audit.server import RangeServer
+from pass_audit.stats import stats
+import tests
+
+
+class TestRangeServer(tests.Test):
+    """Test the local server of the Pwned Passwords ranges."""
+    prefixes = ['00000', '2A0A4', 'FFFFF']
+
+    def setUp(self):
+        """Serve a local dump in a background event loop."""
+        self._tmpdir()
+        path = os.path.join(self.prefix, 'pwned-passwords.txt')
+        tests.pwned_dump(path, self.prefixes)
+        self.source = PwnedFile(path)
+        self.server = RangeServer(self.source)
+        self.loop = asyncio.new_event_loop()
+        self.port = self.loop.run_until_complete(self.server.start(port=0))
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.thread = threading.Thread(target=self.loop.run_forever,
+                                       daemon=True)
+        self.thread.start()
+
+    def tearDown(self):
+        """Stop the server and its event loop."""
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.run_until_complete(self.server.stop())
+        self.loop.close()
+
+    def request(self, method, path, headers=None):
+        """Send a request to the server, get the status and the body."""
+        connection = HTTPConnection('127.0.0.1', self.port, timeout=10)
+        connection.request(method, path, headers=headers or {})
+        response = connection.getresponse()
+        result = response.status, response.read()
+        connection.close()
+        return result
+
+    def test_ranges(self):
+        """Testing: the buckets are the ones of the local dump."""
+        api = PwnedAPI(self.url + '/')
+        self.assertEqual(api.url, self.url)
+        for prefix, bucket in api.password_ranges(self.prefixes + ['12345']):
+            self.assertEqual(bucket, self.source.password_range(prefix))
+        self.assertEqual(len(api.password_range('2A0A4')),
+                         len(tests.PwnedHandler.data))
+        self.assertEqual(len(api.password_range('12345')), 0)
+        self.assertEqual((self.server.hits, self.server.misses), (2, 4))
+
+    def test_concurrent(self):
+        """Testing: a bucket requested at once is only read once."""
+        api = PwnedAPI(self.url, workers=16)
+        prefixes = self.prefixes * 16
+        buckets = dict(api.password_ranges(prefixes))
+        self.assertEqual(len(buckets), len(self.prefixes))
+        self.assertEqual(self.server.hits + self.server.misses, len(prefixes))
+        self.assertEqual(self.server.misses, len(self.prefixes))
+
+    def test_cache(self):
+        """Testing: the cached buckets are revalidated with their ETag."""
+        cache = PwnedCache(os.path.join(self.prefix, 'cache'), ttl=0)
+        api = PwnedAPI(self.url, cache=cache)
+        stats.reset()
+        first = api.password_range('2A0A4')
+        self.assertEqual(api.password_range('2A0A4'), first)
+        counters = stats.asdict()['counters']
+        self.assertEqual(counters['hibp_cache_misses'], 1)
+        self.assertEqual(counters['hibp_cache_hits'], 1)
+
+    def test_eviction(self):
+        """Testing: the least recently used buckets are evicted."""
+        self.server.size = 1
+        api = PwnedAPI(self.url)
+        for prefix in self.prefixes:
+            api.password_range(prefix)
+        self.assertEqual(self.server.used, 0)
+        self.assertEqual(self.server.misses, len(self.prefixes))
+
+    def test_errors(self):
+        """Testing: invalid requests."""
+        status, body = self.request('GET', '/range/2A0A')
+        self.assertEqual(status, 400)
+        self.assertIn(b'not in a valid format', body)
+        self.assertEqual(self.request('GET', '/range/2A0AG')[0], 400)
+        self.assertEqual(self.request('GET', '/')[0], 404)
+        self.assertEqual(self.request('POST', '/range/2A0A4')[0], 405)
+        self.assertEqual(self.request('HEAD', '/range/2a0a4'), (200, b''))
@@ -0,0 +1,145 @@
+# -*- encoding: utf-8 -*-
+# pass-audit - test suite
+# Copyright (C) 2018-2022 Alexandre PUJOL <alexandre@pujol.io>.
+#
+
+import os
+import shutil
+
+from pass_audit.audit import PassAudit
+from pass_audit.passwordstore import PasswordStore
+from pass_audit.state import AuditState
+import tests
+
+
+class TestAuditState(tests.Test):
+    """Test the AuditState class."""
+
+    def setUp(self):
+        """Copy the audit password store in a temporary directory."""
+        self._tmpdir()
+        shutil.copytree(tests.prefix, os.path.join(self.prefix, 'store'))
+        self.store = PasswordStore(os.path.join(self.prefix, 'store'), 'gpg')
+        self.path = os.path.join(self.prefix, 'state.gpg')
+        self.paths = self.store.list('Password')
+        self.data = {path: self.store.show(path) for path in self.paths}
+        audit = PassAudit(self.data, False)
+        self.weak = audit.zxcvbn()
+        self.breached = [(path, self.data[path]['password'], 42)
+                         for path in self.paths if 'pwned' in path]
+
+    def test_default_path(self):
+        """Testing: state in XDG_CACHE_HOME."""
+        state = AuditState(self.store)
+        self.assertTrue(state.path.startswith(os.path.join(
+            os.environ['XDG_CACHE_HOME'], 'pass-audit', 'state')))
+
+    def test_save_load(self):
+        """Testing: the state is encrypted and does not contain passwords."""
+        state = AuditState(self.store, self.path)
+        self.assertFalse(state.load())
+        state.update(self.paths, self.data, self.breached, self.weak)
+        state.save()
+        with open(self.path, 'rb') as file:
+            content = file.read()
+        self.assertNotIn(b'fingerprint', content)
+        self.assertNotIn(self.data['Password/good/1']['password'].encode(),
+                         content)
+
+        loaded = AuditState(self.store, self.path)
+        self.assertTrue(loaded.load())
+        self.assertEqual(loaded.entries, state.entries)
+        self.assertEqual(loaded.salt, state.salt)
+
+        # A state recorded with other checks is not used.
+        loaded = AuditState(self.store, self.path, ['duplicates', 'breach'])
+        self.assertEqual(loaded.checks, ['breach', 'duplicates'])
+        self.assertFalse(loaded.load())
+
+    def test_changed(self):
+        """Testing: only the new or changed entries are audited again."""
+        state = AuditState(self.store, self.path)
+        self.assertEqual(state.changed(self.paths), self.paths)
+        state.update(self.paths, self.data, self.breached, self.weak)
+        self.assertEqual(state.changed(self.paths), [])
+
+        path = os.path.join(self.store.prefix, 'Password/good/1.gpg')
+        os.utime(path, ns=(0, 0))
+        self.assertEqual(state.changed(self.paths), ['Password/good/1'])
+        self.assertEqual(state.changed(self.paths + ['dummy']),
+                         ['Password/good/1', 'dummy'])
+
+    def test_track(self):
+        """Testing: the findings are recorded as the entries are audited."""
+        state = AuditState(self.store, self.path)
+        entries = state.track(self.data.items())
+        path, _ = next(entries)
+        self.assertEqual(list(state.entries.keys()), [path])
+        state.found('breached', path, 42)
+        state.found('weak', path, {'score': 1, 'guesses': 1000})
+        self.assertEqual(state.breached([path]), [(path, None, 42)])
+        self.assertEqual(state.weak([path]),
+                         [(path, None, {'score': 1, 'guesses': 1000.0})])
+        list(entries)
+        self.assertEqual(list(state.entries.keys()), self.paths)
+        os.remove(self.store.passfile(path))
+        state.prune(self.paths[1:])
+        self.assertEqual(list(state.entries.keys()), self.paths[1:])
+        self.assertEqual(state.breached([path]), [])
+
+    def test_prune(self):
+        """Testing: the entries of the other pass-names are kept."""
+        state = AuditState(self.store, self.path)
+        state.update(self.paths, self.data, self.breached, self.weak)
+        good = [path for path in self.paths if 'good' in path]
+        state.update(good, {}, [], [])
+        self.assertEqual(list(state.entries.keys()), self.paths)
+        os.remove(self.store.passfile(good[0]))
+        state.update(good[1:], {}, [], [])
+        self.assertEqual(list(state.entries.keys()),
+                         [path for path in self.paths if path != good[0]])
+
+    def test_unevaluated(self):
+        """Testing: the passwords not evaluated are recorded."""
+        state = AuditState(self.store, self.path)
+        state.update(self.paths, self.data, self.breached, self.weak)
+        path = self.paths[0]
+        self.assertEqual(state.unevaluated(self.paths), [])
+        state.found('unevaluated', path, None)
+        self.assertEqual(state.unevaluated(self.paths), [path])
+        state.update(self.paths, {path: self.data[path]}, [], [])
+        self.assertEqual(state.unevaluated(self.paths), [])
+
+    @tests.salted()
+    def test_findings(self):
+        """Testing: the previous findings are kept for unchanged entries."""
+        state = AuditState(self.store, self.path)
+        state.update(self.paths, self.data, self.breached, self.weak)
+        breached = state.breached(self.paths)
+        self.assertEqual(breached, [(path, None, count)
+                                    for path, _, count in self.breached])
+        weak = state.weak(self.paths)
+        self.assertEqual([path for path, _, _ in weak],
+                         [path for path, _, _ in self.weak])
+        for (_, _, details), (_, _, ref) in zip(weak, self.weak):
+            self.assertEqual(details['score'], ref['score'])
+        self.assertEqual(state.duplicates(), [])
+
+        # A new duplicate of an unchanged entry is found.
+        path = 'Password/good/copy'
+        data = {path: self.data['Password/good/1']}
+        shutil.copy(os.path.join(self.store.prefix, 'Password/good/1.gpg'),
+                    os.path.join(self.store.prefix, path + '.gpg'))
+        state.update(self.paths + [path], data, [], [])
+        self.assertEqual(state.duplicates(), [['Password/good/1', path]])
+        self.assertEqual(state.similar(),
+                         [['Password/pwned/2', 'Password/pwned/3']])
+
+        # The duplicates are only searched in the audited paths.
+        self.assertEqual(state.duplicates(self.paths), [])
+
+        # Removed entries are forgotten.
+        os.remove(self.store.passfile(self.paths[0]))
+        state.update(self.paths[1:], {}, [], [])
+        self.assertEqual(list(state.entries.keys()),
+                         self.paths[1:] + [path])
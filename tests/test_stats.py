@@ -0,0 +1,63 @@
+# -*- encoding: utf-8 -*-
+# pass-audit - test suite
+# Copyright (C) 2018-2022 Alexandre PUJOL <alexandre@pujol.io>.
+#
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import pass_audit.stats
+from pass_audit.passwordstore import PasswordStore
+from pass_audit.stats import Stats, stats
+import tests
+
+
+class TestStats(tests.Test):
+    """Test the Stats class."""
+
+    def test_stage(self):
+        """Testing: time of the stages, summed over the threads."""
+        data = Stats()
+
+        def sleep(_):
+            with data.stage('decrypt'):
+                time.sleep(0.05)
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(sleep, range(4)))
+        result = data.asdict()
+        self.assertEqual(result['stages']['decrypt']['calls'], 4)
+        self.assertGreaterEqual(result['stages']['decrypt']['wall'], 0.2)
+        self.assertLess(result['stages']['decrypt']['cpu'], 0.1)
+        self.assertEqual(result['stages']['hibp']['calls'], 0)
+
+        data.reset()
+        self.assertEqual(data.asdict()['stages']['decrypt']['calls'], 0)
+
+    def test_count(self):
+        """Testing: counters of the audit."""
+        data = Stats()
+        data.count('http_requests')
+        data.count('http_bytes', 1024)
+        counters = data.asdict()['counters']
+        self.assertEqual(counters['http_requests'], 1)
+        self.assertEqual(counters['http_bytes'], 1024)
+        self.assertEqual(counters['subprocesses'], 0)
+
+    def test_subprocesses(self):
+        """Testing: the password store counts its subprocesses."""
+        store = PasswordStore(tests.prefix, 'gpg')
+        stats.reset()
+        store.show('Password/good/1')
+        result = stats.asdict()
+        self.assertEqual(result['counters']['subprocesses'], 1)
+        self.assertEqual(result['stages']['decrypt']['calls'], 1)
+        self.assertGreater(result['counters']['subprocesses_cpu'], 0)
+
+    def test_subprocesses_unknown(self):
+        """Testing: the CPU time of the subprocesses is unknown on Windows."""
+        with mock.patch.object(pass_audit.stats, 'RESOURCE', False):
+            data = Stats()
+            self.assertEqual(data.asdict()['counters']['subprocesses_cpu'],
+                             0)